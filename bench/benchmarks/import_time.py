@@ -0,0 +1,13 @@
+class ImportTime(object):
+  """Times the imports of metric_learn in a fresh interpreter: algorithms
+  are only imported when accessed, so that short-lived processes which only
+  need to embed points start fast."""
+
+  def timeraw_import_metric_learn(self):
+    return "import metric_learn"
+
+  def timeraw_import_inference_model(self):
+    return "from metric_learn import load_inference_model"
+
+  def timeraw_import_all(self):
+    return "from metric_learn import *"
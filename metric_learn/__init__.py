@@ -1,15 +1,65 @@
 from __future__ import absolute_import
 
-from .constraints import Constraints
-from .covariance import Covariance
-from .itml import ITML, ITML_Supervised
-from .lmnn import LMNN
-from .lsml import LSML, LSML_Supervised
-from .sdml import SDML, SDML_Supervised
-from .nca import NCA
-from .lfda import LFDA
-from .rca import RCA, RCA_Supervised
-from .mlkr import MLKR
-from .mmc import MMC, MMC_Supervised
+import sys
+from importlib import import_module
 
 from ._version import __version__
+
+# the submodule defining each public name: submodules are only imported when
+# one of their names is first accessed, so that importing metric_learn is
+# fast and does not load the algorithms (and their dependencies) not used
+_SUBMODULES = {
+    'InferenceModel': 'base_metric',
+    'load_inference_model': 'base_metric',
+    'MahalanobisMetric': 'base_metric',
+    'QuantizedModel': 'base_metric',
+    'config_context': '_config',
+    'get_config': '_config',
+    'record_copies': '_config',
+    'set_config': '_config',
+    'Constraints': 'constraints',
+    'Covariance': 'covariance',
+    'ITML': 'itml',
+    'ITML_Supervised': 'itml',
+    'LMNN': 'lmnn',
+    'LSML': 'lsml',
+    'LSML_Supervised': 'lsml',
+    'SDML': 'sdml',
+    'SDML_Supervised': 'sdml',
+    'NCA': 'nca',
+    'LFDA': 'lfda',
+    'RCA': 'rca',
+    'RCA_Supervised': 'rca',
+    'MLKR': 'mlkr',
+    'MMC': 'mmc',
+    'MMC_Supervised': 'mmc',
+    'LSHIndex': 'lsh',
+    'MetricKNeighborsClassifier': 'neighbors',
+    'MetricKNeighborsRegressor': 'neighbors',
+    'PQIndex': 'pq',
+    'CachedPreprocessor': 'preprocessor',
+}
+
+__all__ = sorted(_SUBMODULES) + ['__version__']
+
+
+def _import_name(name):
+  value = getattr(import_module('.' + _SUBMODULES[name], __name__), name)
+  globals()[name] = value
+  return value
+
+
+if sys.version_info >= (3, 7):
+  def __getattr__(name):
+    if name not in _SUBMODULES:
+      raise AttributeError("module {!r} has no attribute {!r}"
+                           .format(__name__, name))
+    return _import_name(name)
+
+  def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
+else:
+  # module-level __getattr__ (PEP 562) is not supported: import everything
+  for _name in _SUBMODULES:
+    _import_name(_name)
+  del _name
@@ -0,0 +1,131 @@
+"""Global configuration of metric-learn, like scikit-learn's"""
+import threading
+from contextlib import contextmanager
+
+_global_config = {
+    'assume_valid': False,
+    'assume_finite': False,
+    'copy': 'allow',
+}
+# every thread has its own configuration, starting from the defaults above,
+# so that a `config_context` in a thread does not affect the computations
+# running at the same time in other threads
+_threadlocal = threading.local()
+
+# the lists of the active `record_copies` contexts
+_copy_recorders = []
+
+
+def _get_threadlocal_config():
+  """Returns the configuration of the current thread."""
+  if not hasattr(_threadlocal, 'global_config'):
+    _threadlocal.global_config = _global_config.copy()
+  return _threadlocal.global_config
+
+
+def get_config():
+  """Returns the current values of the configuration of metric-learn, in
+  the current thread.
+
+  Returns
+  -------
+  config : dict
+    Keys are the parameter names that can be passed to `set_config`.
+  """
+  return _get_threadlocal_config().copy()
+
+
+def set_config(assume_valid=None, assume_finite=None, copy=None):
+  """Sets the configuration of metric-learn, for the current thread (the
+  threads started by metric-learn, see the `n_jobs` parameter of the metric
+  learners, use the configuration of the thread which started them).
+
+  Parameters
+  ----------
+  assume_valid : bool or None, optional (default=None)
+    If True, the inputs of the inference methods of the metric learners
+    (`transform`, `score_pairs`, `predict`, `decision_function`...) which are
+    already C-contiguous float numpy arrays of the expected number of
+    dimensions are used as they are, without going through the validation
+    of scikit-learn's `check_array`, which is costly compared to the
+    computations on small batches. If None, the current value is kept.
+    Global default: False.
+
+  assume_finite : bool or None, optional (default=None)
+    If True, the inputs of the metric learners are not checked for NaN or
+    infinite values: computations on such values then silently return NaN
+    or infinite values. If None, the current value is kept. Global default:
+    False.
+
+  copy : {'allow', 'never'} or None, optional (default=None)
+    If 'never', converting input data to the dtype, memory layout or sparse
+    format expected by metric-learn raises a
+    :class:`metric_learn.exceptions.CopyError` instead of copying it, which
+    the caller can avoid by giving data in the expected format (gathering
+    points or tuples from a preprocessor, which always copies them, is only
+    recorded by `record_copies`). If None, the current value is kept.
+    Global default: 'allow'.
+  """
+  if copy is not None and copy not in ('allow', 'never'):
+    raise ValueError("Expected copy to be 'allow' or 'never', but copy={!r}."
+                     .format(copy))
+  local_config = _get_threadlocal_config()
+  if assume_valid is not None:
+    local_config['assume_valid'] = assume_valid
+  if assume_finite is not None:
+    local_config['assume_finite'] = assume_finite
+  if copy is not None:
+    local_config['copy'] = copy
+
+
+@contextmanager
+def config_context(**new_config):
+  """Context manager for the configuration of metric-learn, in the current
+  thread.
+
+  Parameters
+  ----------
+  **new_config
+    The parameters of `set_config` to set within the context.
+
+  Examples
+  --------
+  >>> import metric_learn
+  >>> with metric_learn.config_context(assume_valid=True,
+  ...                                  assume_finite=True):
+  ...     scores = nca.score_pairs(pairs)  # doctest: +SKIP
+  """
+  old_config = get_config()
+  set_config(**new_config)
+  try:
+    yield
+  finally:
+    set_config(**old_config)
+
+
+@contextmanager
+def record_copies():
+  """Context manager recording the copies of input data made by metric-learn
+  along the input pipeline (validation, conversion, and forming of points and
+  tuples from preprocessors), in all the threads.
+
+  Yields
+  ------
+  records : list of dict
+    The list to which a dict is appended for every copy, with the keys
+    ``'site'`` (the metric-learn function making the copy), ``'caller'``
+    (the ``'file:line'`` of the innermost call outside of metric-learn),
+    ``'nbytes'``, ``'shape'`` and ``'dtype'`` (of the copy).
+
+  Examples
+  --------
+  >>> with metric_learn.record_copies() as records:
+  ...     nca.score_pairs(indices_of_pairs)  # doctest: +SKIP
+  >>> sum(record['nbytes'] for record in records)  # doctest: +SKIP
+  """
+  records = []
+  _copy_recorders.append(records)
+  try:
+    yield records
+  finally:
+    _copy_recorders.remove(records)
@@ -1,8 +1,12 @@
+import os
+import traceback
 import numpy as np
+import scipy.sparse as sp
 import six
-from sklearn.utils import check_array
+from sklearn.utils import assert_all_finite, check_array, gen_batches
 from sklearn.utils.validation import check_X_y
-from metric_learn.exceptions import PreprocessorError
+from metric_learn.exceptions import CopyError, PreprocessorError
+from metric_learn._config import get_config, _copy_recorders
 
 # hack around lack of axis kwarg in older numpy versions
 try:
@@ -104,6 +108,22 @@ def check_input(input_data, y=None, preprocessor=None,
 
   context = make_context(estimator)
 
+  if get_config()['assume_finite']:
+    force_all_finite = False
+  if y is None and type_of_inputs in ('classic', 'tuples'):
+    # under assume_valid, inputs that the checks below would return unchanged
+    # are returned right away
+    trusted_data = trusted_array(input_data,
+                                 2 if type_of_inputs == 'classic' else 3,
+                                 dtype=dtype, order=order, copy=copy,
+                                 force_all_finite=force_all_finite,
+                                 ensure_min_samples=ensure_min_samples,
+                                 ensure_min_features=ensure_min_features)
+    if trusted_data is not None:
+      if type_of_inputs == 'tuples':
+        check_tuple_size(trusted_data, tuple_size, context)
+      return trusted_data
+
   args_for_sk_checks = dict(accept_sparse=accept_sparse,
                             dtype=dtype, order=order,
                             copy=copy, force_all_finite=force_all_finite,
@@ -142,6 +162,112 @@ def check_input(input_data, y=None, preprocessor=None,
   return input_data if y is None else (input_data, y)
 
 
+def trusted_array(X, ndim, dtype='numeric', order=None, copy=False,
+                  force_all_finite=True, ensure_min_samples=1,
+                  ensure_min_features=1):
+  """Returns `X` unchecked if ``assume_valid`` is set (see
+  `metric_learn.config_context`) and `X` is a C-contiguous float numpy array
+  with `ndim` dimensions that `check_array` would return unchanged with these
+  arguments, or None otherwise. Only the finiteness of `X` is checked, if
+  `force_all_finite` is not False."""
+  if (not get_config()['assume_valid'] or not isinstance(X, np.ndarray) or
+          isinstance(X, np.matrix) or X.ndim != ndim or X.dtype.kind != 'f' or
+          not X.flags.c_contiguous or copy or order not in (None, 'C') or
+          X.shape[0] < ensure_min_samples or
+          X.shape[-1] < ensure_min_features):
+    return None
+  if converts_dtype(X.dtype, dtype):
+    return None
+  if force_all_finite:
+    assert_all_finite(X, allow_nan=force_all_finite == 'allow-nan')
+  return X
+
+
+def converts_dtype(array_dtype, dtype):
+  """Returns True if `check_array` converts arrays of dtype `array_dtype` to
+  the requested `dtype`."""
+  if dtype is None:
+    return False
+  if isinstance(dtype, six.string_types) and dtype == 'numeric':
+    return array_dtype.kind == 'O'
+  if isinstance(dtype, (list, tuple)):
+    return array_dtype not in dtype
+  return array_dtype != np.dtype(dtype)
+
+
+def check_zero_copy(X, site, accept_sparse=False, dtype='numeric',
+                    order=None, copy=False):
+  """Raises a `CopyError` if copies are forbidden (``copy='never'``, see
+  `metric_learn.set_config`) and `check_array` would copy the array `X` to
+  convert it with these arguments (copies requested with `copy` are
+  allowed)."""
+  if get_config()['copy'] != 'never' or copy:
+    return
+  conversion = None
+  if sp.issparse(X):
+    if isinstance(accept_sparse, six.string_types):
+      accept_sparse = [accept_sparse]
+    if (isinstance(accept_sparse, (list, tuple)) and
+            X.format not in accept_sparse):
+      conversion = 'to the sparse format {}'.format(accept_sparse[0])
+  elif isinstance(X, np.ndarray):
+    if ((order == 'C' and not X.flags.c_contiguous) or
+            (order == 'F' and not X.flags.f_contiguous)):
+      conversion = 'to a {}-contiguous array'.format(order)
+  else:
+    return
+  if conversion is None and converts_dtype(X.dtype, dtype):
+    conversion = 'to the dtype {}'.format(dtype)
+  if conversion is not None:
+    raise CopyError("{} would copy an array of shape {} and dtype {} ({} "
+                    "bytes) to convert it {}, but copy='never' is set."
+                    .format(site, X.shape, X.dtype, array_nbytes(X),
+                            conversion))
+
+
+def record_copy(result, site, source=None):
+  """Records that the array `result` has been copied from the array `source`
+  (if given) at `site`, if copies are recorded (see
+  `metric_learn.record_copies`). Nothing is recorded if `result` is not a
+  copy, i.e. if it shares memory with `source`."""
+  if not _copy_recorders or source is result:
+    return
+  if source is not None:
+    if sp.issparse(source) and sp.issparse(result):
+      source, result_data = source.data, result.data
+    else:
+      result_data = result
+    if (isinstance(source, np.ndarray) and
+            isinstance(result_data, np.ndarray) and
+            np.may_share_memory(source, result_data)):
+      return
+  record = {'site': site, 'caller': _outer_caller(),
+            'nbytes': array_nbytes(result), 'shape': np.shape(result),
+            'dtype': getattr(result, 'dtype', None)}
+  for records in list(_copy_recorders):
+    records.append(record)
+
+
+def array_nbytes(X):
+  """Returns the number of bytes of a dense or sparse array."""
+  if sp.issparse(X):
+    return sum(getattr(X, name).nbytes for name in
+               ('data', 'indices', 'indptr', 'row', 'col', 'offsets')
+               if hasattr(X, name))
+  return np.asarray(X).nbytes
+
+
+def _outer_caller():
+  """Returns the ``'file:line'`` of the innermost frame of the stack outside
+  of metric-learn."""
+  package_dir = os.path.dirname(os.path.abspath(__file__)) + os.sep
+  for frame in reversed(traceback.extract_stack()):
+    filename, lineno = frame[0], frame[1]
+    if not os.path.abspath(filename).startswith(package_dir):
+      return '{}:{}'.format(filename, lineno)
+  return None
+
+
 def check_input_tuples(input_data, context, preprocessor, args_for_sk_checks,
                        tuple_size):
   preprocessor_has_been_applied = False
@@ -158,8 +284,8 @@ def check_input_tuples(input_data, context, preprocessor, args_for_sk_checks,
       make_error_input(420, input_data, context)
     else:
       make_error_input(200, input_data, context)
-  input_data = check_array(input_data, allow_nd=True, ensure_2d=False,
-                           **args_for_sk_checks)
+  input_data = checked_array(input_data, 'check_input', allow_nd=True,
+                             ensure_2d=False, **args_for_sk_checks)
   # we need to check num_features because check_array does not check it
   # for 3D inputs:
   if args_for_sk_checks['ensure_min_features'] > 0:
@@ -198,8 +324,8 @@ def check_input_classic(input_data, context, preprocessor, args_for_sk_checks):
     else:
       make_error_input(100, input_data, context)
 
-  input_data = check_array(input_data, allow_nd=True, ensure_2d=False,
-                           **args_for_sk_checks)
+  input_data = checked_array(input_data, 'check_input', allow_nd=True,
+                             ensure_2d=False, **args_for_sk_checks)
   if input_data.ndim != 2:
     # we have to ensure this because check_array above does not
     if preprocessor_has_been_applied:
@@ -209,6 +335,18 @@ def check_input_classic(input_data, context, preprocessor, args_for_sk_checks):
   return input_data
 
 
+def checked_array(X, site, **kwargs):
+  """Calls `check_array` on `X` with the given arguments, raising instead if
+  copies are forbidden and it would copy `X`, and recording the copy if
+  copies are recorded."""
+  check_zero_copy(X, site, **{name: kwargs[name] for name in
+                              ('accept_sparse', 'dtype', 'order', 'copy')
+                              if name in kwargs})
+  X_checked = check_array(X, **kwargs)
+  record_copy(X_checked, site, source=X)
+  return X_checked
+
+
 def make_error_input(code, input_data, context):
   code_str = {'expected_input': {'1': '2D array of formed points',
                                  '2': '3D array of formed tuples',
@@ -239,14 +377,118 @@ def make_error_input(code, input_data, context):
 
 
 def preprocess_tuples(tuples, preprocessor):
+  """form tuples with the preprocessor, calling it only once on every
+  distinct indicator when possible"""
+  unique = unique_indicators(tuples)
+  if unique is not None:
+    indicators, inverse = unique
+    points = preprocess_points(indicators, preprocessor)
+    shape = np.shape(points)
+    if (not sp.issparse(points) and len(shape) > 0 and
+            shape[0] == indicators.shape[0]):
+      tuples = np.asarray(points)[inverse]
+      record_copy(tuples, 'preprocess_tuples', source=points)
+      return tuples
+  # indicators that cannot be sorted, or preprocessors that do not return one
+  # point per indicator, are applied on every column of the tuples instead
   try:
     tuples = np.column_stack([preprocessor(tuples[:, i])[:, np.newaxis] for
                               i in range(tuples.shape[1])])
   except Exception as e:
     raise PreprocessorError(e)
+  record_copy(tuples, 'preprocess_tuples')
   return tuples
 
 
+def unique_indicators(indicators):
+  """Returns the sorted distinct values of an array of indicators, and the
+  array of the positions of each indicator in these values (with the same
+  shape as `indicators`), or None if the indicators cannot be sorted."""
+  indicators = np.asarray(indicators)
+  try:
+    uniques, inverse = np.unique(indicators, return_inverse=True)
+  except TypeError:
+    return None
+  return uniques, inverse.reshape(indicators.shape)
+
+
+def check_tuples_unique(input_data, preprocessor=None, tuple_size=None,
+                        accept_sparse=False, dtype='numeric', estimator=None):
+  """Checks tuples like `check_input` with ``type_of_inputs='tuples'``, but
+  if tuples are given as indicators, forms every distinct point only once
+  instead of forming the 3D array of tuples.
+
+  Parameters
+  ----------
+  input_data : array-like
+    The tuples to check: a 3D array of formed tuples, or a 2D array of
+    indicators of tuples if a preprocessor is given.
+
+  preprocessor : callable (default=`None`)
+    The preprocessor to use. If None, no preprocessor is used.
+
+  tuple_size : int
+    The number of elements in a tuple (e.g. 2 for pairs).
+
+  accept_sparse : `bool`, str or list of str
+    Set to true to allow sparse formed points, or to the accepted sparse
+    formats (see `sklearn.utils.check_array`).
+
+  dtype : string, type, list of types or None (default='numeric')
+    Data type of the formed points (see `check_input`).
+
+  estimator : str or estimator instance (default=`None`)
+    If passed, include the name of the estimator in warning messages.
+
+  Returns
+  -------
+  points : `numpy.ndarray`
+    The checked distinct points, of shape (n_unique_points, n_features), if
+    the input was indicators, or the checked 3D array of formed tuples
+    otherwise.
+
+  inverse : `numpy.ndarray` or None
+    The array of shape (n_tuples, tuple_size) of the positions in `points` of
+    the elements of every tuple, or None if the input was formed tuples.
+  """
+  def check_formed_tuples():
+    # also used to raise the appropriate error on invalid inputs
+    return check_input(input_data, type_of_inputs='tuples',
+                       preprocessor=preprocessor, tuple_size=tuple_size,
+                       accept_sparse=accept_sparse, dtype=dtype,
+                       estimator=estimator), None
+
+  if not (get_config()['assume_valid'] and
+          isinstance(input_data, np.ndarray)):
+    input_data = check_array(input_data, ensure_2d=False, allow_nd=True,
+                             copy=False, force_all_finite=False,
+                             accept_sparse=True, dtype=None,
+                             ensure_min_features=0, ensure_min_samples=0)
+  if (preprocessor is None or input_data.ndim != 2 or
+          input_data.shape[0] == 0 or
+          (tuple_size is not None and input_data.shape[1] != tuple_size)):
+    return check_formed_tuples()
+  unique = unique_indicators(input_data)
+  if unique is None:
+    return check_formed_tuples()
+  indicators, inverse = unique
+  points = preprocess_points(indicators, preprocessor)
+  force_all_finite = not get_config()['assume_finite']
+  try:
+    trusted_points = trusted_array(points, 2, dtype=dtype,
+                                   force_all_finite=force_all_finite)
+    points = (trusted_points if trusted_points is not None else
+              checked_array(points, 'check_tuples_unique',
+                            accept_sparse=accept_sparse, dtype=dtype,
+                            force_all_finite=force_all_finite,
+                            warn_on_dtype=False, estimator=estimator))
+  except ValueError:
+    return check_formed_tuples()
+  if points.shape[0] != indicators.shape[0]:
+    return check_formed_tuples()
+  return points, inverse
+
+
 def preprocess_points(points, preprocessor):
   """form points if there is a preprocessor else keep them as such (assumes
   that check_points has already been called)"""
@@ -296,24 +538,83 @@ def check_tuple_size(tuples, tuple_size, context):
 
 
 class ArrayIndexer:
+  """Forms points from indices in an array-like preprocessor.
+
+  The array can be a `numpy.memmap`, or the path of a ``.npy`` file, which is
+  then memory-mapped in read-only mode: only the rows gathered are read from
+  the disk, in increasing order of their indices, and only them are checked
+  (by `check_input`, on the points formed).
+  """
 
   def __init__(self, X):
-    # we check the array-like preprocessor here, and we as much permissive
-    # as possible (because the user will check for the desired
-    # format with arguments in check_input, and only this latter function
-    # should return the appropriate errors). We do this only to have a numpy
-    # array object which can be indexed by another numpy array object.
-    X = check_array(X,
-                    accept_sparse=True, dtype=None,
-                    force_all_finite=False,
-                    ensure_2d=False, allow_nd=True,
-                    ensure_min_samples=0,
-                    ensure_min_features=0,
-                    warn_on_dtype=False, estimator=None)
+    if isinstance(X, six.string_types):
+      X = np.load(X, mmap_mode='r')
+    if not isinstance(X, np.memmap):
+      # we check the array-like preprocessor here, and we as much permissive
+      # as possible (because the user will check for the desired
+      # format with arguments in check_input, and only this latter function
+      # should return the appropriate errors). We do this only to have a
+      # numpy array object which can be indexed by another numpy array
+      # object (subclasses of numpy arrays, like `numpy.matrix`, are
+      # converted to numpy arrays). Memory-mapped arrays are kept as they
+      # are, so that they are neither copied nor read in full.
+      X = check_array(X,
+                      accept_sparse=True, dtype=None,
+                      force_all_finite=False,
+                      ensure_2d=False, allow_nd=True,
+                      ensure_min_samples=0,
+                      ensure_min_features=0,
+                      warn_on_dtype=False, estimator=None)
     self.X = X
 
   def __call__(self, indices):
-    return self.X[indices]
+    if isinstance(self.X, np.memmap):
+      points = _sorted_gather(self.X, indices)
+    else:
+      points = self.X[indices]
+    record_copy(points, 'ArrayIndexer', source=self.X)
+    return points
+
+
+def _sorted_gather(X, indices):
+  """Gathers the rows of a memory-mapped array at the given indices,
+  reading every distinct row once and in increasing order of the indices
+  (i.e. sequentially on the disk)."""
+  indices = np.asarray(indices)
+  if indices.dtype.kind not in 'iu':
+    # boolean masks already read the rows in order
+    return np.asarray(X[indices])
+  unique_indices, inverse = np.unique(indices, return_inverse=True)
+  return (np.asarray(X[unique_indices])[inverse]
+          .reshape(indices.shape + X.shape[1:]))
+
+
+def top_k_by_blocks(block_distances, n_queries, n_gallery, k,
+                    gallery_batch_size):
+  """Returns the `k` smallest distances between queries and gallery
+  points, in increasing order, and the indices of these gallery points, both
+  of shape (n_queries, k).
+
+  `block_distances` is a callable returning the distances between all the
+  queries and the gallery points of a slice, of shape (n_queries,
+  slice_size). It is called for consecutive slices of `gallery_batch_size`
+  points, and only the `k` best candidates found so far are kept for every
+  query, so that the distances to the whole gallery are never stored.
+  """
+  rows = np.arange(n_queries)[:, np.newaxis]
+  best_dist = np.empty((n_queries, 0))
+  best_ind = np.empty((n_queries, 0), dtype=np.intp)
+  for gallery_sl in gen_batches(n_gallery, gallery_batch_size):
+    dist = block_distances(gallery_sl)
+    best_dist = np.hstack([best_dist, dist])
+    best_ind = np.hstack([best_ind, np.tile(np.arange(gallery_sl.start,
+                                                      gallery_sl.stop),
+                                            (n_queries, 1))])
+    if k < best_dist.shape[1]:
+      best = np.argpartition(best_dist, k - 1, axis=1)[:, :k]
+      best_dist, best_ind = best_dist[rows, best], best_ind[rows, best]
+  order = np.argsort(best_dist, axis=1)
+  return best_dist[rows, order], best_ind[rows, order]
 
 
 def check_collapsed_pairs(pairs):
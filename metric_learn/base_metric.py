@@ -1,27 +1,75 @@
-from numpy.linalg import cholesky
-from scipy.spatial.distance import euclidean
 from sklearn.base import BaseEstimator
 from sklearn.utils.validation import _is_arraylike
-from sklearn.metrics import roc_auc_score
+from sklearn.utils import (check_array, gen_batches, gen_even_slices,
+                           get_chunk_n_rows)
+from sklearn.utils.extmath import row_norms
+from sklearn.utils.validation import check_is_fitted
 import numpy as np
+import scipy.sparse as sp
 from abc import ABCMeta, abstractmethod
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import json
+import os
+import threading
 import six
-from ._util import ArrayIndexer, check_input, validate_vector
+from ._config import config_context, get_config
+from ._util import (ArrayIndexer, check_input, check_tuples_unique,
+                    top_k_by_blocks, validate_vector, make_context)
+from ._version import __version__
 import warnings
+# (sklearn.metrics and sklearn.neighbors are slow to import and not needed to
+# embed or score points, so they are imported by the functions using them)
+
+# version of the layout written by `export_inference_model`
+_INFERENCE_FORMAT_VERSION = 1
+
+# number of integers of a quantized transformation upcast at once by
+# `_integer_dot`
+_INTEGER_BLOCK_SIZE = 2 ** 16
+
+# pools of threads of `_map_row_blocks`, by process and number of threads
+# (see `_get_thread_pool`)
+_THREAD_POOLS = {}
+_THREAD_POOLS_LOCK = threading.Lock()
 
 
 class BaseMetricLearner(six.with_metaclass(ABCMeta, BaseEstimator)):
 
-  def __init__(self, preprocessor=None):
+  def __init__(self, preprocessor=None, cache_embedding=False,
+               inference_dtype=None, n_jobs=None):
     """
 
     Parameters
     ----------
-    preprocessor : array-like, shape=(n_samples, n_features) or callable
+    preprocessor : array-like, shape=(n_samples, n_features), str or callable
       The preprocessor to call to get tuples from indices. If array-like,
-      tuples will be gotten like this: X[indices].
+      tuples will be gotten like this: X[indices]. If str, the path of a
+      ``.npy`` file, which is memory-mapped: only the rows of the indices
+      are read (and checked).
+
+    cache_embedding : bool, optional (default=False)
+      If True and the preprocessor is array-like, metric learners that embed
+      points (see :class:`MahalanobisMixin`) compute the embedding of all its
+      points once, the first time it is needed after fitting, and look
+      indicators of points up in it instead of embedding them again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+      If not None, for instance ``np.float32``, metric learners that embed
+      points (see :class:`MahalanobisMixin`) convert the points to embed to
+      this dtype, and embed them with a copy of their transformation in this
+      dtype.
+
+    n_jobs : int or None, optional (default=None)
+      The number of threads used by metric learners that embed points (see
+      :class:`MahalanobisMixin`) to embed or score inputs: the inputs are
+      split into as many blocks of rows, which are processed in parallel.
+      ``None`` means 1 and ``-1`` means using all processors.
     """
     self.preprocessor = preprocessor
+    self.cache_embedding = cache_embedding
+    self.inference_dtype = inference_dtype
+    self.n_jobs = n_jobs
 
   @abstractmethod
   def score_pairs(self, pairs):
@@ -49,14 +97,17 @@ class BaseMetricLearner(six.with_metaclass(ABCMeta, BaseEstimator)):
 
   def check_preprocessor(self):
     """Initializes the preprocessor"""
-    if _is_arraylike(self.preprocessor):
+    if (isinstance(self.preprocessor, six.string_types) or
+            _is_arraylike(self.preprocessor)):
+      # (a string is the path of a .npy file, memory-mapped by ArrayIndexer)
       self.preprocessor_ = ArrayIndexer(self.preprocessor)
     elif callable(self.preprocessor) or self.preprocessor is None:
       self.preprocessor_ = self.preprocessor
     else:
       raise ValueError("Invalid type for the preprocessor: {}. You should "
                        "provide either None, an array-like object, "
-                       "or a callable.".format(type(self.preprocessor)))
+                       "the path of a .npy file, or a callable."
+                       .format(type(self.preprocessor)))
 
   def _prepare_inputs(self, X, y=None, type_of_inputs='classic',
                       **kwargs):
@@ -89,6 +140,11 @@ class BaseMetricLearner(six.with_metaclass(ABCMeta, BaseEstimator)):
       The checked input labels array.
     """
     self.check_preprocessor()
+    # the state derived from the fit by the inference methods is cached in
+    # this dict (see `MahalanobisMixin._get_cached`), which is created here
+    # since the inference methods must not change the attributes of the
+    # metric learner
+    self._inference_cache = {}
     return check_input(X, y,
                        type_of_inputs=type_of_inputs,
                        preprocessor=self.preprocessor_,
@@ -97,7 +153,7 @@ class BaseMetricLearner(six.with_metaclass(ABCMeta, BaseEstimator)):
                        **kwargs)
 
   @abstractmethod
-  def get_metric(self):
+  def get_metric(self, batched=False):
     """Returns a function that takes as input two 1D arrays and outputs the
     learned metric score on these two points.
 
@@ -106,6 +162,14 @@ class BaseMetricLearner(six.with_metaclass(ABCMeta, BaseEstimator)):
     and it can be directly plugged into the `metric` argument of
     scikit-learn's estimators.
 
+    Parameters
+    ----------
+    batched : `bool`, optional (default=False)
+      If True, the returned function is a `MahalanobisMetric` object, which
+      can also compute the scores between many points at once (see
+      `MahalanobisMetric.pairwise` and `MahalanobisMetric.paired`), and can
+      be pickled. Only supported by Mahalanobis metric learners.
+
     Returns
     -------
     metric_fun : function
@@ -176,6 +240,32 @@ class MahalanobisMixin(six.with_metaclass(ABCMeta, BaseMetricLearner,
       The learned linear transformation ``L``.
   """
 
+  @property
+  def transformer_(self):
+    # a diagonal transformation is stored as its diagonal (see
+    # `_set_diagonal`), and the dense matrix is only built, once per fit, if
+    # it is accessed
+    if '_diagonal' in self.__dict__:
+      return self._get_cached('transformer', (self._diagonal,),
+                              lambda: np.diag(self._diagonal))
+    if '_transformer' not in self.__dict__:
+      raise AttributeError("'{}' object has no attribute 'transformer_'"
+                           .format(type(self).__name__))
+    return self._transformer
+
+  @transformer_.setter
+  def transformer_(self, transformer):
+    self.__dict__.pop('_diagonal', None)
+    self._transformer = transformer
+
+  def _set_diagonal(self, scaling):
+    """Sets the learned transformation to the diagonal matrix whose diagonal
+    is the vector `scaling`. Only this vector is stored: points are embedded
+    by scaling their features, in O(d) per point instead of O(d^2), and
+    ``transformer_`` is only built if it is accessed."""
+    self.__dict__.pop('_transformer', None)
+    self._diagonal = scaling
+
   def score_pairs(self, pairs):
     """Returns the learned Mahalanobis distance between pairs.
 
@@ -210,13 +300,85 @@ class MahalanobisMixin(six.with_metaclass(ABCMeta, BaseMetricLearner,
     :ref:`mahalanobis_distances` : The section of the project documentation
       that describes Mahalanobis Distances.
     """
-    pairs = check_input(pairs, type_of_inputs='tuples',
-                        preprocessor=self.preprocessor_,
-                        estimator=self, tuple_size=2)
-    pairwise_diffs = self.transform(pairs[:, 1, :] - pairs[:, 0, :])
-    # (for MahalanobisMixin, the embedding is linear so we can just embed the
-    # difference)
-    return np.sqrt(np.sum(pairwise_diffs**2, axis=-1))
+    return self._map_row_blocks(self._score_pairs, pairs, indicators_ndim=2)
+
+  def score_pairs_iter(self, pairs_blocks):
+    """Returns a generator of the learned Mahalanobis distances of every pair
+    of an iterable of blocks of pairs.
+
+    Every block is checked and scored like with `score_pairs`, but the
+    temporary arrays (differences of points and their embeddings) are
+    allocated once for the largest block and then reused, so the memory used
+    does not depend on the total number of pairs.
+
+    Parameters
+    ----------
+    pairs_blocks : iterable of array-like
+      Iterable (e.g. generator) of blocks of pairs, each block being a 3D
+      array of pairs of shape (n_pairs_block, 2, n_features), or a 2D array of
+      indices of pairs of shape (n_pairs_block, 2) if the metric learner uses
+      a preprocessor.
+
+    Yields
+    ------
+    scores : `numpy.ndarray` of shape=(n_pairs_block,)
+      The learned Mahalanobis distance for every pair of the block.
+    """
+    buffers = {}
+    for pairs in pairs_blocks:
+      yield self._score_pairs(pairs, buffers)
+
+  def _score_pairs(self, pairs, buffers=None, tuple_size=2):
+    """Scores pairs (see `score_pairs`), with the temporary arrays taken from
+    the dict `buffers` if given (see `_get_buffer`).
+
+    If `tuple_size` is 4, `pairs` are quadruplets: they are validated once,
+    and their first and last pairs are scored together, the scores having
+    shape (n_quadruplets, 2)."""
+    # (the cached embedding is only computed for indicators of points)
+    embedding_indexer = (self._get_embedding_indexer() if np.ndim(pairs) == 2
+                         else None)
+    if embedding_indexer is not None:
+      # indicators are directly looked up in the cached embedding
+      X_embedded, inverse = check_tuples_unique(
+          pairs, preprocessor=embedding_indexer, estimator=self,
+          tuple_size=tuple_size, dtype=self._get_inference_dtype())
+      X_embedded, inverse = _split_pairs(X_embedded, inverse)
+      pairwise_diffs = _paired_differences(X_embedded, inverse, buffers)
+    else:
+      # sparse points (formed by a sparse preprocessor) are kept as CSR
+      # matrices: their rows are gathered and subtracted as sparse rows, and
+      # only embedded points or differences are dense
+      points, inverse = check_tuples_unique(pairs,
+                                            preprocessor=self.preprocessor_,
+                                            estimator=self,
+                                            tuple_size=tuple_size,
+                                            accept_sparse='csr',
+                                            dtype=self._get_inference_dtype())
+      points, inverse = _split_pairs(points, inverse)
+      # (for MahalanobisMixin, the embedding is linear so we can just embed
+      # the difference)
+      if inverse is not None and points.shape[0] < inverse.shape[0]:
+        # points appear in several pairs: it is cheaper to embed every
+        # distinct point once and take the differences in the embedding
+        # space
+        pairwise_diffs = _paired_differences(self._embed(points), inverse,
+                                             buffers)
+      else:
+        pairwise_diffs = self._embed(_paired_differences(points, inverse,
+                                                         buffers), buffers)
+    # pairwise_diffs is a temporary array, so we can square it in place
+    np.square(pairwise_diffs, out=pairwise_diffs)
+    scores = np.sqrt(np.sum(pairwise_diffs, axis=-1))
+    return scores if tuple_size == 2 else scores.reshape(-1, tuple_size // 2)
+
+  def _score_quadruplets(self, quadruplets):
+    """Returns the scores of the first and last pairs of quadruplets, of
+    shape (n_quadruplets, 2), validating the quadruplets once and embedding
+    the differences of all their pairs in a single product."""
+    return self._map_row_blocks(
+        lambda block: self._score_pairs(block, tuple_size=4), quadruplets,
+        indicators_ndim=2)
 
   def transform(self, X):
     """Embeds data points in the learned linear embedding space.
@@ -235,13 +397,561 @@ class MahalanobisMixin(six.with_metaclass(ABCMeta, BaseMetricLearner,
     X_embedded : `numpy.ndarray`, shape=(n_samples, num_dims)
       The embedded data points.
     """
+    return self._map_row_blocks(self._transform, X, indicators_ndim=1)
+
+  def transform_iter(self, X_blocks, copy=True):
+    """Returns a generator of the embeddings of an iterable of blocks of
+    points.
+
+    Every block is checked and embedded like with `transform`, but into an
+    array allocated once for the largest block and then reused.
+
+    Parameters
+    ----------
+    X_blocks : iterable of array-like
+      Iterable (e.g. generator) of blocks of points, each block being a 2D
+      array of shape (n_samples_block, n_features), or a 1D array of
+      indicators of points if the metric learner uses a preprocessor.
+
+    copy : `bool`, optional (default=True)
+      If False, the yielded arrays are views on the reused array, and are
+      therefore overwritten by the embedding of the next block.
+
+    Yields
+    ------
+    X_embedded : `numpy.ndarray`, shape=(n_samples_block, num_dims)
+      The embedded points of the block.
+    """
+    buffers = {}
+    for X in X_blocks:
+      X_embedded = self._transform(X, buffers)
+      yield X_embedded.copy() if copy else X_embedded
+
+  def _transform(self, X, buffers=None):
+    """Embeds points (see `transform`), into an array taken from the dict
+    `buffers` if given (see `_get_buffer`)."""
+    embedding_indexer = (self._get_embedding_indexer() if np.ndim(X) == 1
+                         else None)
+    if embedding_indexer is not None:
+      # indicators are directly looked up in the cached embedding
+      return check_input(X, type_of_inputs='classic', estimator=self,
+                         preprocessor=embedding_indexer,
+                         dtype=self._get_inference_dtype())
     X_checked = check_input(X, type_of_inputs='classic', estimator=self,
-                             preprocessor=self.preprocessor_,
-                             accept_sparse=True)
-    return X_checked.dot(self.transformer_.T)
+                            preprocessor=self.preprocessor_,
+                            accept_sparse=True,
+                            dtype=self._get_inference_dtype())
+    return self._embed(X_checked, buffers)
+
+  def _embed(self, X_checked, buffers=None):
+    """Embeds already checked points (see `transform`), into an array taken
+    from the dict `buffers` if given (see `_get_buffer`)."""
+    structure, _ = self._get_metric_structure()
+    if structure == 'diagonal':
+      # O(d) scaling of the features instead of a product by a (d, d) matrix
+      scaling = self._get_inference_factor()
+      if sp.issparse(X_checked):
+        return X_checked.dot(sp.diags(scaling)).toarray()
+      if buffers is None:
+        return X_checked * scaling
+      X_embedded = _get_buffer(buffers, 'embedding', X_checked.shape,
+                               np.result_type(X_checked, scaling))
+      return np.multiply(X_checked, scaling, out=X_embedded)
+    transformer = self._get_inference_factor()
+    if buffers is None or sp.issparse(X_checked):
+      return X_checked.dot(transformer.T)
+    X_embedded = _get_buffer(buffers, 'embedding',
+                             (X_checked.shape[0], transformer.shape[0]),
+                             np.result_type(X_checked, transformer))
+    return np.dot(X_checked, transformer.T, out=X_embedded)
+
+  def _map_row_blocks(self, func, inputs, indicators_ndim):
+    """Applies `func` (`_transform` or `_score_pairs`) to `inputs`. If
+    `n_jobs` is not 1, `inputs` is split into blocks of rows which are
+    processed in parallel by a pool of threads (numpy releases the GIL in
+    the validation, the subtractions and the products), reused between calls
+    (see `_get_thread_pool`), and the results are written into a single
+    output array. `indicators_ndim` is the number of
+    dimensions of `inputs` when they are indicators of points (1 for points,
+    2 for tuples)."""
+    n_jobs = _effective_n_jobs(self.n_jobs)
+    if n_jobs == 1:
+      return func(inputs)
+    if sp.issparse(inputs):
+      inputs = inputs.tocsr()  # (so that it can be sliced)
+    elif not hasattr(inputs, 'shape'):
+      inputs = np.asarray(inputs)
+    if len(inputs.shape) == 0 or inputs.shape[0] < 2:
+      return func(inputs)
+    # the derived state is computed once here, rather than by every thread
+    if inputs.ndim == indicators_ndim:
+      self._get_embedding_indexer()
+    self._get_inference_factor()
+    blocks = list(gen_even_slices(inputs.shape[0], min(n_jobs,
+                                                       inputs.shape[0])))
+    lock = threading.Lock()
+    output = []
+    # (the configuration is local to every thread, so the threads of the
+    # pool are given the one of the caller)
+    config = get_config()
+
+    def process_block(block):
+      with config_context(**config):
+        result = func(inputs[block])
+      with lock:
+        # the output array is allocated by the first block to finish, since
+        # its dtype depends on the validated inputs
+        if not output:
+          output.append(np.empty((inputs.shape[0],) + result.shape[1:],
+                                 dtype=result.dtype))
+      output[0][block] = result
+
+    _get_thread_pool(n_jobs).map(process_block, blocks)
+    return output[0]
+
+  def _get_inference_dtype(self):
+    """Returns the dtype to convert inputs to before embedding them, to be
+    passed to `check_input`."""
+    inference_dtype = getattr(self, 'inference_dtype', None)
+    return 'numeric' if inference_dtype is None else inference_dtype
+
+  def _get_cached(self, name, sources, compute):
+    """Returns the state `name` derived from the fit, computed by calling
+    `compute` the first time it is needed, and computed again if any object
+    of the tuple `sources` it is derived from has been replaced since then
+    (for instance ``transformer_``, by a new fit or by `compress`).
+
+    The state is cached in the ``_inference_cache`` dict created by the fit,
+    so that the inference methods only change the content of this dict, not
+    the attributes of the metric learner. Without this dict (e.g. if the
+    metric learner was fitted without `_prepare_inputs`), the state is
+    computed at every call."""
+    cache = self.__dict__.get('_inference_cache')
+    if cache is None:
+      return compute()
+    entry = cache.get(name)
+    if (entry is None or len(entry[0]) != len(sources) or
+            any(cached is not source
+                for cached, source in zip(entry[0], sources))):
+      entry = cache[name] = (sources, compute())
+    return entry[1]
+
+  def __getstate__(self):
+    # the cached derived state is not pickled, but computed again when needed
+    state = super(MahalanobisMixin, self).__getstate__()
+    if '_inference_cache' in state:
+      state = dict(state, _inference_cache={})
+    return state
+
+  def __setstate__(self, state):
+    # metric learners pickled by previous versions have a transformer_
+    # attribute, which is now a property
+    if 'transformer_' in state:
+      state = dict(state)
+      state['_transformer'] = state.pop('transformer_')
+    super(MahalanobisMixin, self).__setstate__(state)
+
+  def _get_inference_factor(self):
+    """Returns the factor of `_get_metric_structure`, or its copy in
+    `inference_dtype` if it is set (made once per fit, see `_get_cached`)."""
+    factor = self._get_metric_structure()[1]
+    inference_dtype = getattr(self, 'inference_dtype', None)
+    if (inference_dtype is None or
+            factor.dtype == np.dtype(inference_dtype)):
+      return factor
+    inference_dtype = np.dtype(inference_dtype)
+    return self._get_cached('inference_factor', (factor, inference_dtype),
+                            lambda: factor.astype(inference_dtype))
+
+  def _get_metric_structure(self):
+    """Returns the structure of the learned transformation, as a tuple
+    ``(structure, factor)``:
+
+    - ``('diagonal', scaling)`` if the transformation was set by
+      `_set_diagonal`, with ``scaling`` its diagonal,
+    - ``('full', transformer_)`` otherwise.
+
+    The structure is the one the metric learner stored, it is never found by
+    scanning ``transformer_``. Low-rank transformations (with ``num_dims <
+    n_features``) need no special case: ``transformer_`` is then already
+    their (num_dims, n_features) factor."""
+    if '_diagonal' in self.__dict__:
+      return 'diagonal', self._diagonal
+    return 'full', self.transformer_
+
+  def _get_embedding_indexer(self):
+    """Returns an `ArrayIndexer` on the embedding of all the points of the
+    array-like preprocessor if `cache_embedding` is True, or None otherwise.
+
+    The embedding is computed the first time it is needed, and computed
+    again if the metric learner has been fitted again since then (which
+    sets new ``transformer_`` and ``preprocessor_`` objects), or if
+    `inference_dtype` has changed (see `_get_cached`).
+    """
+    if (not getattr(self, 'cache_embedding', False) or
+            not isinstance(self.preprocessor_, ArrayIndexer)):
+      return None
+
+    def embed_preprocessor():
+      X = self.preprocessor_.X
+      if X.ndim != 2:
+        # invalid preprocessors raise the appropriate error without cache
+        return None
+      try:
+        X = check_array(X, accept_sparse=True, estimator=self,
+                        dtype=self._get_inference_dtype())
+      except ValueError:
+        return None
+      return ArrayIndexer(self._embed(X))
+
+    return self._get_cached(
+        'embedding', (self._get_inference_factor(), self.preprocessor_),
+        embed_preprocessor)
+
+  def pairwise_distances_chunked(self, X, Y=None, squared=False,
+                                 working_memory=None):
+    """Generates the learned distance matrix between ``X`` and ``Y``, chunk
+    by chunk of rows.
+
+    ``X`` and ``Y`` are embedded only once, and the distances are then
+    computed in the embedding space, by blocks of rows of ``X`` small enough
+    for each block of the distance matrix to fit in ``working_memory``.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples_X, n_features) or (n_samples_X,)
+      2D array of points, or 1D array of indicators of points if the metric
+      learner uses a preprocessor.
+
+    Y : array-like, shape=(n_samples_Y, n_features) or (n_samples_Y,), optional
+      2D array of points, or 1D array of indicators of points if the metric
+      learner uses a preprocessor. If None, the distances between the points
+      of ``X`` are computed.
+
+    squared : `bool`
+      If True, the squared learned distances are returned, which is faster to
+      compute.
+
+    working_memory : int, optional
+      The sought maximum memory, in MiB, for a chunk of the distance matrix.
+      When None (default), the value of
+      ``sklearn.get_config()['working_memory']`` is used.
+
+    Yields
+    ------
+    D_chunk : `numpy.ndarray`, shape=(n_chunk_rows, n_samples_Y)
+      A contiguous block of rows of the distance matrix.
+
+    See Also
+    --------
+    pairwise_distances : the same computation, returning the whole matrix.
+    """
+    X_embedded = self.transform(X)
+    Y_embedded = X_embedded if Y is None else self.transform(Y)
+    return _embedded_distances_chunked(X_embedded, Y_embedded, Y is None,
+                                       squared, working_memory)
+
+  def pairwise_distances(self, X, Y=None, squared=False, working_memory=None):
+    """Returns the learned distance matrix between ``X`` and ``Y``.
+
+    Unlike calling `score_pairs` on every combination of points, this never
+    forms the array of pairs: ``X`` and ``Y`` are embedded once, and the
+    distance matrix is filled by blocks of rows (see
+    `pairwise_distances_chunked`).
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples_X, n_features) or (n_samples_X,)
+      2D array of points, or 1D array of indicators of points if the metric
+      learner uses a preprocessor.
+
+    Y : array-like, shape=(n_samples_Y, n_features) or (n_samples_Y,), optional
+      2D array of points, or 1D array of indicators of points if the metric
+      learner uses a preprocessor. If None, the distances between the points
+      of ``X`` are computed.
+
+    squared : `bool`
+      If True, the squared learned distances are returned, which is faster to
+      compute.
+
+    working_memory : int, optional
+      The sought maximum memory, in MiB, for temporary blocks of the distance
+      matrix. When None (default), the value of
+      ``sklearn.get_config()['working_memory']`` is used.
+
+    Returns
+    -------
+    D : `numpy.ndarray`, shape=(n_samples_X, n_samples_Y)
+      The learned distance between every point of ``X`` and every point of
+      ``Y``.
+    """
+    X_embedded = self.transform(X)
+    Y_embedded = X_embedded if Y is None else self.transform(Y)
+    D = np.empty((X_embedded.shape[0], Y_embedded.shape[0]))
+    start = 0
+    for D_chunk in _embedded_distances_chunked(X_embedded, Y_embedded,
+                                               Y is None, squared,
+                                               working_memory):
+      D[start:start + D_chunk.shape[0]] = D_chunk
+      start += D_chunk.shape[0]
+    return D
+
+  def retrieve(self, queries, gallery, k=10, batch_size=1000,
+               gallery_batch_size=None):
+    """Finds, for every query, the `k` nearest points of a gallery under the
+    learned metric, with bounded memory.
+
+    The gallery is embedded once. Queries are then embedded and processed
+    by blocks of `batch_size`, and each block is compared with blocks of
+    `gallery_batch_size` gallery points, computing the squared distances in
+    the embedding space through the expansion
+    :math:`||x_e - y_e||^2 = ||x_e||^2 - 2 x_e^T y_e + ||y_e||^2`, and only
+    keeping the `k` best candidates found so far for every query. The
+    temporary memory is thus O(batch_size * gallery_batch_size) instead of
+    O(n_queries * n_gallery).
+
+    Parameters
+    ----------
+    queries : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    gallery : array-like, shape=(n_gallery, n_features) or (n_gallery,)
+      2D array of points to search, or 1D array of indicators of points if
+      the metric learner uses a preprocessor.
+
+    k : int, optional (default=10)
+      Number of nearest gallery points to retrieve for every query.
+
+    batch_size : int, optional (default=1000)
+      Number of queries processed at once.
+
+    gallery_batch_size : int or None, optional (default=None)
+      Number of gallery points compared at once with a block of queries. If
+      None, the whole gallery is compared at once.
+
+    Returns
+    -------
+    distances : `numpy.ndarray`, shape=(n_queries, k)
+      The learned distances from every query to its `k` nearest gallery
+      points, in increasing order.
+
+    indices : `numpy.ndarray`, shape=(n_queries, k)
+      The indices in `gallery` of these points.
+    """
+    gallery_embedded = self.transform(gallery)
+    n_gallery = gallery_embedded.shape[0]
+    if not 0 < k <= n_gallery:
+      raise ValueError("Expected 0 < k <= n_gallery, but k={} and "
+                       "n_gallery={}.".format(k, n_gallery))
+    if gallery_batch_size is None:
+      gallery_batch_size = n_gallery
+    gallery_norms = row_norms(gallery_embedded, squared=True)
+    queries = check_array(queries, ensure_2d=False, allow_nd=True,
+                          force_all_finite=False, accept_sparse=True,
+                          dtype=None, ensure_min_features=0)
+    n_queries = queries.shape[0]
+    distances = np.empty((n_queries, k))
+    indices = np.empty((n_queries, k), dtype=np.intp)
+    for sl in gen_batches(n_queries, batch_size):
+      queries_embedded = self.transform(queries[sl])
+      queries_norms = row_norms(queries_embedded, squared=True)[:, np.newaxis]
+
+      def block_distances(gallery_sl):
+        dist = queries_embedded.dot(gallery_embedded[gallery_sl].T)
+        dist *= -2
+        dist += queries_norms
+        dist += gallery_norms[gallery_sl]
+        return dist
+
+      distances[sl], indices[sl] = top_k_by_blocks(
+          block_distances, queries_embedded.shape[0], n_gallery, k,
+          gallery_batch_size)
+    np.maximum(distances, 0, out=distances)
+    return np.sqrt(distances, out=distances), indices
+
+  def _get_fitted_transformer(self):
+    """Returns the learned transformation as it is stored (its diagonal for
+    diagonal metrics, see `_get_metric_structure`), checking that the metric
+    learner is fitted. Indexes keep it to detect, by its identity, that the
+    metric learner has been fitted again since they were built."""
+    # (`transformer_` would be built to check it)
+    check_is_fitted(self, ['_transformer', '_diagonal'], all_or_any=any)
+    return self._get_metric_structure()[1]
+
+  def build_index(self, X, algorithm='auto', leaf_size=30):
+    """Builds a nearest neighbors index on points embedded in the learned
+    space.
+
+    The points of ``X`` are embedded once (see `transform`), so that
+    nearest neighbors queries under the learned metric reduce to euclidean
+    queries, which scikit-learn's neighbors structures answer much faster
+    than with a callable metric (such as the one returned by `get_metric`).
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples, n_features) or (n_samples,)
+      2D array of points to index, or 1D array of indicators of points if
+      the metric learner uses a preprocessor.
+
+    algorithm : {'auto', 'ball_tree', 'kd_tree', 'brute'}, optional
+      Algorithm used to compute the nearest neighbors (see
+      :class:`sklearn.neighbors.NearestNeighbors`).
 
-  def get_metric(self):
-    transformer_T = self.transformer_.T.copy()
+    leaf_size : int, optional (default=30)
+      Leaf size passed to the tree structures.
+
+    Returns
+    -------
+    self : object
+      Returns the instance itself, with an ``index_`` attribute.
+    """
+    from sklearn.neighbors import NearestNeighbors
+    X_embedded = self.transform(X)
+    self.index_ = NearestNeighbors(algorithm=algorithm, leaf_size=leaf_size)
+    self.index_.fit(X_embedded)
+    # we keep the transformer the index was built with, to detect a refit
+    self._index_transformer = self._get_fitted_transformer()
+    return self
+
+  def kneighbors(self, X, n_neighbors=5, return_distance=True):
+    """Finds the nearest neighbors of points, under the learned metric,
+    among the points indexed with `build_index`.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    n_neighbors : int, optional (default=5)
+      Number of neighbors to get.
+
+    return_distance : `bool`, optional (default=True)
+      If False, the distances will not be returned.
+
+    Returns
+    -------
+    dist : `numpy.ndarray`, shape=(n_queries, n_neighbors)
+      The learned distances to the neighbors, only present if
+      `return_distance` is True.
+
+    ind : `numpy.ndarray`, shape=(n_queries, n_neighbors)
+      The indices of the nearest points in the indexed points.
+    """
+    self._check_index()
+    return self.index_.kneighbors(self.transform(X), n_neighbors=n_neighbors,
+                                  return_distance=return_distance)
+
+  def _check_index(self):
+    """Checks that the index has been built with the current fit."""
+    check_is_fitted(self, ['index_'])
+    if self._index_transformer is not self._get_fitted_transformer():
+      raise ValueError("The nearest neighbors index{} was built before the "
+                       "metric learner was last fitted. Call `build_index` "
+                       "again.".format(make_context(self)))
+
+  def radius_neighbors(self, X, radius):
+    """Finds the points indexed with `build_index` that are within a given
+    learned distance of query points.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    radius : float
+      The maximum learned distance (inclusive) between a query and the
+      indexed points to find.
+
+    Returns
+    -------
+    graph : `scipy.sparse.csr_matrix`, shape=(n_queries, n_indexed)
+      Sparse matrix where ``graph[i, j]`` is the learned distance between
+      the i-th query and the j-th indexed point, for all the indexed points
+      within `radius` of the query (a zero distance is stored explicitly).
+    """
+    self._check_index()
+    return self.index_.radius_neighbors_graph(self.transform(X), radius,
+                                              mode='distance')
+
+  def similarity_join(self, X, threshold, working_memory=None):
+    """Finds all the pairs of points of ``X`` whose learned distance is below
+    a threshold.
+
+    The points are embedded once, and the distances are computed by blocks
+    of rows of the distance matrix (see `pairwise_distances_chunked`), only
+    keeping the pairs below the threshold, so that the dense distance matrix
+    is never formed. The distances of the pairs kept are computed exactly,
+    from the differences of the embedded points, so that duplicates are
+    found with a zero threshold.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples, n_features) or (n_samples,)
+      2D array of points, or 1D array of indicators of points if the metric
+      learner uses a preprocessor.
+
+    threshold : float
+      The maximum learned distance (inclusive) between two points for them
+      to be joined.
+
+    working_memory : int, optional
+      The sought maximum memory, in MiB, for temporary blocks of the distance
+      matrix. When None (default), the value of
+      ``sklearn.get_config()['working_memory']`` is used.
+
+    Returns
+    -------
+    graph : `scipy.sparse.csr_matrix`, shape=(n_samples, n_samples)
+      Symmetric sparse matrix where ``graph[i, j]`` is the learned distance
+      between the i-th and the j-th points, for every pair of distinct points
+      within `threshold` of each other (a zero distance is stored
+      explicitly).
+    """
+    X_embedded = self.transform(X)
+    n_samples = X_embedded.shape[0]
+    # (distances are compared squared, and a negative threshold joins
+    # nothing)
+    threshold_squared = threshold**2 if threshold >= 0 else -1.
+    # the expansion of squared norms is not exact (its error grows with the
+    # norms of the points), so the pairs within this slack of the threshold
+    # are only candidates, whose distances are then computed exactly from
+    # the differences of their embeddings
+    eps = np.finfo(np.result_type(X_embedded.dtype, np.float32)).eps
+    slack = (8 * eps * max(X_embedded.shape[1], 1) *
+             (row_norms(X_embedded, squared=True).max() if n_samples else 0))
+    indptr, indices, data = [np.zeros(1, dtype=np.intp)], [], []
+    start = 0
+    for D_chunk in _embedded_distances_chunked(X_embedded, X_embedded, True,
+                                               True, working_memory):
+      rows, cols = np.nonzero(D_chunk <= threshold_squared + slack)
+      distinct = cols != start + rows
+      rows, cols = rows[distinct], cols[distinct]
+      distances = row_norms(X_embedded[start + rows] - X_embedded[cols],
+                            squared=True)
+      joined = distances <= threshold_squared
+      rows, cols = rows[joined], cols[joined]
+      indptr.append(indptr[-1][-1] +
+                    np.cumsum(np.bincount(rows, minlength=D_chunk.shape[0])))
+      indices.append(cols)
+      data.append(np.sqrt(distances[joined]))
+      start += D_chunk.shape[0]
+    return sp.csr_matrix((np.concatenate(data) if data else np.empty(0),
+                          np.concatenate(indices) if indices else
+                          np.empty(0, dtype=np.intp),
+                          np.concatenate(indptr)),
+                         shape=(n_samples, n_samples))
+
+  def get_metric(self, batched=False):
+    structure, factor = self._get_metric_structure()
+    if batched:
+      return MahalanobisMetric(factor.copy())
+    if structure == 'diagonal':
+      scaling = factor.copy()
+    else:
+      transformer_T = factor.T.copy()
 
     def metric_fun(u, v, squared=False):
       """This function computes the metric between u and v, according to the
@@ -266,7 +976,10 @@ class MahalanobisMixin(six.with_metaclass(ABCMeta, BaseMetricLearner,
       """
       u = validate_vector(u)
       v = validate_vector(v)
-      transformed_diff = (u - v).dot(transformer_T)
+      if structure == 'diagonal':
+        transformed_diff = (u - v) * scaling
+      else:
+        transformed_diff = (u - v).dot(transformer_T)
       dist = np.dot(transformed_diff, transformed_diff.T)
       if not squared:
         dist = np.sqrt(dist)
@@ -291,7 +1004,310 @@ class MahalanobisMixin(six.with_metaclass(ABCMeta, BaseMetricLearner,
     M : `numpy.ndarray`, shape=(n_components, n_features)
       The copy of the learned Mahalanobis matrix.
     """
-    return self.transformer_.T.dot(self.transformer_)
+    # the matrix is computed once per fit (in O(d) if the metric is
+    # diagonal), and copied so that the cache cannot be modified
+    structure, factor = self._get_metric_structure()
+
+    def mahalanobis_matrix():
+      if structure == 'diagonal':
+        return np.diag(factor ** 2)
+      return factor.T.dot(factor)
+
+    return self._get_cached('mahalanobis_matrix', (factor,),
+                            mahalanobis_matrix).copy()
+
+  def export_inference_model(self, path):
+    """Writes the learned metric alone in a directory, to be loaded with
+    `load_inference_model`.
+
+    Unlike pickling the metric learner, this only writes the learned
+    transformation (in `inference_dtype` if it is set, and as its diagonal
+    for diagonal metrics) as a ``.npy`` file, and some metadata, leaving
+    aside the preprocessor and the rest of the training state. If an index
+    has been built with `build_index`, the embedding of the indexed points
+    is written too. The ``.npy`` files can then be memory-mapped, so that
+    the processes loading the model on a host share the same pages.
+
+    Parameters
+    ----------
+    path : str
+      The directory to write the model into. It is created if it does not
+      exist.
+
+    See Also
+    --------
+    load_inference_model : Loads the exported model.
+    """
+    self._get_fitted_transformer()
+    metadata = {'format_version': _INFERENCE_FORMAT_VERSION,
+                'metric_learner': type(self).__name__,
+                'metric_learn_version': __version__,
+                'inference_dtype': None}
+    if getattr(self, 'inference_dtype', None) is not None:
+      metadata['inference_dtype'] = np.dtype(self.inference_dtype).str
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    np.save(os.path.join(path, 'transformer.npy'),
+            np.ascontiguousarray(self._get_inference_factor()))
+    if hasattr(self, 'index_'):
+      self._check_index()
+      params = self.index_.get_params()
+      metadata['index'] = {'algorithm': params['algorithm'],
+                           'leaf_size': params['leaf_size']}
+      np.save(os.path.join(path, 'index.npy'), self.index_._fit_X)
+    with open(os.path.join(path, 'metadata.json'), 'w') as f:
+      json.dump(metadata, f, indent=2, sort_keys=True)
+
+  def quantize(self, X_validation=None, dtype=np.int8):
+    """Returns a copy of the learned metric whose transformation is
+    quantized to integers, to reproduce and measure the loss of precision of
+    an integer inference.
+
+    Every row of ``transformer_`` is stored as integers of type `dtype`
+    times a scale, so that the int8 transformation takes 8 times less
+    memory than a float64 one. The inputs of the inference methods are
+    quantized the same way, row by row, and embedded with the product of the
+    integer matrices, rescaled. This product is summed in int32, or in
+    int64 if the sums could overflow int32 (with more than 133144 features
+    for int8, or 2 for int16), so that it is exact. Numpy has no integer
+    BLAS: the product only upcasts blocks of the transformation, but it is
+    slower than a float product.
+
+    Parameters
+    ----------
+    X_validation : array-like or None, optional (default=None)
+      If not None, 2D array of points (or 1D array of indicators of points
+      if the metric learner uses a preprocessor) on which the learned
+      distances between all pairs of points are compared with the quantized
+      ones, the maximum difference being stored in the
+      ``max_distance_error_`` attribute of the returned model.
+
+    dtype : {np.int8, np.int16}, optional (default=np.int8)
+      The integer type of the quantized transformation.
+
+    Returns
+    -------
+    model : `QuantizedModel`
+      The quantized model, using the same preprocessor and `n_jobs` as the
+      metric learner.
+    """
+    check_is_fitted(self, ['transformer_'])
+    if np.dtype(dtype) not in (np.int8, np.int16):
+      raise ValueError("Expected dtype to be np.int8 or np.int16, but "
+                       "dtype={}.".format(dtype))
+    quantized_transformer, scales = _quantize_rows(self.transformer_, dtype)
+    model = QuantizedModel(quantized_transformer, scales,
+                           preprocessor=self.preprocessor_,
+                           n_jobs=getattr(self, 'n_jobs', None))
+    model.max_distance_error_ = None
+    if X_validation is not None:
+      model.max_distance_error_ = np.max(np.abs(
+          model.pairwise_distances(X_validation) -
+          self.pairwise_distances(X_validation)))
+    return model
+
+  def compress(self, rank=None, energy=0.99, X_validation=None):
+    """Replaces the learned transformation by a low-rank one, keeping the
+    main directions of the learned metric, for faster inference.
+
+    The Mahalanobis matrix ``M = L.T.dot(L)`` (with ``L = transformer_``)
+    is decomposed into its eigenvectors, through the singular value
+    decomposition of ``L`` (so that ``M`` is not formed). ``transformer_``
+    is then replaced by the ``(rank, n_features)`` matrix whose rows are the
+    top eigenvectors scaled by the square roots of their eigenvalues: this
+    is the best approximation of ``M`` of this rank, and embedding a point
+    costs O(rank * n_features) instead of O(n_features^2). Indexes built
+    with `build_index` must then be built again.
+
+    Parameters
+    ----------
+    rank : int or None, optional (default=None)
+      The number of components kept. If None, it is the smallest number of
+      components whose eigenvalues sum to at least `energy` times the trace
+      of ``M``.
+
+    energy : float, optional (default=0.99)
+      The fraction of the trace of ``M`` to keep, in (0, 1], only used if
+      `rank` is None.
+
+    X_validation : array-like or None, optional (default=None)
+      If not None, 2D array of points (or 1D array of indicators of points
+      if the metric learner uses a preprocessor) on which the learned
+      distances between all pairs of points are compared before and after
+      the compression, the maximum difference being stored in the
+      ``max_distance_error_`` attribute.
+
+    Returns
+    -------
+    self : object
+      Returns the instance itself, with the attributes
+      ``energy_`` (the fraction of the trace of ``M`` kept) and
+      ``max_distance_error_`` (None if `X_validation` is None).
+    """
+    check_is_fitted(self, ['transformer_'])
+    transformer = np.atleast_2d(self.transformer_)
+    _, singular_values, components = np.linalg.svd(transformer,
+                                                   full_matrices=False)
+    eigenvalues = singular_values ** 2
+    total_energy = eigenvalues.sum()
+    if rank is None:
+      if not 0 < energy <= 1:
+        raise ValueError("Expected 0 < energy <= 1, but energy={}."
+                         .format(energy))
+      if total_energy == 0:
+        rank = 1
+      else:
+        # (the tolerance avoids keeping negligible components for energy=1)
+        rank = 1 + np.searchsorted(np.cumsum(eigenvalues) / total_energy,
+                                   energy - 1e-12)
+    elif not 0 < rank <= transformer.shape[1]:
+      raise ValueError("Expected 0 < rank <= n_features, but rank={} and "
+                       "n_features={}.".format(rank, transformer.shape[1]))
+    rank = min(rank, eigenvalues.size)
+    if X_validation is not None:
+      distances = self.pairwise_distances(X_validation)
+    self.transformer_ = components[:rank] * singular_values[:rank,
+                                                            np.newaxis]
+    self.energy_ = (eigenvalues[:rank].sum() / total_energy if total_energy
+                    else 1.)
+    self.max_distance_error_ = None
+    if X_validation is not None:
+      self.max_distance_error_ = np.max(np.abs(
+          self.pairwise_distances(X_validation) - distances))
+    return self
+
+
+def _quantize_rows(X, dtype):
+  """Returns the integers of type `dtype` and the scales, of shape
+  (n_rows,), such that every row of `X` is approximately the row of integers
+  times its scale."""
+  scales = np.max(np.abs(X), axis=1) / np.iinfo(dtype).max
+  scales[scales == 0] = 1  # (rows of zeros)
+  return np.round(X / scales[:, np.newaxis]).astype(dtype), scales
+
+
+def _accumulation_dtype(dtype, n_features):
+  """Returns the integer type in which the products of integers of type
+  `dtype` (quantized by `_quantize_rows`) are summed over `n_features`
+  without overflow, or raises a ValueError if there is none."""
+  max_product = int(np.iinfo(dtype).max) ** 2
+  for accumulation_dtype in (np.int32, np.int64):
+    if n_features * max_product <= np.iinfo(accumulation_dtype).max:
+      return accumulation_dtype
+  raise ValueError("Cannot accumulate the products of {} values over {} "
+                   "features without overflow.".format(np.dtype(dtype).name,
+                                                       n_features))
+
+
+def _integer_dot(A, B):
+  """Returns ``A.dot(B.T)`` for two matrices of quantized integers, summed
+  in the type given by `_accumulation_dtype`. The rows of `B` are upcast to
+  this type by blocks, so that no copy of the whole of `B` is made."""
+  accumulation_dtype = _accumulation_dtype(B.dtype, B.shape[1])
+  A = A.astype(accumulation_dtype)
+  out = np.empty((A.shape[0], B.shape[0]), dtype=accumulation_dtype)
+  block_size = max(_INTEGER_BLOCK_SIZE // max(B.shape[1], 1), 1)
+  for sl in gen_batches(B.shape[0], block_size):
+    out[:, sl] = A.dot(B[sl].astype(accumulation_dtype).T)
+  return out
+
+
+def _effective_n_jobs(n_jobs):
+  """Returns the number of threads to use for `n_jobs`, with joblib's
+  conventions: None means 1 and negative values count from the number of
+  processors (-1 means all of them)."""
+  if n_jobs is None:
+    return 1
+  if n_jobs == 0:
+    raise ValueError("n_jobs == 0 has no meaning.")
+  if n_jobs < 0:
+    return max(cpu_count() + 1 + n_jobs, 1)
+  return n_jobs
+
+
+def _get_thread_pool(n_threads):
+  """Returns the pool of `n_threads` threads of the current process. It is
+  created the first time it is needed and then shared by all the metric
+  learners, so that inference calls do not pay for starting threads. (The
+  pools are kept by process, since the threads of a pool do not exist in
+  the processes forked after it was created.)"""
+  key = os.getpid(), n_threads
+  with _THREAD_POOLS_LOCK:
+    if key not in _THREAD_POOLS:
+      _THREAD_POOLS[key] = ThreadPool(n_threads)
+    return _THREAD_POOLS[key]
+
+
+def _get_buffer(buffers, name, shape, dtype):
+  """Returns a C-contiguous array of the given shape and dtype, which is a
+  view on the array stored at `name` in the dict `buffers`. This array is
+  only reallocated when it is too small, so that temporary arrays can be
+  reused from one block of inputs to the next."""
+  size = int(np.prod(shape))
+  buffer = buffers.get(name)
+  if buffer is None or buffer.dtype != dtype or buffer.size < size:
+    buffer = buffers[name] = np.empty(size, dtype=dtype)
+  return buffer[:size].reshape(shape)
+
+
+def _split_pairs(points, inverse):
+  """Splits tuples of an even size, as returned by `check_tuples_unique`,
+  into their consecutive pairs (a quadruplet into its first and last pairs
+  for instance), without copying the points."""
+  if inverse is None:
+    if points.shape[1] == 2:
+      return points, inverse
+    return points.reshape((-1, 2) + points.shape[2:]), inverse
+  return points, inverse.reshape(-1, 2)
+
+
+def _paired_differences(points, inverse, buffers=None):
+  """Returns the differences between the second and the first points of
+  pairs. If `inverse` is None, `points` is a 3D array of pairs; otherwise
+  `points` is a 2D array of distinct points and `inverse` the array of the
+  positions of the points of every pair in it. If `buffers` is given, the
+  result is a view on a temporary array taken from it (see `_get_buffer`)."""
+  if inverse is None:
+    first, second = points[:, 0, :], points[:, 1, :]
+    if buffers is None:
+      return second - first
+    diffs = _get_buffer(buffers, 'diffs', first.shape,
+                        np.result_type(first, second))
+    return np.subtract(second, first, out=diffs)
+  if buffers is None or sp.issparse(points):
+    return points[inverse[:, 1]] - points[inverse[:, 0]]
+  shape = (inverse.shape[0],) + points.shape[1:]
+  diffs = _get_buffer(buffers, 'diffs', shape, points.dtype)
+  first = _get_buffer(buffers, 'first_points', shape, points.dtype)
+  np.take(points, inverse[:, 1], axis=0, out=diffs)
+  np.take(points, inverse[:, 0], axis=0, out=first)
+  diffs -= first
+  return diffs
+
+
+def _embedded_distances_chunked(X_embedded, Y_embedded, same_points, squared,
+                                working_memory):
+  """Yields blocks of rows of the euclidean distance matrix between two
+  arrays of already embedded points. If `same_points` is True, ``X_embedded``
+  and ``Y_embedded`` are the same array and the diagonal is set to zero."""
+  Y_norm_squared = row_norms(Y_embedded, squared=True)[np.newaxis, :]
+  n_samples_X, n_samples_Y = X_embedded.shape[0], Y_embedded.shape[0]
+  chunk_n_rows = get_chunk_n_rows(row_bytes=8 * n_samples_Y,
+                                  max_n_rows=n_samples_X,
+                                  working_memory=working_memory)
+  from sklearn.metrics.pairwise import euclidean_distances
+  for sl in gen_batches(n_samples_X, chunk_n_rows):
+    D_chunk = euclidean_distances(X_embedded[sl], Y_embedded,
+                                  Y_norm_squared=Y_norm_squared,
+                                  squared=True)
+    if same_points:
+      # the expansion of squared norms is not exact, so we enforce zeros on
+      # the diagonal
+      rows = np.arange(D_chunk.shape[0])
+      D_chunk[rows, sl.start + rows] = 0.
+    if not squared:
+      np.sqrt(D_chunk, out=D_chunk)
+    yield D_chunk
 
 
 class _PairsClassifierMixin(BaseMetricLearner):
@@ -337,9 +1353,8 @@ class _PairsClassifierMixin(BaseMetricLearner):
     y_predicted : `numpy.ndarray` of floats, shape=(n_constraints,)
       The predicted learned metric value between samples in every pair.
     """
-    pairs = check_input(pairs, type_of_inputs='tuples',
-                        preprocessor=self.preprocessor_,
-                        estimator=self, tuple_size=self._tuple_size)
+    # score_pairs checks the pairs, and forms every distinct point only once
+    # when pairs are given as indicators
     return self.score_pairs(pairs)
 
   def score(self, pairs, y):
@@ -367,6 +1382,7 @@ class _PairsClassifierMixin(BaseMetricLearner):
     score : float
       The ``roc_auc`` score.
     """
+    from sklearn.metrics import roc_auc_score
     return roc_auc_score(y, self.decision_function(pairs))
 
 
@@ -393,9 +1409,7 @@ class _QuadrupletsClassifierMixin(BaseMetricLearner):
     prediction : `numpy.ndarray` of floats, shape=(n_constraints,)
       Predictions of the ordering of pairs, for each quadruplet.
     """
-    quadruplets = check_input(quadruplets, type_of_inputs='tuples',
-                              preprocessor=self.preprocessor_,
-                              estimator=self, tuple_size=self._tuple_size)
+    # (the quadruplets are checked by decision_function)
     return np.sign(self.decision_function(quadruplets))
 
   def decision_function(self, quadruplets):
@@ -417,8 +1431,17 @@ class _QuadrupletsClassifierMixin(BaseMetricLearner):
     decision_function : `numpy.ndarray` of floats, shape=(n_constraints,)
       Metric differences.
     """
-    return (self.score_pairs(quadruplets[:, :2]) -
-            self.score_pairs(quadruplets[:, 2:]))
+    scores = self._score_quadruplets(quadruplets)
+    return scores[:, 0] - scores[:, 1]
+
+  def _score_quadruplets(self, quadruplets):
+    """Returns the scores of the first and last pairs of quadruplets, of
+    shape (n_quadruplets, 2)."""
+    quadruplets = check_input(quadruplets, type_of_inputs='tuples',
+                              preprocessor=self.preprocessor_,
+                              estimator=self, tuple_size=self._tuple_size)
+    return np.column_stack([self.score_pairs(quadruplets[:, :2]),
+                            self.score_pairs(quadruplets[:, 2:])])
 
   def score(self, quadruplets, y=None):
     """Computes score on input quadruplets
@@ -443,3 +1466,385 @@ class _QuadrupletsClassifierMixin(BaseMetricLearner):
       The quadruplets score.
     """
     return -np.mean(self.predict(quadruplets))
+
+
+class MahalanobisMetric(object):
+  """Learned Mahalanobis metric, independent from the metric learner.
+
+  Such metrics are returned by ``get_metric(batched=True)``. Like the
+  function returned by `get_metric`, they can be called on two 1D arrays,
+  but they also compute the distances between many points at once, with
+  vectorized operations (see `pairwise` and `paired`), and can be pickled.
+  Besides, the Mahalanobis matrix `VI` can be given to the ``'mahalanobis'``
+  metric of scipy's `cdist` and `pdist` or of scikit-learn's estimators,
+  which then compute the distances in C instead of calling a Python
+  function for every pair::
+
+    cdist(U, V, 'mahalanobis', VI=metric.VI)
+
+  Parameters
+  ----------
+  transformer : `numpy.ndarray`, shape=(num_dims, n_features) or (n_features,)
+    The learned linear transformation ``L``, or its diagonal if it is a
+    diagonal matrix.
+
+  Attributes
+  ----------
+  VI : `numpy.ndarray`, shape=(n_features, n_features)
+    The Mahalanobis matrix ``M = L.T.dot(L)``, computed the first time it is
+    accessed.
+  """
+
+  def __init__(self, transformer):
+    self.transformer = transformer
+
+  @property
+  def VI(self):
+    if getattr(self, '_VI', None) is None:
+      if self.transformer.ndim == 1:
+        self._VI = np.diag(self.transformer ** 2)
+      else:
+        self._VI = self.transformer.T.dot(self.transformer)
+    return self._VI
+
+  def __call__(self, u, v, squared=False):
+    """Computes the learned distance between two points.
+
+    Parameters
+    ----------
+    u : array-like, shape=(n_features,)
+      The first point involved in the distance computation.
+
+    v : array-like, shape=(n_features,)
+      The second point involved in the distance computation.
+
+    squared : `bool`
+      If True, the function will return the squared metric between u and
+      v, which is faster to compute.
+
+    Returns
+    -------
+    distance: float
+      The distance between u and v according to the new metric.
+    """
+    transformed_diff = self._embed(validate_vector(u) - validate_vector(v))
+    dist = np.dot(transformed_diff, transformed_diff.T)
+    if not squared:
+      dist = np.sqrt(dist)
+    return dist
+
+  def pairwise(self, U, V=None, squared=False):
+    """Computes the learned distances between all pairs of points, like
+    scipy's `cdist` (or `pdist` in square form if `V` is None).
+
+    Parameters
+    ----------
+    U : array-like, shape=(n_samples_U, n_features)
+      2D array of points.
+
+    V : array-like, shape=(n_samples_V, n_features) or None
+      2D array of points. If None, the distances between the points of `U`
+      are computed, with zeros on the diagonal.
+
+    squared : `bool`, optional (default=False)
+      If True, the squared distances are returned.
+
+    Returns
+    -------
+    distances : `numpy.ndarray`, shape=(n_samples_U, n_samples_V)
+      The distances between every point of `U` and every point of `V`.
+    """
+    U_embedded = self._embed(check_array(U))
+    V_embedded = (U_embedded if V is None else
+                  self._embed(check_array(V)))
+    return np.vstack(list(_embedded_distances_chunked(
+        U_embedded, V_embedded, V is None, squared, None)))
+
+  def paired(self, U, V, squared=False):
+    """Computes the learned distances between the points of `U` and `V`
+    row by row, like sklearn's `paired_distances`.
+
+    Parameters
+    ----------
+    U : array-like, shape=(n_samples, n_features)
+      2D array of points.
+
+    V : array-like, shape=(n_samples, n_features)
+      2D array of points.
+
+    squared : `bool`, optional (default=False)
+      If True, the squared distances are returned.
+
+    Returns
+    -------
+    distances : `numpy.ndarray`, shape=(n_samples,)
+      The distance between every point of `U` and the point of `V` in the
+      same row.
+    """
+    U, V = check_array(U), check_array(V)
+    if U.shape != V.shape:
+      raise ValueError("U and V should have the same shape, but U has shape "
+                       "{} and V has shape {}.".format(U.shape, V.shape))
+    distances = row_norms(self._embed(U - V), squared=True)
+    return distances if squared else np.sqrt(distances)
+
+  def _embed(self, X):
+    """Embeds (differences of) points with the learned transformation."""
+    if self.transformer.ndim == 1:
+      return X * self.transformer
+    return X.dot(self.transformer.T)
+
+
+class _BruteForceIndex(object):
+  """Exact nearest neighbors index of embedded points, searched by brute
+  force, with the methods of scikit-learn's `NearestNeighbors` used by
+  :class:`MahalanobisMixin` (see `build_index`).
+
+  Unlike `NearestNeighbors`, it needs no fit: `load_inference_model` uses it
+  so that loading a model does no work proportional to the number of
+  indexed points, which are only read, from their memory-map, by the
+  queries.
+  """
+
+  def __init__(self, X_embedded):
+    self._fit_X = X_embedded
+    self._norms = None
+
+  def get_params(self):
+    return {'algorithm': 'brute', 'leaf_size': 30}
+
+  def _get_norms(self):
+    # (computed by the first query, rather than when loading the model)
+    if self._norms is None:
+      self._norms = row_norms(self._fit_X, squared=True)
+    return self._norms
+
+  def kneighbors(self, X, n_neighbors=5, return_distance=True):
+    n_indexed = self._fit_X.shape[0]
+    if not 0 < n_neighbors <= n_indexed:
+      raise ValueError("Expected 0 < n_neighbors <= n_indexed, but "
+                       "n_neighbors={} and n_indexed={}."
+                       .format(n_neighbors, n_indexed))
+    norms = self._get_norms()
+    X_norms = row_norms(X, squared=True)[:, np.newaxis]
+
+    def block_distances(indexed_sl):
+      dist = X.dot(self._fit_X[indexed_sl].T)
+      dist *= -2
+      dist += X_norms
+      dist += norms[indexed_sl]
+      return dist
+
+    _, indices = top_k_by_blocks(
+        block_distances, X.shape[0], n_indexed, n_neighbors,
+        get_chunk_n_rows(row_bytes=8 * max(X.shape[0], 1),
+                         max_n_rows=n_indexed))
+    # the expansion of squared norms is not exact, so the distances to the
+    # neighbors found are computed again from the differences of the points
+    differences = X[:, np.newaxis] - self._fit_X[indices]
+    distances = np.sqrt(np.einsum('ijk,ijk->ij', differences, differences))
+    order = np.argsort(distances, axis=1, kind='mergesort')
+    rows = np.arange(X.shape[0])[:, np.newaxis]
+    distances, indices = distances[rows, order], indices[rows, order]
+    return (distances, indices) if return_distance else indices
+
+  def radius_neighbors_graph(self, X, radius, mode='distance'):
+    # (only mode='distance' is used by `MahalanobisMixin.radius_neighbors`)
+    indptr, indices, data = [np.zeros(1, dtype=np.intp)], [], []
+    for D_chunk in _embedded_distances_chunked(X, self._fit_X, False, False,
+                                               None):
+      rows, cols = np.nonzero(D_chunk <= radius)
+      indptr.append(indptr[-1][-1] +
+                    np.cumsum(np.bincount(rows, minlength=D_chunk.shape[0])))
+      indices.append(cols)
+      data.append(D_chunk[rows, cols])
+    return sp.csr_matrix((np.concatenate(data) if data else np.empty(0),
+                          np.concatenate(indices) if indices else
+                          np.empty(0, dtype=np.intp),
+                          np.concatenate(indptr)),
+                         shape=(X.shape[0], self._fit_X.shape[0]))
+
+
+class InferenceModel(MahalanobisMixin):
+  """Mahalanobis metric exported by a metric learner, for inference only.
+
+  Such models are loaded with `load_inference_model` and provide the
+  inference methods of :class:`MahalanobisMixin` (`transform`,
+  `score_pairs`, `kneighbors`...), but no preprocessor: they only take
+  points as inputs, not indicators of points.
+
+  Parameters
+  ----------
+  transformer : `numpy.ndarray`, shape=(num_dims, n_features) or (n_features,)
+    The learned linear transformation ``L``, or its diagonal if it is a
+    diagonal matrix, which can be a memory-map.
+
+  inference_dtype : numpy dtype or None, optional (default=None)
+    See :class:`BaseMetricLearner`.
+
+  n_jobs : int or None, optional (default=None)
+    See :class:`BaseMetricLearner`.
+
+  Attributes
+  ----------
+  transformer_ : `numpy.ndarray`, shape=(num_dims, n_features)
+    The learned linear transformation ``L``.
+  """
+
+  def __init__(self, transformer, inference_dtype=None, n_jobs=None):
+    super(InferenceModel, self).__init__(inference_dtype=inference_dtype,
+                                         n_jobs=n_jobs)
+    self.transformer = transformer
+    self.preprocessor_ = None
+    self._inference_cache = {}
+    if transformer.ndim == 1:
+      self._set_diagonal(transformer)
+    else:
+      self.transformer_ = transformer
+
+  def fit(self, X=None, y=None):
+    """Does nothing: the model has been fitted by the metric learner it was
+    exported from.
+
+    Returns
+    -------
+    self : object
+      Returns the instance itself.
+    """
+    return self
+
+
+class QuantizedModel(MahalanobisMixin):
+  """Mahalanobis metric with a transformation quantized to integers, for
+  inference only.
+
+  Such models are returned by `MahalanobisMixin.quantize`, and provide the
+  inference methods of :class:`MahalanobisMixin` (`transform`,
+  `score_pairs`, `kneighbors`...), which quantize their inputs and embed
+  them with integer values. They cannot be exported nor compressed.
+
+  Parameters
+  ----------
+  quantized_transformer : `numpy.ndarray`, shape=(num_dims, n_features)
+    The quantized transformation, of type int8 or int16.
+
+  scales : `numpy.ndarray`, shape=(num_dims,)
+    The scale of every row of `quantized_transformer`.
+
+  preprocessor : array-like, shape=(n_samples, n_features) or callable
+    The (already checked) preprocessor of the metric learner.
+
+  n_jobs : int or None, optional (default=None)
+    See :class:`BaseMetricLearner`.
+
+  Attributes
+  ----------
+  max_distance_error_ : float or None
+    The maximum difference between the learned and the quantized distances
+    on the validation points given to `quantize`, if any.
+  """
+
+  def __init__(self, quantized_transformer, scales, preprocessor=None,
+               n_jobs=None):
+    super(QuantizedModel, self).__init__(preprocessor=preprocessor,
+                                         n_jobs=n_jobs)
+    self.quantized_transformer = quantized_transformer
+    self.scales = scales
+    self.preprocessor_ = preprocessor
+    self._inference_cache = {}
+
+  @property
+  def transformer_(self):
+    """The dequantized transformation, as float64. It is computed the first
+    time it is accessed (the inference methods do not use it, except for
+    sparse inputs)."""
+    return self._get_cached(
+        'dequantized_transformer', (self.quantized_transformer, self.scales),
+        lambda: self.quantized_transformer * self.scales[:, np.newaxis])
+
+  def fit(self, X=None, y=None):
+    """Does nothing: the model has been fitted by the metric learner it was
+    quantized from.
+
+    Returns
+    -------
+    self : object
+      Returns the instance itself.
+    """
+    return self
+
+  def export_inference_model(self, path):
+    raise TypeError("Quantized models cannot be exported: export the metric "
+                    "learner instead, and quantize the loaded model.")
+
+  def compress(self, rank=None, energy=0.99, X_validation=None):
+    raise TypeError("Quantized models cannot be compressed: compress the "
+                    "metric learner before quantizing it.")
+
+  def _get_inference_factor(self):
+    return self.quantized_transformer
+
+  def _get_fitted_transformer(self):
+    # (the quantized transformation identifies the model without being
+    # dequantized)
+    return self.quantized_transformer
+
+  def _get_metric_structure(self):
+    # (only used by `get_metric` and `get_mahalanobis_matrix`, which need
+    # the dequantized transformation, since `_embed` is overridden)
+    return 'full', self.transformer_
+
+  def _embed(self, X_checked, buffers=None):
+    if sp.issparse(X_checked):
+      return X_checked.dot(self.transformer_.T)
+    X_quantized, X_scales = _quantize_rows(
+        np.asarray(X_checked, dtype=np.float64),
+        self.quantized_transformer.dtype)
+    X_embedded = _integer_dot(X_quantized, self.quantized_transformer)
+    X_embedded = X_embedded * X_scales[:, np.newaxis]
+    X_embedded *= self.scales
+    return X_embedded
+
+
+def load_inference_model(path, mmap_mode='r', n_jobs=None):
+  """Loads a model exported with `export_inference_model`.
+
+  Parameters
+  ----------
+  path : str
+    The directory the model was exported into.
+
+  mmap_mode : {None, 'r+', 'r', 'w+', 'c'}, optional (default='r')
+    The memory-map mode of the loaded arrays (see :func:`numpy.load`). With
+    the default read-only mode, the processes loading the same model share
+    its pages, and loading it does not read the arrays. If None, the arrays
+    are read into memory.
+
+  n_jobs : int or None, optional (default=None)
+    The number of threads used by the inference methods of the model (see
+    :class:`BaseMetricLearner`).
+
+  Returns
+  -------
+  model : `InferenceModel`
+    The loaded model. If an index was exported, `kneighbors` and
+    `radius_neighbors` can be called right away: they search the exported
+    embedding by brute force, from its memory-map, so that no tree is built
+    when loading the model.
+  """
+  with open(os.path.join(path, 'metadata.json')) as f:
+    metadata = json.load(f)
+  if metadata.get('format_version') != _INFERENCE_FORMAT_VERSION:
+    raise ValueError("Unsupported inference model format version {} in {}, "
+                     "expected {}.".format(metadata.get('format_version'),
+                                           path, _INFERENCE_FORMAT_VERSION))
+  transformer = np.load(os.path.join(path, 'transformer.npy'),
+                        mmap_mode=mmap_mode)
+  model = InferenceModel(transformer,
+                         inference_dtype=metadata['inference_dtype'],
+                         n_jobs=n_jobs)
+  if 'index' in metadata:
+    model.index_ = _BruteForceIndex(
+        np.load(os.path.join(path, 'index.npy'), mmap_mode=mmap_mode))
+    model._index_transformer = model._get_fitted_transformer()
+  return model
@@ -7,6 +7,8 @@ import warnings
 from six.moves import xrange
 from scipy.sparse import coo_matrix
 
+from ._util import record_copy
+
 __all__ = ['Constraints']
 
 
@@ -98,4 +100,5 @@ def wrap_pairs(X, constraints):
   constraints = np.vstack((np.column_stack((a, b)), np.column_stack((c, d))))
   y = np.vstack([np.ones((len(a), 1)), - np.ones((len(c), 1))])
   pairs = X[constraints]
+  record_copy(pairs, 'wrap_pairs', source=X)
   return pairs, y
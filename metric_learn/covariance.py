@@ -26,8 +26,35 @@ class Covariance(MahalanobisMixin, TransformerMixin):
       metric (See function `transformer_from_metric`.)
   """
 
-  def __init__(self, preprocessor=None):
-    super(Covariance, self).__init__(preprocessor)
+  def __init__(self, preprocessor=None, cache_embedding=False,
+               inference_dtype=None, n_jobs=None):
+    """Initialize Covariance.
+
+    Parameters
+    ----------
+    preprocessor : array-like, shape=(n_samples, n_features) or callable
+      The preprocessor to call to get tuples from indices. If array-like,
+      tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+      If True and the preprocessor is array-like, the embedding of all its
+      points is computed once, the first time it is needed after fitting,
+      and indicators of points given to `transform` or `score_pairs` are then
+      looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+      If not None, for instance ``np.float32``, the inputs of `transform` and
+      `score_pairs` are converted to this dtype (instead of being upcast to
+      the dtype of ``transformer_``), and they are embedded with a copy of
+      ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+      The number of threads used by `transform` and `score_pairs`, which split
+      their input into as many blocks of rows and process them in parallel.
+      ``None`` means 1 and ``-1`` means using all processors.
+    """
+    super(Covariance, self).__init__(preprocessor, cache_embedding,
+                                     inference_dtype, n_jobs)
 
   def fit(self, X, y=None):
     """
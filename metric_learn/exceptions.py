@@ -10,3 +10,8 @@ class PreprocessorError(Exception):
     err_msg = ("An error occurred when trying to use the "
                "preprocessor: {}").format(repr(original_error))
     super(PreprocessorError, self).__init__(err_msg)
+
+
+class CopyError(Exception):
+  """Raised when input data would have to be copied while copies are
+  forbidden (see :func:`metric_learn.set_config`)."""
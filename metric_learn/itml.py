@@ -31,7 +31,8 @@ class _BaseITML(MahalanobisMixin):
   _tuple_size = 2  # constraints are pairs
 
   def __init__(self, gamma=1., max_iter=1000, convergence_threshold=1e-3,
-               A0=None, verbose=False, preprocessor=None):
+               A0=None, verbose=False, preprocessor=None,
+               cache_embedding=False, inference_dtype=None, n_jobs=None):
     """Initialize ITML.
 
     Parameters
@@ -52,13 +53,33 @@ class _BaseITML(MahalanobisMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform`, `score_pairs` or
+        `decision_function` are then looked up in it instead of being
+        embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`,
+        `score_pairs` and `decision_function` are converted to this dtype
+        (instead of being upcast to the dtype of ``transformer_``), and they
+        are embedded with a copy of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform`, `score_pairs` and
+        `decision_function`, which split their input into as many blocks of
+        rows and process them in parallel. ``None`` means 1 and ``-1`` means
+        using all processors.
     """
     self.gamma = gamma
     self.max_iter = max_iter
     self.convergence_threshold = convergence_threshold
     self.A0 = A0
     self.verbose = verbose
-    super(_BaseITML, self).__init__(preprocessor)
+    super(_BaseITML, self).__init__(preprocessor, cache_embedding,
+                                    inference_dtype, n_jobs)
 
   def _fit(self, pairs, y, bounds=None):
     pairs, y = self._prepare_inputs(pairs, y,
@@ -203,7 +224,8 @@ class ITML_Supervised(_BaseITML, TransformerMixin):
 
   def __init__(self, gamma=1., max_iter=1000, convergence_threshold=1e-3,
                num_labeled='deprecated', num_constraints=None,
-               bounds='deprecated', A0=None, verbose=False, preprocessor=None):
+               bounds='deprecated', A0=None, verbose=False, preprocessor=None,
+               cache_embedding=False, inference_dtype=None, n_jobs=None):
     """Initialize the supervised version of `ITML`.
 
     `ITML_Supervised` creates pairs of similar sample by taking same class
@@ -234,10 +256,29 @@ class ITML_Supervised(_BaseITML, TransformerMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform` or `score_pairs` are
+        then looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`
+        and `score_pairs` are converted to this dtype (instead of being upcast
+        to the dtype of ``transformer_``), and they are embedded with a copy
+        of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform` and `score_pairs`, which
+        split their input into as many blocks of rows and process them in
+        parallel. ``None`` means 1 and ``-1`` means using all processors.
     """
     _BaseITML.__init__(self, gamma=gamma, max_iter=max_iter,
                        convergence_threshold=convergence_threshold,
-                       A0=A0, verbose=verbose, preprocessor=preprocessor)
+                       A0=A0, verbose=verbose, preprocessor=preprocessor,
+                       cache_embedding=cache_embedding,
+                       inference_dtype=inference_dtype, n_jobs=n_jobs)
     self.num_labeled = num_labeled
     self.num_constraints = num_constraints
     self.bounds = bounds
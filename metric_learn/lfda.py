@@ -32,7 +32,8 @@ class LFDA(MahalanobisMixin, TransformerMixin):
   '''
 
   def __init__(self, num_dims=None, k=None, embedding_type='weighted',
-               preprocessor=None):
+               preprocessor=None, cache_embedding=False, inference_dtype=None,
+               n_jobs=None):
     '''
     Initialize LFDA.
 
@@ -54,13 +55,31 @@ class LFDA(MahalanobisMixin, TransformerMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform` or `score_pairs` are
+        then looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`
+        and `score_pairs` are converted to this dtype (instead of being upcast
+        to the dtype of ``transformer_``), and they are embedded with a copy
+        of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform` and `score_pairs`, which
+        split their input into as many blocks of rows and process them in
+        parallel. ``None`` means 1 and ``-1`` means using all processors.
     '''
     if embedding_type not in ('weighted', 'orthonormalized', 'plain'):
       raise ValueError('Invalid embedding_type: %r' % embedding_type)
     self.num_dims = num_dims
     self.embedding_type = embedding_type
     self.k = k
-    super(LFDA, self).__init__(preprocessor)
+    super(LFDA, self).__init__(preprocessor, cache_embedding,
+                               inference_dtype, n_jobs)
 
   def fit(self, X, y):
     '''Fit the LFDA model.
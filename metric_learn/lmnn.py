@@ -23,7 +23,8 @@ from .base_metric import MahalanobisMixin
 class _base_LMNN(MahalanobisMixin, TransformerMixin):
   def __init__(self, k=3, min_iter=50, max_iter=1000, learn_rate=1e-7,
                regularization=0.5, convergence_tol=0.001, use_pca=True,
-               verbose=False, preprocessor=None):
+               verbose=False, preprocessor=None, cache_embedding=False,
+               inference_dtype=None, n_jobs=None):
     """Initialize the LMNN object.
 
     Parameters
@@ -37,6 +38,23 @@ class _base_LMNN(MahalanobisMixin, TransformerMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform` or `score_pairs` are
+        then looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`
+        and `score_pairs` are converted to this dtype (instead of being upcast
+        to the dtype of ``transformer_``), and they are embedded with a copy
+        of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform` and `score_pairs`, which
+        split their input into as many blocks of rows and process them in
+        parallel. ``None`` means 1 and ``-1`` means using all processors.
     """
     self.k = k
     self.min_iter = min_iter
@@ -46,7 +64,8 @@ class _base_LMNN(MahalanobisMixin, TransformerMixin):
     self.convergence_tol = convergence_tol
     self.use_pca = use_pca
     self.verbose = verbose
-    super(_base_LMNN, self).__init__(preprocessor)
+    super(_base_LMNN, self).__init__(preprocessor, cache_embedding,
+                                     inference_dtype, n_jobs)
 
 
 # slower Python version
@@ -207,7 +226,9 @@ class python_LMNN(_base_LMNN):
     return target_neighbors
 
   def _find_impostors(self, furthest_neighbors, X, label_inds):
-    Lx = self.transform(X)
+    # (X is already checked, and training must not depend on the inference
+    # options, such as `inference_dtype`, used by `transform`)
+    Lx = X.dot(self.transformer_.T)
     margin_radii = 1 + _inplace_paired_L2(Lx[furthest_neighbors], Lx)
     impostors = []
     for label in self.labels_[:-1]:
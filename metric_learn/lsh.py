@@ -0,0 +1,353 @@
+"""
+Locality Sensitive Hashing (LSH) index in the learned space
+
+Approximate nearest neighbors search for Mahalanobis metric learners: points
+are embedded with the learned transformation, and the euclidean distance in
+the embedding space is hashed with p-stable (gaussian) random projections
+(Datar et al., 2004). Points which collide with a query in at least one hash
+table are the candidate neighbors, which are then ranked by their exact
+learned distance to the query.
+"""
+
+from __future__ import division, absolute_import
+import time
+import numpy as np
+from six.moves import xrange
+from sklearn.base import BaseEstimator
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.utils import check_random_state, gen_batches, get_chunk_n_rows
+from sklearn.utils.extmath import row_norms
+from sklearn.utils.validation import check_is_fitted
+
+from ._util import make_name
+
+
+class LSHIndex(BaseEstimator):
+  """Locality Sensitive Hashing (LSH) index in the learned space
+
+  Each of the ``n_tables`` hash tables hashes an embedded point ``x`` to the
+  tuple of the ``n_projections`` integers ``floor((a . x + b) / w)``, where
+  ``a`` is a random gaussian vector, ``b`` a random offset in ``[0, w)`` and
+  ``w`` the ``bucket_width``. Two points are all the more likely to collide
+  in a table that they are close: more projections make the buckets more
+  selective (fewer candidates, lower recall), and more tables make it more
+  likely to find the true neighbors (higher recall, more candidates). Use
+  `recall_report` to tune them.
+
+  Parameters
+  ----------
+  metric_learner : `MahalanobisMixin`
+    The fitted metric learner whose learned distance is searched.
+
+  n_tables : int, optional (default=10)
+    Number of hash tables.
+
+  n_projections : int, optional (default=8)
+    Number of random projections concatenated into the key of a table.
+
+  bucket_width : float, optional (default=4.)
+    Width ``w`` of the buckets of the projections, in the units of the
+    learned distance.
+
+  random_state : int, RandomState instance or None, optional (default=None)
+    Seed of the random projections.
+
+  Attributes
+  ----------
+  n_indexed_ : int
+    Number of points in the index.
+
+  projections_ : `numpy.ndarray`, shape=(num_dims, n_tables * n_projections)
+    The random projections of the tables.
+
+  offsets_ : `numpy.ndarray`, shape=(n_tables * n_projections,)
+    The random offsets of the projections.
+
+  tables_ : list of list of tuple
+    The hash tables, each being a list of sorted runs ``(keys, offsets,
+    indices)`` of arrays: ``keys`` are the sorted keys of the non-empty
+    buckets of the run, and the indices of the points of the bucket of
+    ``keys[i]`` are ``indices[offsets[i]:offsets[i + 1]]``. The points
+    inserted by `partial_fit` are hashed into a new run, and the last run is
+    merged with the previous one as long as it is at least as large, so
+    that a table has a logarithmic number of runs, and every point is merged
+    a logarithmic number of times.
+  """
+
+  def __init__(self, metric_learner, n_tables=10, n_projections=8,
+               bucket_width=4., random_state=None):
+    self.metric_learner = metric_learner
+    self.n_tables = n_tables
+    self.n_projections = n_projections
+    self.bucket_width = bucket_width
+    self.random_state = random_state
+
+  def fit(self, X):
+    """Builds the index on points.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples, n_features) or (n_samples,)
+      2D array of points to index, or 1D array of indicators of points if
+      the metric learner uses a preprocessor.
+
+    Returns
+    -------
+    self : object
+      Returns the instance itself.
+    """
+    if self.n_tables < 1 or self.n_projections < 1:
+      raise ValueError("n_tables and n_projections should be positive, but "
+                       "n_tables={} and n_projections={}."
+                       .format(self.n_tables, self.n_projections))
+    if self.bucket_width <= 0:
+      raise ValueError("bucket_width should be positive, but bucket_width={}."
+                       .format(self.bucket_width))
+    transformer = self.metric_learner._get_fitted_transformer()
+    X_embedded = self.metric_learner.transform(X)
+    rng = check_random_state(self.random_state)
+    n_hashes = self.n_tables * self.n_projections
+    self.projections_ = rng.normal(size=(X_embedded.shape[1], n_hashes))
+    self.offsets_ = rng.uniform(0, self.bucket_width, size=n_hashes)
+    # random coefficients combining the integers of the projections of a
+    # table into a single key (collisions between keys only add candidates)
+    self._key_coefs = rng.randint(1, np.iinfo(np.int32).max,
+                                  size=self.n_projections).astype(np.int64)
+    self.tables_ = [[] for _ in xrange(self.n_tables)]
+    self._embedding = np.empty((0, X_embedded.shape[1]),
+                               dtype=X_embedded.dtype)
+    self.n_indexed_ = 0
+    # we keep the transformer the index was built with, to detect a refit
+    self._transformer = transformer
+    self._insert(X_embedded)
+    return self
+
+  def partial_fit(self, X):
+    """Inserts new points in the index, without rebuilding it.
+
+    The new points get the next indices, after the ones of the points
+    already in the index. If the index has not been built yet, it is built
+    on the points (see `fit`).
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples, n_features) or (n_samples,)
+      2D array of points to insert, or 1D array of indicators of points if
+      the metric learner uses a preprocessor.
+
+    Returns
+    -------
+    self : object
+      Returns the instance itself.
+    """
+    if not hasattr(self, 'tables_'):
+      return self.fit(X)
+    self._check_fitted()
+    self._insert(self.metric_learner.transform(X))
+    return self
+
+  def kneighbors(self, X, n_neighbors=5, return_distance=True):
+    """Finds approximate nearest neighbors of points, under the learned
+    metric, among the indexed points.
+
+    If fewer than `n_neighbors` points collide with a query in the hash
+    tables, its last neighbors have an index of -1 and an infinite distance.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    n_neighbors : int, optional (default=5)
+      Number of neighbors to get.
+
+    return_distance : `bool`, optional (default=True)
+      If False, the distances will not be returned.
+
+    Returns
+    -------
+    dist : `numpy.ndarray`, shape=(n_queries, n_neighbors)
+      The learned distances to the neighbors, only present if
+      `return_distance` is True.
+
+    ind : `numpy.ndarray`, shape=(n_queries, n_neighbors)
+      The indices of the nearest points in the indexed points.
+    """
+    self._check_fitted()
+    dist, ind, _ = self._query(self.metric_learner.transform(X), n_neighbors)
+    return (dist, ind) if return_distance else ind
+
+  def recall_report(self, X, n_neighbors=10):
+    """Compares the approximate nearest neighbors of points to the exact
+    ones, to tune the parameters of the index.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    n_neighbors : int, optional (default=10)
+      Number of neighbors to get.
+
+    Returns
+    -------
+    report : dict
+      With the following keys:
+
+      - ``'recall'``: the fraction of the exact nearest neighbors found by
+        the index,
+      - ``'mean_candidates'``: the mean number of candidate neighbors whose
+        distance to a query was computed,
+      - ``'query_time'`` and ``'exact_time'``: the times (in seconds) of the
+        approximate and exact searches of the neighbors of all the points
+        (excluding the embedding of the points),
+      - ``'speedup'``: the ratio of these times.
+    """
+    self._check_fitted()
+    X_embedded = self.metric_learner.transform(X)
+    start_time = time.time()
+    _, ind, n_candidates = self._query(X_embedded, n_neighbors)
+    query_time = time.time() - start_time
+
+    start_time = time.time()
+    distances = euclidean_distances(X_embedded,
+                                    self._embedding[:self.n_indexed_],
+                                    squared=True)
+    n_exact = min(n_neighbors, self.n_indexed_)
+    exact_ind = np.argpartition(distances, n_exact - 1, axis=1)[:, :n_exact]
+    exact_time = time.time() - start_time
+
+    n_found = sum(np.intersect1d(approx, exact).size
+                  for approx, exact in zip(ind, exact_ind))
+    return {'recall': n_found / exact_ind.size,
+            'mean_candidates': np.mean(n_candidates),
+            'query_time': query_time,
+            'exact_time': exact_time,
+            'speedup': exact_time / max(query_time, np.finfo(float).eps)}
+
+  def _hash(self, X_embedded):
+    """Returns the keys of the buckets of embedded points, of shape
+    (n_samples, n_tables)."""
+    projections = np.floor((X_embedded.dot(self.projections_) + self.offsets_)
+                           / self.bucket_width).astype(np.int64)
+    return projections.reshape(-1, self.n_tables,
+                               self.n_projections).dot(self._key_coefs)
+
+  def _insert(self, X_embedded):
+    """Hashes embedded points into a new run of every hash table, and merges
+    the last runs of similar sizes."""
+    n_indexed = self.n_indexed_ + X_embedded.shape[0]
+    self._embedding = _reserve(self._embedding, self.n_indexed_, n_indexed)
+    self._embedding[self.n_indexed_:n_indexed] = X_embedded
+    new_indices = np.arange(self.n_indexed_, n_indexed, dtype=np.intp)
+    for runs, keys in zip(self.tables_, self._hash(X_embedded).T):
+      runs.append(_make_run(keys, new_indices))
+      while len(runs) > 1 and runs[-2][2].size <= runs[-1][2].size:
+        # (the points of the previous run come first, so that the indices of
+        # every bucket stay in increasing order)
+        previous, last = runs.pop(-2), runs.pop()
+        runs.append(_make_run(*[np.concatenate(arrays) for arrays in
+                                zip(_run_points(previous),
+                                    _run_points(last))]))
+    self.n_indexed_ = n_indexed
+
+  def _query(self, X_embedded, n_neighbors):
+    """Returns the distances and indices of the approximate nearest
+    neighbors of embedded points, and their numbers of candidates."""
+    if n_neighbors < 1:
+      raise ValueError("Expected n_neighbors > 0, but n_neighbors={}."
+                       .format(n_neighbors))
+    n_queries = X_embedded.shape[0]
+    dist = np.full((n_queries, n_neighbors), np.inf)
+    ind = np.full((n_queries, n_neighbors), -1, dtype=np.intp)
+    # the buckets of all the queries are looked up at once in every run of
+    # every table, giving the (query, candidate) pairs
+    pairs = [np.empty(0, dtype=np.int64)]
+    for runs, query_keys in zip(self.tables_, self._hash(X_embedded).T):
+      for keys, offsets, indices in runs:
+        positions, queries = _concatenated_ranges(
+            *_bucket_bounds(keys, offsets, query_keys))
+        pairs.append(queries.astype(np.int64) * self.n_indexed_ +
+                     indices[positions])
+    # (a point colliding with a query in several tables is a single
+    # candidate, and the pairs are sorted by query)
+    pairs = np.unique(np.concatenate(pairs))
+    queries, candidates = np.divmod(pairs, max(self.n_indexed_, 1))
+    n_candidates = np.bincount(queries, minlength=n_queries)
+    distances = np.empty(pairs.size)
+    for sl in gen_batches(pairs.size, get_chunk_n_rows(
+            row_bytes=16 * X_embedded.shape[1], max_n_rows=pairs.size)):
+      distances[sl] = row_norms(self._embedding[candidates[sl]] -
+                                X_embedded[queries[sl]], squared=True)
+    # the candidates of every query are ranked by distance, and the first
+    # `n_neighbors` ones are kept
+    order = np.lexsort((distances, queries))
+    ranks = (np.arange(pairs.size) -
+             np.repeat(np.cumsum(n_candidates) - n_candidates, n_candidates))
+    kept = order[ranks < n_neighbors]
+    ranks = ranks[ranks < n_neighbors]
+    dist[queries[kept], ranks] = np.sqrt(distances[kept])
+    ind[queries[kept], ranks] = candidates[kept]
+    return dist, ind, n_candidates
+
+  def _check_fitted(self):
+    """Checks that the index has been built with the current fit of the
+    metric learner."""
+    check_is_fitted(self, ['tables_'])
+    if (self._transformer is not
+            self.metric_learner._get_fitted_transformer()):
+      raise ValueError("The LSH index was built before {} was last fitted. "
+                       "Call `fit` again."
+                       .format(make_name(self.metric_learner)))
+
+
+def _reserve(array, n_used, n_rows):
+  """Returns `array`, or a copy of its first `n_used` rows with room for at
+  least `n_rows` rows (the capacity is doubled, so that appending rows is
+  amortized)."""
+  if n_rows <= array.shape[0]:
+    return array
+  reserved = np.empty((max(n_rows, 2 * array.shape[0]),) + array.shape[1:],
+                      dtype=array.dtype)
+  reserved[:n_used] = array[:n_used]
+  return reserved
+
+
+def _make_run(keys, indices):
+  """Returns the sorted run ``(keys, offsets, indices)`` of a hash table (see
+  `LSHIndex.tables_`) holding the points of `indices`, hashed to `keys`."""
+  # (the stable sort keeps the indices of every bucket in their order)
+  order = np.argsort(keys, kind='mergesort')
+  bucket_keys, starts = np.unique(keys[order], return_index=True)
+  return (bucket_keys, np.append(starts, order.size).astype(np.intp),
+          indices[order])
+
+
+def _run_points(run):
+  """Returns the keys and the indices of the points of a run."""
+  keys, offsets, indices = run
+  return np.repeat(keys, np.diff(offsets)), indices
+
+
+def _concatenated_ranges(starts, ends):
+  """Returns the concatenation of the ranges ``[starts[i], ends[i])``, and
+  for each of its elements, the index ``i`` of its range."""
+  lengths = ends - starts
+  owners = np.repeat(np.arange(lengths.size), lengths)
+  return (np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) +
+                                               lengths, lengths),
+          owners)
+
+
+def _bucket_bounds(keys, offsets, query_keys):
+  """Returns the start and end offsets of the buckets of `query_keys` in a
+  hash table with sorted `keys` and bucket `offsets`, both empty for the
+  keys of no bucket."""
+  positions = np.searchsorted(keys, query_keys)
+  found = positions < keys.size
+  found[found] = keys[positions[found]] == query_keys[found]
+  starts = np.where(found, offsets[np.minimum(positions, keys.size)], 0)
+  ends = np.where(found, offsets[np.minimum(positions + 1, keys.size)], 0)
+  return starts, ends
@@ -24,7 +24,8 @@ class _BaseLSML(MahalanobisMixin):
   _tuple_size = 4  # constraints are quadruplets
 
   def __init__(self, tol=1e-3, max_iter=1000, prior=None, verbose=False,
-               preprocessor=None):
+               preprocessor=None, cache_embedding=False, inference_dtype=None,
+               n_jobs=None):
     """Initialize LSML.
 
     Parameters
@@ -38,12 +39,32 @@ class _BaseLSML(MahalanobisMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform`, `score_pairs` or
+        `decision_function` are then looked up in it instead of being
+        embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`,
+        `score_pairs` and `decision_function` are converted to this dtype
+        (instead of being upcast to the dtype of ``transformer_``), and they
+        are embedded with a copy of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform`, `score_pairs` and
+        `decision_function`, which split their input into as many blocks of
+        rows and process them in parallel. ``None`` means 1 and ``-1`` means
+        using all processors.
     """
     self.prior = prior
     self.tol = tol
     self.max_iter = max_iter
     self.verbose = verbose
-    super(_BaseLSML, self).__init__(preprocessor)
+    super(_BaseLSML, self).__init__(preprocessor, cache_embedding,
+                                    inference_dtype, n_jobs)
 
   def _fit(self, quadruplets, y=None, weights=None):
     quadruplets = self._prepare_inputs(quadruplets,
@@ -183,7 +204,8 @@ class LSML_Supervised(_BaseLSML, TransformerMixin):
   def __init__(self, tol=1e-3, max_iter=1000, prior=None,
                num_labeled='deprecated', num_constraints=None, weights=None,
                verbose=False,
-               preprocessor=None):
+               preprocessor=None, cache_embedding=False, inference_dtype=None,
+               n_jobs=None):
     """Initialize the supervised version of `LSML`.
 
     `LSML_Supervised` creates quadruplets from labeled samples by taking two
@@ -210,9 +232,28 @@ class LSML_Supervised(_BaseLSML, TransformerMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform` or `score_pairs` are
+        then looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`
+        and `score_pairs` are converted to this dtype (instead of being upcast
+        to the dtype of ``transformer_``), and they are embedded with a copy
+        of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform` and `score_pairs`, which
+        split their input into as many blocks of rows and process them in
+        parallel. ``None`` means 1 and ``-1`` means using all processors.
     """
     _BaseLSML.__init__(self, tol=tol, max_iter=max_iter, prior=prior,
-                       verbose=verbose, preprocessor=preprocessor)
+                       verbose=verbose, preprocessor=preprocessor,
+                       cache_embedding=cache_embedding,
+                       inference_dtype=inference_dtype, n_jobs=n_jobs)
     self.num_labeled = num_labeled
     self.num_constraints = num_constraints
     self.weights = weights
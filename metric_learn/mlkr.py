@@ -38,7 +38,8 @@ class MLKR(MahalanobisMixin, TransformerMixin):
   """
 
   def __init__(self, num_dims=None, A0=None, tol=None, max_iter=1000,
-               verbose=False, preprocessor=None):
+               verbose=False, preprocessor=None, cache_embedding=False,
+               inference_dtype=None, n_jobs=None):
     """
     Initialize MLKR.
 
@@ -62,13 +63,31 @@ class MLKR(MahalanobisMixin, TransformerMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform` or `score_pairs` are
+        then looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`
+        and `score_pairs` are converted to this dtype (instead of being upcast
+        to the dtype of ``transformer_``), and they are embedded with a copy
+        of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform` and `score_pairs`, which
+        split their input into as many blocks of rows and process them in
+        parallel. ``None`` means 1 and ``-1`` means using all processors.
     """
     self.num_dims = num_dims
     self.A0 = A0
     self.tol = tol
     self.max_iter = max_iter
     self.verbose = verbose
-    super(MLKR, self).__init__(preprocessor)
+    super(MLKR, self).__init__(preprocessor, cache_embedding,
+                               inference_dtype, n_jobs)
 
   def fit(self, X, y):
       """
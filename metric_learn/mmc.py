@@ -35,7 +35,8 @@ class _BaseMMC(MahalanobisMixin):
 
   def __init__(self, max_iter=100, max_proj=10000, convergence_threshold=1e-3,
                A0=None, diagonal=False, diagonal_c=1.0, verbose=False,
-               preprocessor=None):
+               preprocessor=None, cache_embedding=False, inference_dtype=None,
+               n_jobs=None):
     """Initialize MMC.
     Parameters
     ----------
@@ -56,6 +57,25 @@ class _BaseMMC(MahalanobisMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be gotten like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform`, `score_pairs` or
+        `decision_function` are then looked up in it instead of being
+        embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`,
+        `score_pairs` and `decision_function` are converted to this dtype
+        (instead of being upcast to the dtype of ``transformer_``), and they
+        are embedded with a copy of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform`, `score_pairs` and
+        `decision_function`, which split their input into as many blocks of
+        rows and process them in parallel. ``None`` means 1 and ``-1`` means
+        using all processors.
     """
     self.max_iter = max_iter
     self.max_proj = max_proj
@@ -64,7 +84,8 @@ class _BaseMMC(MahalanobisMixin):
     self.diagonal = diagonal
     self.diagonal_c = diagonal_c
     self.verbose = verbose
-    super(_BaseMMC, self).__init__(preprocessor)
+    super(_BaseMMC, self).__init__(preprocessor, cache_embedding,
+                                   inference_dtype, n_jobs)
 
   def _fit(self, pairs, y):
     pairs, y = self._prepare_inputs(pairs, y,
@@ -267,7 +288,8 @@ class _BaseMMC(MahalanobisMixin):
 
     self.A_ = np.diag(w)
 
-    self.transformer_ = transformer_from_metric(self.A_)
+    # (only the diagonal of the transformation is stored)
+    self._set_diagonal(np.sqrt(w))
     return self
 
   def _fD(self, neg_pairs, A):
@@ -398,7 +420,8 @@ class MMC_Supervised(_BaseMMC, TransformerMixin):
   def __init__(self, max_iter=100, max_proj=10000, convergence_threshold=1e-6,
                num_labeled='deprecated', num_constraints=None, A0=None,
                diagonal=False, diagonal_c=1.0, verbose=False,
-               preprocessor=None):
+               preprocessor=None, cache_embedding=False, inference_dtype=None,
+               n_jobs=None):
     """Initialize the supervised version of `MMC`.
 
     `MMC_Supervised` creates pairs of similar sample by taking same class
@@ -430,11 +453,30 @@ class MMC_Supervised(_BaseMMC, TransformerMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform` or `score_pairs` are
+        then looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`
+        and `score_pairs` are converted to this dtype (instead of being upcast
+        to the dtype of ``transformer_``), and they are embedded with a copy
+        of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform` and `score_pairs`, which
+        split their input into as many blocks of rows and process them in
+        parallel. ``None`` means 1 and ``-1`` means using all processors.
     """
     _BaseMMC.__init__(self, max_iter=max_iter, max_proj=max_proj,
                       convergence_threshold=convergence_threshold,
                       A0=A0, diagonal=diagonal, diagonal_c=diagonal_c,
-                      verbose=verbose, preprocessor=preprocessor)
+                      verbose=verbose, preprocessor=preprocessor,
+                      cache_embedding=cache_embedding,
+                      inference_dtype=inference_dtype, n_jobs=n_jobs)
     self.num_labeled = num_labeled
     self.num_constraints = num_constraints
 
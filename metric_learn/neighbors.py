@@ -0,0 +1,234 @@
+"""
+Nearest neighbors estimators in the learned space
+
+k-nearest neighbors classifier and regressor for Mahalanobis metric learners:
+the metric learner is fitted on the training set, which is embedded once with
+the learned transformation and stored in a scikit-learn nearest neighbors
+estimator. Since the learned distance is the euclidean distance between the
+embedded points, the neighbors are then searched with trees or blocked
+euclidean distances, instead of calling a Python metric for every pair of
+points, and every batch of queries is embedded only once.
+"""
+
+from __future__ import absolute_import
+from sklearn.base import BaseEstimator, ClassifierMixin, RegressorMixin, clone
+from sklearn.neighbors import KNeighborsClassifier, KNeighborsRegressor
+from sklearn.utils.validation import check_is_fitted
+
+
+class _BaseMetricKNeighbors(BaseEstimator):
+  """Base class for the nearest neighbors estimators in the learned space.
+
+  Subclasses define the scikit-learn estimator searching the neighbors in
+  ``_neighbors_estimator``.
+  """
+
+  def __init__(self, metric_learner, n_neighbors=5, weights='uniform',
+               algorithm='auto', leaf_size=30, n_jobs=None):
+    self.metric_learner = metric_learner
+    self.n_neighbors = n_neighbors
+    self.weights = weights
+    self.algorithm = algorithm
+    self.leaf_size = leaf_size
+    self.n_jobs = n_jobs
+
+  def fit(self, X, y):
+    """Fits a clone of the metric learner on the training set, and stores
+    the embedded training set.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples, n_features) or (n_samples,)
+      2D array of training points, or 1D array of indicators of points if
+      the metric learner uses a preprocessor.
+
+    y : array-like, shape=(n_samples,)
+      The training targets.
+
+    Returns
+    -------
+    self : object
+      Returns the instance itself.
+    """
+    self.metric_learner_ = clone(self.metric_learner).fit(X, y)
+    self.estimator_ = self._neighbors_estimator(
+        n_neighbors=self.n_neighbors, weights=self.weights,
+        algorithm=self.algorithm, leaf_size=self.leaf_size,
+        n_jobs=self.n_jobs)
+    self.estimator_.fit(self.metric_learner_.transform(X), y)
+    return self
+
+  def kneighbors(self, X, n_neighbors=None, return_distance=True):
+    """Finds the nearest neighbors of points, under the learned metric,
+    among the training points.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    n_neighbors : int or None, optional (default=None)
+      Number of neighbors to get. If None, `n_neighbors` of the estimator is
+      used.
+
+    return_distance : `bool`, optional (default=True)
+      If False, the distances will not be returned.
+
+    Returns
+    -------
+    dist : `numpy.ndarray`, shape=(n_queries, n_neighbors)
+      The learned distances to the neighbors, only present if
+      `return_distance` is True.
+
+    ind : `numpy.ndarray`, shape=(n_queries, n_neighbors)
+      The indices of the nearest points in the training set.
+    """
+    X_embedded = self._embed(X)
+    return self.estimator_.kneighbors(X_embedded, n_neighbors,
+                                      return_distance)
+
+  def _embed(self, X):
+    """Embeds query points with the fitted metric learner."""
+    check_is_fitted(self, ['estimator_'])
+    return self.metric_learner_.transform(X)
+
+
+class MetricKNeighborsClassifier(_BaseMetricKNeighbors, ClassifierMixin):
+  """k-nearest neighbors classifier in the learned space
+
+  Parameters
+  ----------
+  metric_learner : `MahalanobisMixin`
+    The supervised metric learner, fitted (as a clone) on the training set
+    by `fit`.
+
+  n_neighbors : int, optional (default=5)
+    Number of neighbors voting for the class of a query.
+
+  weights : str or callable, optional (default='uniform')
+    The weights of the votes of the neighbors, see
+    :class:`sklearn.neighbors.KNeighborsClassifier`.
+
+  algorithm : {'auto', 'ball_tree', 'kd_tree', 'brute'}, optional
+    The algorithm searching the neighbors in the embedding space, see
+    :class:`sklearn.neighbors.KNeighborsClassifier`.
+
+  leaf_size : int, optional (default=30)
+    The leaf size of the trees.
+
+  n_jobs : int or None, optional (default=None)
+    The number of jobs searching the neighbors.
+
+  Attributes
+  ----------
+  metric_learner_ : `MahalanobisMixin`
+    The metric learner fitted on the training set.
+
+  estimator_ : :class:`sklearn.neighbors.KNeighborsClassifier`
+    The classifier fitted on the embedded training set.
+
+  classes_ : `numpy.ndarray`, shape=(n_classes,)
+    The class labels.
+  """
+
+  _neighbors_estimator = KNeighborsClassifier
+
+  def fit(self, X, y):
+    super(MetricKNeighborsClassifier, self).fit(X, y)
+    self.classes_ = self.estimator_.classes_
+    return self
+
+  fit.__doc__ = _BaseMetricKNeighbors.fit.__doc__
+
+  def predict(self, X):
+    """Predicts the classes of points from the classes of their nearest
+    neighbors under the learned metric.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    Returns
+    -------
+    y : `numpy.ndarray`, shape=(n_queries,)
+      The predicted classes.
+    """
+    X_embedded = self._embed(X)
+    return self.estimator_.predict(X_embedded)
+
+  def predict_proba(self, X):
+    """Predicts the probabilities of the classes of points, as the weighted
+    votes of their nearest neighbors under the learned metric.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    Returns
+    -------
+    p : `numpy.ndarray`, shape=(n_queries, n_classes)
+      The probabilities of the classes, ordered as in ``classes_``.
+    """
+    X_embedded = self._embed(X)
+    return self.estimator_.predict_proba(X_embedded)
+
+
+class MetricKNeighborsRegressor(_BaseMetricKNeighbors, RegressorMixin):
+  """k-nearest neighbors regressor in the learned space
+
+  Parameters
+  ----------
+  metric_learner : `MahalanobisMixin`
+    The supervised metric learner (for instance `MLKR`), fitted (as a clone)
+    on the training set by `fit`.
+
+  n_neighbors : int, optional (default=5)
+    Number of neighbors whose targets are averaged.
+
+  weights : str or callable, optional (default='uniform')
+    The weights of the neighbors in the average, see
+    :class:`sklearn.neighbors.KNeighborsRegressor`.
+
+  algorithm : {'auto', 'ball_tree', 'kd_tree', 'brute'}, optional
+    The algorithm searching the neighbors in the embedding space, see
+    :class:`sklearn.neighbors.KNeighborsRegressor`.
+
+  leaf_size : int, optional (default=30)
+    The leaf size of the trees.
+
+  n_jobs : int or None, optional (default=None)
+    The number of jobs searching the neighbors.
+
+  Attributes
+  ----------
+  metric_learner_ : `MahalanobisMixin`
+    The metric learner fitted on the training set.
+
+  estimator_ : :class:`sklearn.neighbors.KNeighborsRegressor`
+    The regressor fitted on the embedded training set.
+  """
+
+  _neighbors_estimator = KNeighborsRegressor
+
+  def predict(self, X):
+    """Predicts the targets of points by averaging the targets of their
+    nearest neighbors under the learned metric.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    Returns
+    -------
+    y : `numpy.ndarray`, shape=(n_queries,) or (n_queries, n_outputs)
+      The predicted targets.
+    """
+    X_embedded = self._embed(X)
+    return self.estimator_.predict(X_embedded)
@@ -0,0 +1,254 @@
+"""
+Product Quantization (PQ) index in the learned space
+
+Compressed nearest neighbors search for Mahalanobis metric learners: points
+are embedded with the learned transformation, the embedding space is split
+into subspaces, and every embedded point is stored as the indices (codes) of
+its nearest centroids in codebooks learned by k-means in every subspace
+(Jegou et al., 2011). The distances between a query and the stored points
+are then approximated by the distances between the query and the centroids
+of their codes (asymmetric distance computation), which are summed from
+lookup tables computed once per query.
+"""
+
+from __future__ import division, absolute_import
+import numpy as np
+from sklearn.base import BaseEstimator
+from sklearn.cluster import KMeans
+from sklearn.metrics.pairwise import (euclidean_distances,
+                                      pairwise_distances_argmin)
+from sklearn.utils import check_random_state, gen_batches
+from sklearn.utils.validation import check_is_fitted
+
+from ._util import make_name, top_k_by_blocks
+
+
+class PQIndex(BaseEstimator):
+  """Product Quantization (PQ) index in the learned space
+
+  Every indexed point is stored as ``n_subspaces`` codes of one byte
+  (instead of ``num_dims`` floats of eight bytes), so that an index with
+  ``n_subspaces = num_dims / 4`` for instance takes 32 times less memory
+  than the embedded points. The distances to the indexed points are
+  approximate: the more subspaces and clusters, the more accurate (and the
+  larger) the index.
+
+  Parameters
+  ----------
+  metric_learner : `MahalanobisMixin`
+    The fitted metric learner whose learned distance is searched.
+
+  n_subspaces : int, optional (default=8)
+    Number of subspaces the embedding space is split into (the dimensions
+    are split as evenly as possible), i.e. number of codes of every point.
+
+  n_clusters : int, optional (default=256)
+    Number of centroids of the codebook of every subspace, at most 256 so
+    that the codes fit in one byte.
+
+  max_iter : int, optional (default=20)
+    Maximum number of iterations of the k-means training the codebooks.
+
+  random_state : int, RandomState instance or None, optional (default=None)
+    Seed of the k-means initializations.
+
+  Attributes
+  ----------
+  n_indexed_ : int
+    Number of points in the index.
+
+  subspaces_ : list of slice
+    The dimensions of the embedding space in every subspace.
+
+  codebooks_ : list of `numpy.ndarray`, of shape=(n_clusters, subspace_dim)
+    The centroids of every subspace.
+
+  codes_ : `numpy.ndarray`, shape=(n_indexed_, n_subspaces), dtype=uint8
+    The codes of the indexed points.
+  """
+
+  def __init__(self, metric_learner, n_subspaces=8, n_clusters=256,
+               max_iter=20, random_state=None):
+    self.metric_learner = metric_learner
+    self.n_subspaces = n_subspaces
+    self.n_clusters = n_clusters
+    self.max_iter = max_iter
+    self.random_state = random_state
+
+  def fit(self, X):
+    """Trains the codebooks on points, and indexes them.
+
+    The codebooks can be trained on a sample of the points to index, the
+    others being then inserted with `partial_fit`.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples, n_features) or (n_samples,)
+      2D array of points to index, or 1D array of indicators of points if
+      the metric learner uses a preprocessor.
+
+    Returns
+    -------
+    self : object
+      Returns the instance itself.
+    """
+    if not 0 < self.n_clusters <= 256:
+      raise ValueError("Expected 0 < n_clusters <= 256, but n_clusters={}."
+                       .format(self.n_clusters))
+    transformer = self.metric_learner._get_fitted_transformer()
+    X_embedded = self.metric_learner.transform(X)
+    num_dims = X_embedded.shape[1]
+    if not 0 < self.n_subspaces <= num_dims:
+      raise ValueError("Expected 0 < n_subspaces <= num_dims, but "
+                       "n_subspaces={} and num_dims={}."
+                       .format(self.n_subspaces, num_dims))
+    rng = check_random_state(self.random_state)
+    bounds = np.cumsum([0] + [len(dims) for dims in
+                              np.array_split(np.arange(num_dims),
+                                             self.n_subspaces)])
+    self.subspaces_ = [slice(start, stop) for start, stop
+                       in zip(bounds[:-1], bounds[1:])]
+    self.codebooks_ = [KMeans(n_clusters=self.n_clusters, n_init=1,
+                              max_iter=self.max_iter, random_state=rng)
+                       .fit(X_embedded[:, subspace]).cluster_centers_
+                       for subspace in self.subspaces_]
+    self.codes_ = self._encode(X_embedded)
+    self.n_indexed_ = self.codes_.shape[0]
+    # we keep the transformer the index was built with, to detect a refit
+    self._transformer = transformer
+    return self
+
+  def partial_fit(self, X):
+    """Inserts new points in the index, with the codebooks already trained.
+
+    The new points get the next indices, after the ones of the points
+    already in the index. If the index has not been built yet, it is built
+    on the points (see `fit`).
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples, n_features) or (n_samples,)
+      2D array of points to insert, or 1D array of indicators of points if
+      the metric learner uses a preprocessor.
+
+    Returns
+    -------
+    self : object
+      Returns the instance itself.
+    """
+    if not hasattr(self, 'codes_'):
+      return self.fit(X)
+    self._check_fitted()
+    self.codes_ = np.vstack([self.codes_,
+                             self._encode(self.metric_learner.transform(X))])
+    self.n_indexed_ = self.codes_.shape[0]
+    return self
+
+  def kneighbors(self, X, n_neighbors=5, return_distance=True,
+                 batch_size=1000, gallery_batch_size=None):
+    """Finds approximate nearest neighbors of points, under the learned
+    metric, among the indexed points.
+
+    The codes of the indexed points are scanned by blocks of
+    `gallery_batch_size`, for blocks of `batch_size` queries, only keeping
+    the best candidates found so far (see `MahalanobisMixin.retrieve`).
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    n_neighbors : int, optional (default=5)
+      Number of neighbors to get.
+
+    return_distance : `bool`, optional (default=True)
+      If False, the distances will not be returned.
+
+    batch_size : int, optional (default=1000)
+      Number of queries processed at once.
+
+    gallery_batch_size : int or None, optional (default=None)
+      Number of indexed points compared at once with a block of queries. If
+      None, all the indexed points are compared at once.
+
+    Returns
+    -------
+    dist : `numpy.ndarray`, shape=(n_queries, n_neighbors)
+      The approximate learned distances to the neighbors, only present if
+      `return_distance` is True.
+
+    ind : `numpy.ndarray`, shape=(n_queries, n_neighbors)
+      The indices of the nearest points in the indexed points.
+    """
+    self._check_fitted()
+    if not 0 < n_neighbors <= self.n_indexed_:
+      raise ValueError("Expected 0 < n_neighbors <= n_indexed, but "
+                       "n_neighbors={} and n_indexed={}."
+                       .format(n_neighbors, self.n_indexed_))
+    if gallery_batch_size is None:
+      gallery_batch_size = self.n_indexed_
+    X_embedded = self.metric_learner.transform(X)
+    n_queries = X_embedded.shape[0]
+    distances = np.empty((n_queries, n_neighbors))
+    indices = np.empty((n_queries, n_neighbors), dtype=np.intp)
+    for sl in gen_batches(n_queries, batch_size):
+      tables = self._lookup_tables(X_embedded[sl])
+
+      def block_distances(gallery_sl):
+        codes = self.codes_[gallery_sl]
+        dist = tables[0][:, codes[:, 0]]
+        for m in range(1, len(tables)):
+          dist += tables[m][:, codes[:, m]]
+        return dist
+
+      distances[sl], indices[sl] = top_k_by_blocks(
+          block_distances, tables[0].shape[0], self.n_indexed_, n_neighbors,
+          gallery_batch_size)
+    if not return_distance:
+      return indices
+    return np.sqrt(distances, out=distances), indices
+
+  def decode(self, codes=None):
+    """Returns the approximations of embedded points given by their codes.
+
+    Parameters
+    ----------
+    codes : array-like, shape=(n_samples, n_subspaces) or None
+      Codes of points. If None, the codes of the indexed points are decoded.
+
+    Returns
+    -------
+    X_embedded : `numpy.ndarray`, shape=(n_samples, num_dims)
+      The centroids of the codes of every point, concatenated.
+    """
+    self._check_fitted()
+    codes = self.codes_ if codes is None else np.asarray(codes)
+    return np.hstack([codebook[codes[:, m]] for m, codebook
+                      in enumerate(self.codebooks_)])
+
+  def _encode(self, X_embedded):
+    """Returns the codes of embedded points."""
+    codes = np.empty((X_embedded.shape[0], self.n_subspaces), dtype=np.uint8)
+    for m, (subspace, codebook) in enumerate(zip(self.subspaces_,
+                                                 self.codebooks_)):
+      codes[:, m] = pairwise_distances_argmin(X_embedded[:, subspace],
+                                              codebook)
+    return codes
+
+  def _lookup_tables(self, X_embedded):
+    """Returns, for every subspace, the squared distances between embedded
+    points and the centroids, of shape (n_samples, n_clusters)."""
+    return [euclidean_distances(X_embedded[:, subspace], codebook,
+                                squared=True)
+            for subspace, codebook in zip(self.subspaces_, self.codebooks_)]
+
+  def _check_fitted(self):
+    """Checks that the index has been built with the current fit of the
+    metric learner."""
+    check_is_fitted(self, ['codes_'])
+    if (self._transformer is not
+            self.metric_learner._get_fitted_transformer()):
+      raise ValueError("The PQ index was built before {} was last fitted. "
+                       "Call `fit` again."
+                       .format(make_name(self.metric_learner)))
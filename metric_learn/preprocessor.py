@@ -0,0 +1,173 @@
+"""
+Caching of callable preprocessors
+
+A callable preprocessor (see :ref:`preprocessor_section`) is called by the
+metric learners on the indicators of the points of every input, so the
+points that appear in many inputs (like the popular items of a
+recommendation service) are formed again at every call, for instance by
+decoding the same images. `CachedPreprocessor` wraps such a callable to keep
+the most recently used points in memory, up to a budget of bytes.
+"""
+
+from __future__ import absolute_import
+from collections import OrderedDict
+import threading
+import numpy as np
+import scipy.sparse as sp
+
+
+class CachedPreprocessor(object):
+  """Callable preprocessor keeping the points it forms in a LRU cache
+
+  The points are cached by indicator (for instance by index or by file
+  path), so the indicators must be hashable. On every call, the points of
+  the indicators in the cache are taken from it, and the wrapped
+  preprocessor is called once on the distinct other indicators. The points
+  it returns are then added to the cache, from which the least recently used
+  points are evicted as long as it holds more than `max_bytes` bytes. If the
+  wrapped preprocessor does not return a dense array with one point per
+  indicator, its result is returned as it is, without being cached.
+
+  It can be used as the ``preprocessor`` of any metric learner, and called
+  from several threads.
+
+  Parameters
+  ----------
+  preprocessor : callable
+    The preprocessor to cache, taking a 1D array-like of indicators and
+    returning the 2D array-like of the points of the indicators.
+
+  max_bytes : int, optional (default=268435456)
+    Maximum number of bytes of the points in the cache (256 MiB by
+    default).
+
+  Examples
+  --------
+  ::
+
+    def find_images(file_paths):
+      return np.row_stack([imread(f).ravel() for f in file_paths])
+
+    nca = NCA(preprocessor=CachedPreprocessor(find_images,
+                                              max_bytes=2 ** 30))
+    nca.fit(['img01.png', 'img00.png', 'img02.png'], [1, 0, 1])
+    nca.transform(['img01.png'])  # the image is taken from the cache
+    nca.preprocessor_.stats()  # {'n_hits': 1, 'n_misses': 3, ...}
+  """
+
+  def __init__(self, preprocessor, max_bytes=2 ** 28):
+    if not callable(preprocessor):
+      raise ValueError("The preprocessor to cache should be a callable, got "
+                       "{}.".format(type(preprocessor)))
+    if max_bytes < 0:
+      raise ValueError("max_bytes should be non-negative, got {}."
+                       .format(max_bytes))
+    self.preprocessor = preprocessor
+    self.max_bytes = max_bytes
+    self._init_cache()
+
+  def _init_cache(self):
+    self._lock = threading.Lock()
+    self._points = OrderedDict()
+    self._nbytes = 0
+    self._n_hits = 0
+    self._n_misses = 0
+    self._n_evictions = 0
+
+  def __getstate__(self):
+    # the lock cannot be pickled (nor deep-copied, as when the metric learner
+    # is cloned), and the cached points are not worth storing
+    return {'preprocessor': self.preprocessor, 'max_bytes': self.max_bytes}
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._init_cache()
+
+  def __call__(self, indicators):
+    """Forms the points of indicators, from the cache when possible.
+
+    Parameters
+    ----------
+    indicators : array-like, shape=(n_indicators,)
+      The hashable indicators of the points.
+
+    Returns
+    -------
+    points : array-like, shape=(n_indicators, n_features)
+      The points of the indicators.
+    """
+    indicators = list(indicators)
+    rows = [None] * len(indicators)
+    missing = OrderedDict()
+    with self._lock:
+      for i, indicator in enumerate(indicators):
+        point = self._points.pop(indicator, None)
+        if point is not None:
+          # reinserted as the most recently used point
+          self._points[indicator] = point
+          rows[i] = point
+          self._n_hits += 1
+        else:
+          missing.setdefault(indicator, []).append(i)
+          self._n_misses += 1
+    if not missing:
+      return np.array(rows)
+    new_points = self.preprocessor(np.array(list(missing)))
+    if (sp.issparse(new_points) or np.ndim(new_points) < 1 or
+            np.shape(new_points)[0] != len(missing)):
+      # the points cannot be split by indicator, so they are all formed
+      if len(missing) == len(indicators):
+        return new_points
+      return self.preprocessor(np.array(indicators))
+    new_points = np.asarray(new_points)
+    with self._lock:
+      for indicator, point in zip(missing, new_points):
+        # copied so that the cache does not keep alive the whole batch
+        point = point.copy()
+        for i in missing[indicator]:
+          rows[i] = point
+        self._add(indicator, point)
+    return np.array(rows)
+
+  def _add(self, indicator, point):
+    """Adds a point to the cache and evicts the least recently used points
+    beyond the budget (called with the lock held)."""
+    if point.nbytes > self.max_bytes:
+      return
+    old_point = self._points.pop(indicator, None)
+    if old_point is not None:
+      # formed concurrently by another thread
+      self._nbytes -= old_point.nbytes
+    self._points[indicator] = point
+    self._nbytes += point.nbytes
+    while self._nbytes > self.max_bytes:
+      _, evicted = self._points.popitem(last=False)
+      self._nbytes -= evicted.nbytes
+      self._n_evictions += 1
+
+  def stats(self):
+    """Returns statistics on the cache.
+
+    Returns
+    -------
+    stats : dict
+      With the following keys:
+
+      - ``'n_hits'`` and ``'n_misses'``: the numbers of indicators whose
+        points were found in the cache and formed by the preprocessor,
+      - ``'n_evictions'``: the number of points evicted from the cache,
+      - ``'n_points'`` and ``'nbytes'``: the number of points in the cache
+        and their size in bytes.
+    """
+    with self._lock:
+      return {'n_hits': self._n_hits,
+              'n_misses': self._n_misses,
+              'n_evictions': self._n_evictions,
+              'n_points': len(self._points),
+              'nbytes': self._nbytes}
+
+  def clear(self):
+    """Empties the cache (the statistics are kept)."""
+    with self._lock:
+      self._points.clear()
+      self._nbytes = 0
@@ -44,7 +44,8 @@ class RCA(MahalanobisMixin, TransformerMixin):
       The learned linear transformation ``L``.
   """
 
-  def __init__(self, num_dims=None, pca_comps=None, preprocessor=None):
+  def __init__(self, num_dims=None, pca_comps=None, preprocessor=None,
+               cache_embedding=False, inference_dtype=None, n_jobs=None):
     """Initialize the learner.
 
     Parameters
@@ -62,10 +63,28 @@ class RCA(MahalanobisMixin, TransformerMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform` or `score_pairs` are
+        then looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`
+        and `score_pairs` are converted to this dtype (instead of being upcast
+        to the dtype of ``transformer_``), and they are embedded with a copy
+        of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform` and `score_pairs`, which
+        split their input into as many blocks of rows and process them in
+        parallel. ``None`` means 1 and ``-1`` means using all processors.
     """
     self.num_dims = num_dims
     self.pca_comps = pca_comps
-    super(RCA, self).__init__(preprocessor)
+    super(RCA, self).__init__(preprocessor, cache_embedding,
+                              inference_dtype, n_jobs)
 
   def _check_dimension(self, rank, X):
     d = X.shape[1]
@@ -149,7 +168,8 @@ class RCA_Supervised(RCA):
   """
 
   def __init__(self, num_dims=None, pca_comps=None, num_chunks=100,
-               chunk_size=2, preprocessor=None):
+               chunk_size=2, preprocessor=None, cache_embedding=False,
+               inference_dtype=None, n_jobs=None):
     """Initialize the supervised version of `RCA`.
 
     `RCA_Supervised` creates chunks of similar points by first sampling a
@@ -165,9 +185,27 @@ class RCA_Supervised(RCA):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform` or `score_pairs` are
+        then looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`
+        and `score_pairs` are converted to this dtype (instead of being upcast
+        to the dtype of ``transformer_``), and they are embedded with a copy
+        of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform` and `score_pairs`, which
+        split their input into as many blocks of rows and process them in
+        parallel. ``None`` means 1 and ``-1`` means using all processors.
     """
     RCA.__init__(self, num_dims=num_dims, pca_comps=pca_comps,
-                 preprocessor=preprocessor)
+                 preprocessor=preprocessor, cache_embedding=cache_embedding,
+                 inference_dtype=inference_dtype, n_jobs=n_jobs)
     self.num_chunks = num_chunks
     self.chunk_size = chunk_size
 
@@ -25,7 +25,8 @@ class _BaseSDML(MahalanobisMixin):
   _tuple_size = 2  # constraints are pairs
 
   def __init__(self, balance_param=0.5, sparsity_param=0.01, use_cov=True,
-               verbose=False, preprocessor=None):
+               verbose=False, preprocessor=None, cache_embedding=False,
+               inference_dtype=None, n_jobs=None):
     """
     Parameters
     ----------
@@ -44,12 +45,32 @@ class _BaseSDML(MahalanobisMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be gotten like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform`, `score_pairs` or
+        `decision_function` are then looked up in it instead of being
+        embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`,
+        `score_pairs` and `decision_function` are converted to this dtype
+        (instead of being upcast to the dtype of ``transformer_``), and they
+        are embedded with a copy of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform`, `score_pairs` and
+        `decision_function`, which split their input into as many blocks of
+        rows and process them in parallel. ``None`` means 1 and ``-1`` means
+        using all processors.
     """
     self.balance_param = balance_param
     self.sparsity_param = sparsity_param
     self.use_cov = use_cov
     self.verbose = verbose
-    super(_BaseSDML, self).__init__(preprocessor)
+    super(_BaseSDML, self).__init__(preprocessor, cache_embedding,
+                                    inference_dtype, n_jobs)
 
   def _fit(self, pairs, y):
     pairs, y = self._prepare_inputs(pairs, y,
@@ -116,7 +137,8 @@ class SDML_Supervised(_BaseSDML, TransformerMixin):
 
   def __init__(self, balance_param=0.5, sparsity_param=0.01, use_cov=True,
                num_labeled='deprecated', num_constraints=None, verbose=False,
-               preprocessor=None):
+               preprocessor=None, cache_embedding=False, inference_dtype=None,
+               n_jobs=None):
     """Initialize the supervised version of `SDML`.
 
     `SDML_Supervised` creates pairs of similar sample by taking same class
@@ -141,10 +163,29 @@ class SDML_Supervised(_BaseSDML, TransformerMixin):
     preprocessor : array-like, shape=(n_samples, n_features) or callable
         The preprocessor to call to get tuples from indices. If array-like,
         tuples will be formed like this: X[indices].
+
+    cache_embedding : bool, optional (default=False)
+        If True and the preprocessor is array-like, the embedding of all its
+        points is computed once, the first time it is needed after fitting,
+        and indicators of points given to `transform` or `score_pairs` are
+        then looked up in it instead of being embedded again.
+
+    inference_dtype : numpy dtype or None, optional (default=None)
+        If not None, for instance ``np.float32``, the inputs of `transform`
+        and `score_pairs` are converted to this dtype (instead of being upcast
+        to the dtype of ``transformer_``), and they are embedded with a copy
+        of ``transformer_`` in this dtype.
+
+    n_jobs : int or None, optional (default=None)
+        The number of threads used by `transform` and `score_pairs`, which
+        split their input into as many blocks of rows and process them in
+        parallel. ``None`` means 1 and ``-1`` means using all processors.
     """
     _BaseSDML.__init__(self, balance_param=balance_param,
                        sparsity_param=sparsity_param, use_cov=use_cov,
-                       verbose=verbose, preprocessor=preprocessor)
+                       verbose=verbose, preprocessor=preprocessor,
+                       cache_embedding=cache_embedding,
+                       inference_dtype=inference_dtype, n_jobs=n_jobs)
     self.num_labeled = num_labeled
     self.num_constraints = num_constraints
 
@@ -0,0 +1,338 @@
+"""
+Micro-batching service for Mahalanobis metric learners
+
+Serves the inference methods of a fitted metric learner (`score_pairs`,
+`transform`, `kneighbors`) to many concurrent callers sending a few rows
+each: the requests received within a short delay are gathered into a single
+batch, run through the metric learner in one vectorized call (so that the
+inputs are checked once and embedded with one matrix product), and the rows
+of the result are routed back to every caller. The service runs in an
+`asyncio` event loop, in-process (`MicroBatcher`) or behind a local Unix
+socket (`serve_unix`). It requires Python 3.4 or above.
+"""
+
+from __future__ import division, absolute_import
+import asyncio
+import json
+import numpy as np
+
+_METHODS = ('score_pairs', 'transform', 'kneighbors')
+
+
+class MicroBatcher(object):
+  """Gathers concurrent requests to a fitted metric learner into batches
+
+  Every request is the input of one of the inference methods of the metric
+  learner, for a few rows (for instance a 3D array with a single pair for
+  `score_pairs`), and immediately returns an :class:`asyncio.Future` of its
+  result. The requests to the same method (with the same arguments) are
+  batched until they have `max_batch_size` rows in total or the first of
+  them has waited for `max_latency` seconds. The batch is then computed in
+  `executor`, so that the event loop keeps receiving requests meanwhile,
+  and split back into the results of the requests. If the batch fails (for
+  instance because of an invalid request), its requests are computed again
+  one by one, so that only the invalid ones get the exception.
+
+  Parameters
+  ----------
+  metric_learner : `MahalanobisMixin`
+    The fitted metric learner (with an index built with `build_index` if
+    `kneighbors` is requested).
+
+  max_batch_size : int, optional (default=256)
+    Number of rows above which a batch is computed without waiting.
+
+  max_latency : float, optional (default=0.002)
+    Maximum time (in seconds) a request waits for other requests before its
+    batch is computed.
+
+  executor : `concurrent.futures.Executor` or None, optional (default=None)
+    The executor computing the batches. If None, the default executor of
+    the event loop is used.
+
+  loop : `asyncio.AbstractEventLoop` or None, optional (default=None)
+    The event loop of the requests. If None, the current event loop is used.
+
+  Examples
+  --------
+  ::
+
+    batcher = MicroBatcher(lmnn, max_batch_size=512)
+    # in a coroutine:
+    scores = await batcher.score_pairs(pairs)
+  """
+
+  def __init__(self, metric_learner, max_batch_size=256, max_latency=0.002,
+               executor=None, loop=None):
+    self.metric_learner = metric_learner
+    self.max_batch_size = max_batch_size
+    self.max_latency = max_latency
+    self.executor = executor
+    self.loop = loop
+    # pending requests, number of their rows, and flush timer, by batch key
+    self._pending = {}
+    self._n_pending_rows = {}
+    self._timers = {}
+    self._n_requests = 0
+    self._n_batches = 0
+    self._n_batched_rows = 0
+    self._largest_batch_size = 0
+    self._max_queue_depth = 0
+
+  def score_pairs(self, pairs):
+    """Requests the learned distances between pairs of points.
+
+    Parameters
+    ----------
+    pairs : array-like, shape=(n_pairs, 2, n_features) or (n_pairs, 2)
+      3D array of pairs, or 2D array of indices of pairs if the metric
+      learner uses a preprocessor.
+
+    Returns
+    -------
+    future : :class:`asyncio.Future`
+      The future of the `numpy.ndarray` of shape (n_pairs,) of the
+      distances.
+    """
+    return self._submit('score_pairs', pairs)
+
+  def transform(self, X):
+    """Requests the embedding of points.
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_samples, n_features) or (n_samples,)
+      2D array of points, or 1D array of indicators of points if the metric
+      learner uses a preprocessor.
+
+    Returns
+    -------
+    future : :class:`asyncio.Future`
+      The future of the `numpy.ndarray` of shape (n_samples, num_dims) of
+      the embedded points.
+    """
+    return self._submit('transform', X)
+
+  def kneighbors(self, X, n_neighbors=5, return_distance=True):
+    """Requests the nearest neighbors of points among the points indexed
+    by the metric learner (see `MahalanobisMixin.kneighbors`).
+
+    Parameters
+    ----------
+    X : array-like, shape=(n_queries, n_features) or (n_queries,)
+      2D array of query points, or 1D array of indicators of points if the
+      metric learner uses a preprocessor.
+
+    n_neighbors : int, optional (default=5)
+      Number of neighbors to get.
+
+    return_distance : `bool`, optional (default=True)
+      If False, the distances will not be returned.
+
+    Returns
+    -------
+    future : :class:`asyncio.Future`
+      The future of the arrays ``(dist, ind)`` of shape (n_queries,
+      n_neighbors), or of ``ind`` only if `return_distance` is False.
+    """
+    return self._submit('kneighbors', X, n_neighbors=n_neighbors,
+                        return_distance=return_distance)
+
+  def stats(self):
+    """Returns statistics on the requests and batches.
+
+    Returns
+    -------
+    stats : dict
+      With the following keys:
+
+      - ``'n_requests'`` and ``'n_batches'``: the numbers of requests and
+        of batches computed so far,
+      - ``'mean_batch_size'`` and ``'largest_batch_size'``: the mean and
+        maximum numbers of rows of the batches,
+      - ``'queue_depth'`` and ``'max_queue_depth'``: the current and
+        maximum numbers of requests waiting for their batch to be computed.
+    """
+    return {'n_requests': self._n_requests,
+            'n_batches': self._n_batches,
+            'mean_batch_size': (self._n_batched_rows / self._n_batches
+                                if self._n_batches else 0.),
+            'largest_batch_size': self._largest_batch_size,
+            'queue_depth': self._queue_depth(),
+            'max_queue_depth': self._max_queue_depth}
+
+  def _get_loop(self):
+    return self.loop if self.loop is not None else asyncio.get_event_loop()
+
+  def _queue_depth(self):
+    return sum(len(requests) for requests in self._pending.values())
+
+  def _submit(self, method, inputs, **kwargs):
+    """Adds a request to the batch of its method and arguments, and returns
+    the future of its result."""
+    loop = self._get_loop()
+    inputs = np.asarray(inputs)
+    future = asyncio.Future(loop=loop)
+    key = (method,) + tuple(sorted(kwargs.items()))
+    self._pending.setdefault(key, []).append((inputs, future))
+    self._n_pending_rows[key] = (self._n_pending_rows.get(key, 0) +
+                                 len(inputs))
+    self._n_requests += 1
+    self._max_queue_depth = max(self._max_queue_depth, self._queue_depth())
+    if self._n_pending_rows[key] >= self.max_batch_size:
+      self._flush(key)
+    elif key not in self._timers:
+      self._timers[key] = loop.call_later(self.max_latency, self._flush, key)
+    return future
+
+  def _flush(self, key):
+    """Computes the batch of the pending requests with the given key."""
+    timer = self._timers.pop(key, None)
+    if timer is not None:
+      timer.cancel()
+    requests = self._pending.pop(key, [])
+    n_rows = self._n_pending_rows.pop(key, 0)
+    if not requests:
+      return
+    self._n_batches += 1
+    self._n_batched_rows += n_rows
+    self._largest_batch_size = max(self._largest_batch_size, n_rows)
+    self._run(key, requests)
+
+  def _run(self, key, requests):
+    """Computes a batch in the executor, and routes its result back to the
+    requests."""
+    method, kwargs = getattr(self.metric_learner, key[0]), dict(key[1:])
+
+    def run_batch():
+      if len(requests) == 1:
+        return method(requests[0][0], **kwargs)
+      return method(np.concatenate([inputs for inputs, _ in requests]),
+                    **kwargs)
+
+    self._get_loop().run_in_executor(self.executor, run_batch)\
+        .add_done_callback(lambda batch: self._dispatch(batch, key,
+                                                        requests))
+
+  def _dispatch(self, batch, key, requests):
+    """Sets the results (or exceptions) of the requests of a computed
+    batch."""
+    # (requests can be done already if they have been cancelled)
+    pending = [request for request in requests if not request[1].done()]
+    if not pending:
+      return
+    if batch.exception() is not None:
+      if len(requests) == 1:
+        requests[0][1].set_exception(batch.exception())
+      else:
+        # the failing requests are isolated from the others
+        for request in pending:
+          self._run(key, [request])
+      return
+    # the batch was computed on all the requests, so its rows are split
+    # between all of them, including the ones already done
+    bounds = np.cumsum([len(inputs) for inputs, _ in requests])[:-1]
+    outputs = batch.result()
+    if isinstance(outputs, tuple):
+      results = zip(*[np.split(output, bounds) for output in outputs])
+    else:
+      results = np.split(outputs, bounds)
+    for (_, future), result in zip(requests, results):
+      if not future.done():
+        future.set_result(result)
+
+
+class _ServingProtocol(asyncio.Protocol):
+  """Protocol of the connections to `serve_unix`: every line received is a
+  JSON request, answered by a JSON line."""
+
+  def __init__(self, batcher):
+    self.batcher = batcher
+    self._buffer = b''
+    self._transport = None
+
+  def connection_made(self, transport):
+    self._transport = transport
+
+  def connection_lost(self, exc):
+    self._transport = None
+
+  def data_received(self, data):
+    lines = (self._buffer + data).split(b'\n')
+    self._buffer = lines.pop()
+    for line in lines:
+      if line.strip():
+        self._handle(line)
+
+  def _handle(self, line):
+    request_id = None
+    try:
+      request = json.loads(line.decode('utf-8'))
+      request_id = request.get('id')
+      if request['method'] == 'stats':
+        self._reply(request_id, result=self.batcher.stats())
+        return
+      if request['method'] not in _METHODS:
+        raise ValueError("Unknown method {!r}, expected one of {}."
+                         .format(request['method'], _METHODS))
+      future = getattr(self.batcher, request['method'])(
+          request['inputs'], **request.get('kwargs', {}))
+    except Exception as e:
+      self._reply(request_id, error=e)
+      return
+    future.add_done_callback(lambda done: self._reply_future(request_id,
+                                                             done))
+
+  def _reply_future(self, request_id, future):
+    if future.exception() is not None:
+      self._reply(request_id, error=future.exception())
+    elif isinstance(future.result(), tuple):
+      self._reply(request_id,
+                  result=[output.tolist() for output in future.result()])
+    else:
+      self._reply(request_id, result=future.result().tolist())
+
+  def _reply(self, request_id, result=None, error=None):
+    if self._transport is None:
+      return
+    response = {'id': request_id}
+    if error is not None:
+      response['error'] = '{}: {}'.format(type(error).__name__, error)
+    else:
+      response['result'] = result
+    self._transport.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+def serve_unix(batcher, path, loop=None):
+  """Serves a `MicroBatcher` on a local Unix socket.
+
+  Every request is a line with a JSON object, with the keys ``'method'``
+  (``'score_pairs'``, ``'transform'``, ``'kneighbors'`` or ``'stats'``),
+  ``'inputs'`` (the nested list of the input rows, except for ``'stats'``),
+  and optionally ``'kwargs'`` (for instance ``{"n_neighbors": 10}``) and
+  ``'id'``. It is answered by a line with a JSON object with the same
+  ``'id'``, and the key ``'result'`` (the nested list of the output, or the
+  dict of `MicroBatcher.stats`) or ``'error'`` (the message of the
+  exception raised). A connection can send several requests without waiting
+  for the responses, which may then come in a different order.
+
+  Parameters
+  ----------
+  batcher : `MicroBatcher`
+    The batcher the requests are submitted to.
+
+  path : str
+    The path of the socket.
+
+  loop : `asyncio.AbstractEventLoop` or None, optional (default=None)
+    The event loop of the server. If None, the current event loop is used.
+
+  Returns
+  -------
+  coroutine
+    The coroutine creating the :class:`asyncio.AbstractServer`, to be run
+    in the event loop, for instance with
+    ``server = loop.run_until_complete(serve_unix(batcher, path))``.
+  """
+  loop = loop if loop is not None else asyncio.get_event_loop()
+  return loop.create_unix_server(lambda: _ServingProtocol(batcher), path)
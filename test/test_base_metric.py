@@ -1,4 +1,6 @@
 import pytest
+import subprocess
+import sys
 import unittest
 import metric_learn
 import numpy as np
@@ -11,78 +13,94 @@ class TestStringRepr(unittest.TestCase):
 
   def test_covariance(self):
     self.assertEqual(str(metric_learn.Covariance()),
-                     "Covariance(preprocessor=None)")
+                     "Covariance(cache_embedding=False, inference_dtype=None, "
+                     "n_jobs=None,\n      preprocessor=None)")
 
   def test_lmnn(self):
     self.assertRegexpMatches(
         str(metric_learn.LMNN()),
-        r"(python_)?LMNN\(convergence_tol=0.001, k=3, learn_rate=1e-07, "
-        r"max_iter=1000,\n      min_iter=50, preprocessor=None, "
-        r"regularization=0.5, use_pca=True,\n      verbose=False\)")
+        r"(python_)?LMNN\(cache_embedding=False, convergence_tol=0.001,\n"
+        r"      inference_dtype=None, k=3, learn_rate=1e-07, max_iter=1000,\n"
+        r"      min_iter=50, n_jobs=None, preprocessor=None, "
+        r"regularization=0.5,\n      use_pca=True, verbose=False\)")
 
   def test_nca(self):
-    self.assertEqual(str(metric_learn.NCA()),
-                     "NCA(max_iter=100, num_dims=None, preprocessor=None, "
-                     "tol=None, verbose=False)")
+    self.assertEqual(str(metric_learn.NCA()), """
+NCA(cache_embedding=False, inference_dtype=None, max_iter=100, n_jobs=None,
+  num_dims=None, preprocessor=None, tol=None, verbose=False)
+""".strip('\n'))
 
   def test_lfda(self):
-    self.assertEqual(str(metric_learn.LFDA()),
-                     "LFDA(embedding_type='weighted', k=None, num_dims=None, "
-                     "preprocessor=None)")
+    self.assertEqual(str(metric_learn.LFDA()), """
+LFDA(cache_embedding=False, embedding_type='weighted', inference_dtype=None,
+   k=None, n_jobs=None, num_dims=None, preprocessor=None)
+""".strip('\n'))
 
   def test_itml(self):
     self.assertEqual(str(metric_learn.ITML()), """
-ITML(A0=None, convergence_threshold=0.001, gamma=1.0, max_iter=1000,
-   preprocessor=None, verbose=False)
+ITML(A0=None, cache_embedding=False, convergence_threshold=0.001, gamma=1.0,
+   inference_dtype=None, max_iter=1000, n_jobs=None, preprocessor=None,
+   verbose=False)
 """.strip('\n'))
     self.assertEqual(str(metric_learn.ITML_Supervised()), """
-ITML_Supervised(A0=None, bounds='deprecated', convergence_threshold=0.001,
-        gamma=1.0, max_iter=1000, num_constraints=None,
+ITML_Supervised(A0=None, bounds='deprecated', cache_embedding=False,
+        convergence_threshold=0.001, gamma=1.0, inference_dtype=None,
+        max_iter=1000, n_jobs=None, num_constraints=None,
         num_labeled='deprecated', preprocessor=None, verbose=False)
 """.strip('\n'))
 
   def test_lsml(self):
-    self.assertEqual(
-        str(metric_learn.LSML()),
-        "LSML(max_iter=1000, preprocessor=None, prior=None, tol=0.001, "
-        "verbose=False)")
+    self.assertEqual(str(metric_learn.LSML()), """
+LSML(cache_embedding=False, inference_dtype=None, max_iter=1000, n_jobs=None,
+   preprocessor=None, prior=None, tol=0.001, verbose=False)
+""".strip('\n'))
     self.assertEqual(str(metric_learn.LSML_Supervised()), """
-LSML_Supervised(max_iter=1000, num_constraints=None, num_labeled='deprecated',
+LSML_Supervised(cache_embedding=False, inference_dtype=None, max_iter=1000,
+        n_jobs=None, num_constraints=None, num_labeled='deprecated',
         preprocessor=None, prior=None, tol=0.001, verbose=False,
         weights=None)
 """.strip('\n'))
 
   def test_sdml(self):
-    self.assertEqual(str(metric_learn.SDML()),
-                     "SDML(balance_param=0.5, preprocessor=None, "
-                     "sparsity_param=0.01, use_cov=True,\n   verbose=False)")
+    self.assertEqual(str(metric_learn.SDML()), """
+SDML(balance_param=0.5, cache_embedding=False, inference_dtype=None,
+   n_jobs=None, preprocessor=None, sparsity_param=0.01, use_cov=True,
+   verbose=False)
+""".strip('\n'))
     self.assertEqual(str(metric_learn.SDML_Supervised()), """
-SDML_Supervised(balance_param=0.5, num_constraints=None,
+SDML_Supervised(balance_param=0.5, cache_embedding=False,
+        inference_dtype=None, n_jobs=None, num_constraints=None,
         num_labeled='deprecated', preprocessor=None, sparsity_param=0.01,
         use_cov=True, verbose=False)
 """.strip('\n'))
 
   def test_rca(self):
-    self.assertEqual(str(metric_learn.RCA()),
-                     "RCA(num_dims=None, pca_comps=None, preprocessor=None)")
-    self.assertEqual(str(metric_learn.RCA_Supervised()),
-                     "RCA_Supervised(chunk_size=2, num_chunks=100, "
-                     "num_dims=None, pca_comps=None,\n        "
-                     "preprocessor=None)")
+    self.assertEqual(str(metric_learn.RCA()), """
+RCA(cache_embedding=False, inference_dtype=None, n_jobs=None, num_dims=None,
+  pca_comps=None, preprocessor=None)
+""".strip('\n'))
+    self.assertEqual(str(metric_learn.RCA_Supervised()), """
+RCA_Supervised(cache_embedding=False, chunk_size=2, inference_dtype=None,
+        n_jobs=None, num_chunks=100, num_dims=None, pca_comps=None,
+        preprocessor=None)
+""".strip('\n'))
 
   def test_mlkr(self):
-    self.assertEqual(str(metric_learn.MLKR()),
-                     "MLKR(A0=None, max_iter=1000, num_dims=None, "
-                     "preprocessor=None, tol=None,\n   verbose=False)")
+    self.assertEqual(str(metric_learn.MLKR()), """
+MLKR(A0=None, cache_embedding=False, inference_dtype=None, max_iter=1000,
+   n_jobs=None, num_dims=None, preprocessor=None, tol=None, verbose=False)
+""".strip('\n'))
 
   def test_mmc(self):
     self.assertEqual(str(metric_learn.MMC()), """
-MMC(A0=None, convergence_threshold=0.001, diagonal=False, diagonal_c=1.0,
-  max_iter=100, max_proj=10000, preprocessor=None, verbose=False)
+MMC(A0=None, cache_embedding=False, convergence_threshold=0.001,
+  diagonal=False, diagonal_c=1.0, inference_dtype=None, max_iter=100,
+  max_proj=10000, n_jobs=None, preprocessor=None, verbose=False)
 """.strip('\n'))
     self.assertEqual(str(metric_learn.MMC_Supervised()), """
-MMC_Supervised(A0=None, convergence_threshold=1e-06, diagonal=False,
-        diagonal_c=1.0, max_iter=100, max_proj=10000, num_constraints=None,
+MMC_Supervised(A0=None, cache_embedding=False, convergence_threshold=1e-06,
+        diagonal=False, diagonal_c=1.0, inference_dtype=None, max_iter=100,
+        max_proj=10000, n_jobs=None, num_constraints=None,
         num_labeled='deprecated', preprocessor=None, verbose=False)
 """.strip('\n'))
 
@@ -163,5 +181,24 @@ def test_get_metric_works_does_not_raise(estimator, build_dataset):
     assert len(record) == 0
 
 
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason="module-level __getattr__ requires Python 3.7")
+def test_lazy_imports():
+  """Tests that importing metric_learn does not import the algorithms, and
+  that they are imported when accessed"""
+  code = ("import sys; import metric_learn; "
+          "assert 'metric_learn.base_metric' not in sys.modules; "
+          "assert 'metric_learn.lmnn' not in sys.modules; "
+          "metric_learn.InferenceModel; "
+          "assert 'sklearn.metrics' not in sys.modules; "
+          "assert 'metric_learn.lmnn' not in sys.modules; "
+          "metric_learn.LMNN; "
+          "assert 'metric_learn.lmnn' in sys.modules")
+  subprocess.check_call([sys.executable, '-c', code])
+  with pytest.raises(AttributeError):
+    metric_learn.NotAnAlgorithm
+  assert set(metric_learn.__all__) <= set(dir(metric_learn))
+
+
 if __name__ == '__main__':
   unittest.main()
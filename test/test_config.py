@@ -0,0 +1,186 @@
+import threading
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from numpy.testing import assert_allclose, assert_array_equal
+
+import metric_learn
+from metric_learn import (NCA, config_context, get_config, record_copies,
+                          set_config)
+from metric_learn._util import check_input, check_tuples_unique
+from metric_learn.constraints import wrap_pairs
+from metric_learn.exceptions import CopyError
+from sklearn.datasets import make_classification
+
+
+def test_config_context():
+  """Tests that config_context sets the configuration within the context
+  only, even if an exception is raised"""
+  assert get_config() == {'assume_valid': False, 'assume_finite': False,
+                          'copy': 'allow'}
+  with config_context(assume_valid=True):
+    assert get_config() == {'assume_valid': True, 'assume_finite': False,
+                            'copy': 'allow'}
+    with config_context(assume_finite=True):
+      assert get_config() == {'assume_valid': True, 'assume_finite': True,
+                              'copy': 'allow'}
+    assert get_config() == {'assume_valid': True, 'assume_finite': False,
+                            'copy': 'allow'}
+  with pytest.raises(ValueError):
+    with config_context(assume_valid=True):
+      raise ValueError
+  assert get_config() == {'assume_valid': False, 'assume_finite': False,
+                          'copy': 'allow'}
+  set_config(assume_finite=True)
+  try:
+    assert metric_learn.get_config()['assume_finite']
+  finally:
+    set_config(assume_finite=False)
+  with pytest.raises(TypeError):
+    with config_context(not_a_parameter=True):
+      pass
+
+
+def test_config_threads():
+  """Tests that the configuration set in a thread does not affect the other
+  threads, but is used by the threads of n_jobs"""
+  X, y = make_classification(n_samples=20, n_features=4, random_state=42)
+  nca = NCA(max_iter=5, n_jobs=2).fit(X, y)
+  X_nan = X.copy()
+  X_nan[0, 0] = np.nan
+  entered, leave = threading.Event(), threading.Event()
+
+  def other_thread():
+    with config_context(assume_finite=True):
+      entered.set()
+      leave.wait()
+
+  thread = threading.Thread(target=other_thread)
+  thread.start()
+  try:
+    entered.wait()
+    assert not get_config()['assume_finite']
+    with pytest.raises(ValueError):
+      nca.transform(X_nan)
+  finally:
+    leave.set()
+    thread.join()
+  with config_context(assume_finite=True):
+    assert np.isnan(nca.transform(X_nan)[0]).all()
+
+
+def test_assume_valid_returns_trusted_inputs():
+  """Tests that under assume_valid, C-contiguous float arrays are returned
+  without copies, and that the other inputs are still checked"""
+  X = np.random.RandomState(0).randn(10, 3)
+  tuples = X.reshape(5, 2, 3)
+  with config_context(assume_valid=True):
+    assert check_input(X) is X
+    assert check_input(tuples, type_of_inputs='tuples', tuple_size=2) is \
+        tuples
+    assert check_tuples_unique(tuples, tuple_size=2)[0] is tuples
+    # other inputs are converted or rejected as usual
+    assert_array_equal(check_input(X.tolist()), X)
+    assert check_input(np.asfortranarray(X)).flags.f_contiguous
+    assert check_input(X, dtype=np.float32).dtype == np.float32
+    assert check_input(X.astype(int)).dtype.kind == 'i'
+    for invalid_input, kwargs in [(X, {'type_of_inputs': 'tuples'}),
+                                  (tuples, {}),
+                                  (tuples, {'type_of_inputs': 'tuples',
+                                            'tuple_size': 3}),
+                                  (X[:0], {})]:
+      with pytest.raises(ValueError):
+        check_input(invalid_input, **kwargs)
+    X_nan = X.copy()
+    X_nan[0, 0] = np.nan
+    with pytest.raises(ValueError):
+      check_input(X_nan)
+    assert check_input(X_nan, force_all_finite='allow-nan') is X_nan
+
+
+def test_assume_finite():
+  """Tests that under assume_finite, inputs are not checked for NaN or
+  infinite values, in the metric learners too"""
+  X, y = make_classification(n_samples=20, n_features=4, random_state=42)
+  nca = NCA(max_iter=5).fit(X, y)
+  X_nan = X.copy()
+  X_nan[0, 0] = np.nan
+  with pytest.raises(ValueError):
+    nca.transform(X_nan)
+  for config in [{'assume_finite': True},
+                 {'assume_finite': True, 'assume_valid': True}]:
+    with config_context(**config):
+      assert np.isnan(nca.transform(X_nan)[0]).all()
+      assert np.isnan(nca.score_pairs([[X_nan[0], X[1]]])[0])
+      assert np.all(np.isfinite(nca.transform(X_nan)[1:]))
+  with config_context(assume_valid=True):
+    with pytest.raises(ValueError):
+      nca.transform(X_nan)
+    assert_array_equal(nca.transform(X), X.dot(nca.transformer_.T))
+
+
+def test_record_copies(tmpdir):
+  """Tests that the copies of input data are recorded with their size and
+  call site, and that the inputs used as they are are not"""
+  X, y = make_classification(n_samples=20, n_features=4, random_state=42)
+  nca = NCA(max_iter=5).fit(X, y)
+  X_memmap = np.memmap(str(tmpdir.join('X.dat')), dtype=X.dtype, mode='w+',
+                       shape=X.shape)
+  X_memmap[:] = X
+  X_memmap = np.memmap(str(tmpdir.join('X.dat')), dtype=X.dtype, mode='r',
+                       shape=X.shape)
+  with record_copies() as records:
+    nca.transform(X_memmap)
+    nca.transform(X[::2])  # (no layout is required)
+  assert records == []
+
+  nca.set_params(inference_dtype=np.float32)
+  with record_copies() as records:
+    nca.transform(X)
+  assert len(records) == 1
+  assert records[0]['site'] == 'check_input'
+  assert records[0]['nbytes'] == X.size * 4
+  assert records[0]['shape'] == X.shape
+  assert records[0]['dtype'] == np.float32
+  assert records[0]['caller'].startswith(__file__.replace('.pyc', '.py'))
+
+  nca.set_params(inference_dtype=None, preprocessor=X)
+  nca.check_preprocessor()
+  with record_copies() as records:
+    with record_copies() as inner_records:
+      nca.transform([0, 1, 2])
+  assert [record['site'] for record in records] == ['ArrayIndexer']
+  assert records == inner_records
+  assert records[0]['nbytes'] == 3 * X.shape[1] * X.itemsize
+
+  with record_copies() as records:
+    pairs, _ = wrap_pairs(X, [[0], [1], [2], [3]])
+  assert [record['site'] for record in records] == ['wrap_pairs']
+  assert records[0]['nbytes'] == pairs.nbytes
+
+
+def test_copy_never():
+  """Tests that under copy='never', the conversions copying input data
+  raise an error, while the inputs in the expected format are accepted"""
+  X, y = make_classification(n_samples=20, n_features=4, random_state=42)
+  nca = NCA(max_iter=5, inference_dtype=np.float32).fit(X, y)
+  with config_context(copy='never'):
+    with pytest.raises(CopyError) as raised:
+      nca.transform(X)
+    assert "copy='never'" in str(raised.value)
+    X_float32 = X.astype(np.float32)
+    assert_allclose(nca.transform(X_float32),
+                    X_float32.dot(nca.transformer_.T.astype(np.float32)),
+                    rtol=1e-6)
+    nca.set_params(inference_dtype=None)
+    nca.transform(X[:, ::-1])
+    with pytest.raises(CopyError):
+      check_input(X[:, ::2], order='C')
+    with pytest.raises(CopyError):
+      check_input(sp.csc_matrix(X), accept_sparse='csr')
+    assert sp.isspmatrix_csr(check_input(sp.csr_matrix(X),
+                                         accept_sparse='csr'))
+    assert check_input(X, dtype=np.float32, copy=True).dtype == np.float32
+  with pytest.raises(ValueError):
+    set_config(copy='sometimes')
@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from sklearn.datasets import make_classification
+from sklearn.exceptions import NotFittedError
+
+from metric_learn import NCA, LSHIndex
+from metric_learn.lsh import _make_run, _run_points
+
+
+@pytest.fixture
+def fitted_nca():
+  X, y = make_classification(n_samples=300, n_features=10, random_state=42)
+  return NCA(max_iter=10).fit(X, y), X, y
+
+
+def test_lsh_kneighbors_exact_distances(fitted_nca):
+  """Tests that the neighbors found are ranked by their exact learned
+  distances, and that each point is its own nearest neighbor"""
+  nca, X, _ = fitted_nca
+  index = LSHIndex(nca, n_tables=5, n_projections=4, bucket_width=20.,
+                   random_state=0).fit(X)
+  assert index.n_indexed_ == X.shape[0]
+  dist, ind = index.kneighbors(X[:20], n_neighbors=3)
+  assert_array_equal(ind[:, 0], np.arange(20))
+  assert_allclose(dist[:, 0], 0, atol=1e-7)
+  found = ind >= 0
+  expected = np.sqrt(np.sum((nca.transform(X[:20])[:, None] -
+                             nca.transform(X)[np.maximum(ind, 0)])**2,
+                            axis=-1))
+  assert_allclose(dist[found], expected[found])
+  assert np.all(found)
+  assert_array_equal(np.sort(dist, axis=1), dist)
+  assert_array_equal(index.kneighbors(X[:20], n_neighbors=3,
+                                      return_distance=False), ind)
+
+
+def test_lsh_recall(fitted_nca):
+  """Tests that with wide buckets every point is a candidate, so the exact
+  neighbors are found, and that narrower buckets give fewer candidates"""
+  nca, X, _ = fitted_nca
+  report = LSHIndex(nca, n_tables=2, n_projections=1, bucket_width=1e6,
+                    random_state=0).fit(X).recall_report(X[:30], 5)
+  assert report['recall'] == 1.
+  assert report['mean_candidates'] == X.shape[0]
+  narrow_report = LSHIndex(nca, n_tables=2, n_projections=4, bucket_width=1.,
+                           random_state=0).fit(X).recall_report(X[:30], 5)
+  assert narrow_report['mean_candidates'] < X.shape[0]
+  assert 0 < narrow_report['recall'] <= 1
+  assert set(report) == {'recall', 'mean_candidates', 'query_time',
+                         'exact_time', 'speedup'}
+
+
+def test_lsh_partial_fit(fitted_nca):
+  """Tests that inserting points in several steps gives the same neighbors
+  and buckets as building the index at once, with runs of the tables merged
+  as they are inserted"""
+  nca, X, _ = fitted_nca
+  index = LSHIndex(nca, n_tables=3, n_projections=3, random_state=1)
+  index.partial_fit(X[:200]).partial_fit(X[200:201]).partial_fit(X[201:205])
+  assert index.n_indexed_ == 205
+  for runs in index.tables_:
+    assert [indices.size for _, _, indices in runs] == [200, 5]
+  partial_index = LSHIndex(nca, n_tables=3, n_projections=3,
+                           random_state=1).fit(X[:205])
+  for result, expected in zip(index.kneighbors(X[::7]),
+                              partial_index.kneighbors(X[::7])):
+    assert_array_equal(result, expected)
+
+  index.partial_fit(X[205:])
+  full_index = LSHIndex(nca, n_tables=3, n_projections=3,
+                        random_state=1).fit(X)
+  assert index.n_indexed_ == X.shape[0]
+  for runs, (expected_run,) in zip(index.tables_, full_index.tables_):
+    assert [indices.size for _, _, indices in runs] == [200, 100]
+    merged_run = _make_run(*[np.concatenate(arrays) for arrays in
+                             zip(*[_run_points(run) for run in runs])])
+    for array, expected in zip(merged_run, expected_run):
+      assert_array_equal(array, expected)
+  for result, expected in zip(index.kneighbors(X[::7]),
+                              full_index.kneighbors(X[::7])):
+    assert_array_equal(result, expected)
+
+
+def test_lsh_partial_fit_single_points(fitted_nca):
+  """Tests that inserting points one by one keeps a logarithmic number of
+  runs in the tables"""
+  nca, X, _ = fitted_nca
+  index = LSHIndex(nca, n_tables=2, n_projections=3, random_state=1)
+  for i in range(X.shape[0]):
+    index.partial_fit(X[i:i + 1])
+    for runs in index.tables_:
+      assert len(runs) <= np.log2(i + 1) + 1
+      assert sum(indices.size for _, _, indices in runs) == i + 1
+  full_index = LSHIndex(nca, n_tables=2, n_projections=3,
+                        random_state=1).fit(X)
+  dist, ind = index.kneighbors(X[::7])
+  expected_dist, expected_ind = full_index.kneighbors(X[::7])
+  # (points embedded one by one can differ in the last bits)
+  assert_allclose(dist, expected_dist, atol=1e-12)
+  assert_array_equal(ind, expected_ind)
+
+
+def test_lsh_no_candidates(fitted_nca):
+  """Tests that missing neighbors have an index of -1 and an infinite
+  distance"""
+  nca, X, _ = fitted_nca
+  index = LSHIndex(nca, n_tables=1, n_projections=8, bucket_width=1e-6,
+                   random_state=0).fit(X[:50])
+  dist, ind = index.kneighbors(X[:2], n_neighbors=2)
+  assert_array_equal(ind[:, 1], -1)
+  assert np.all(np.isinf(dist[:, 1]))
+  dist, ind = index.kneighbors(X[:2] + 1e3, n_neighbors=2)
+  assert_array_equal(ind, -1)
+
+
+def test_lsh_errors(fitted_nca):
+  nca, X, y = fitted_nca
+  with pytest.raises(NotFittedError):
+    LSHIndex(NCA()).fit(X)
+  with pytest.raises(NotFittedError):
+    LSHIndex(nca).kneighbors(X)
+  with pytest.raises(ValueError):
+    LSHIndex(nca, n_tables=0).fit(X)
+  with pytest.raises(ValueError):
+    LSHIndex(nca, bucket_width=0.).fit(X)
+  index = LSHIndex(nca).fit(X)
+  with pytest.raises(ValueError):
+    index.kneighbors(X, n_neighbors=0)
+  nca.fit(X, y)
+  with pytest.raises(ValueError) as raised_error:
+    index.kneighbors(X)
+  assert str(raised_error.value) == ("The LSH index was built before NCA was "
+                                     "last fitted. Call `fit` again.")
+
+
+def test_lsh_preprocessor():
+  """Tests the index with indicators of points"""
+  X, y = make_classification(n_samples=100, random_state=42)
+  nca = NCA(max_iter=5, preprocessor=X).fit(np.arange(100), y)
+  index = LSHIndex(nca, random_state=0).fit(np.arange(100))
+  for result, expected in zip(index.kneighbors(np.arange(10)),
+                              index.kneighbors(X[:10])):
+    assert_array_equal(result, expected)
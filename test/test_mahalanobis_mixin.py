@@ -1,17 +1,28 @@
+import pickle
+import threading
 from itertools import product
 
 import pytest
 import numpy as np
-from numpy.testing import assert_array_almost_equal, assert_allclose
-from scipy.spatial.distance import pdist, squareform, mahalanobis
+import scipy.sparse as sp
+from numpy.testing import (assert_array_almost_equal, assert_allclose,
+                           assert_array_equal)
+from scipy.spatial.distance import cdist, pdist, squareform, mahalanobis
 from sklearn import clone
 from sklearn.cluster import DBSCAN
+from sklearn.datasets import load_iris, make_classification
+from sklearn.exceptions import NotFittedError
 from sklearn.utils import check_random_state
 from sklearn.utils.testing import set_random_state
 
+from metric_learn import (LMNN, LSML, MMC, NCA, Covariance, InferenceModel,
+                          QuantizedModel, load_inference_model)
 from metric_learn._util import make_context
+from metric_learn.base_metric import (_accumulation_dtype, _get_thread_pool,
+                                      _quantize_rows)
 
-from test.test_utils import ids_metric_learners, metric_learners
+from test.test_utils import (ids_metric_learners, metric_learners,
+                             build_quadruplets)
 
 RNG = check_random_state(0)
 
@@ -283,3 +294,841 @@ def test_transformer_is_2D(estimator, build_dataset):
   trunc_data = input_data[..., :1]
   model.fit(trunc_data, labels)
   assert model.transformer_.shape == (1, 1)  # the transformer must be 2D
+
+
+@pytest.mark.parametrize('estimator, build_dataset', metric_learners,
+                         ids=ids_metric_learners)
+def test_pairwise_distances_coherent_with_score_pairs(estimator,
+                                                      build_dataset):
+  """Tests that pairwise_distances returns the same distances as score_pairs
+  on every combination of points"""
+  input_data, labels, _, X = build_dataset()
+  model = clone(estimator)
+  set_random_state(model)
+  model.fit(input_data, labels)
+  X, Y = X[:20], X[20:35]
+  expected = model.score_pairs(np.array(list(product(X, Y))))\
+      .reshape(X.shape[0], Y.shape[0])
+  # the squared norms expansion loses precision on small distances, hence
+  # the absolute tolerance, and its relative error on the other distances
+  # depends on the norms of the embedded points, hence the relative one
+  assert_allclose(model.pairwise_distances(X, Y), expected, rtol=1e-6,
+                  atol=1e-6)
+  assert_allclose(model.pairwise_distances(X, Y, squared=True), expected**2,
+                  rtol=1e-6, atol=1e-6)
+
+  pairwise = model.pairwise_distances(X)
+  assert_allclose(pairwise, squareform(pdist(model.transform(X))),
+                  rtol=1e-6, atol=1e-6)
+  assert (pairwise.diagonal() == 0).all()
+
+
+@pytest.mark.parametrize('working_memory', [None, 0, 1e-4])
+def test_pairwise_distances_chunked(working_memory):
+  """Tests that the chunks of pairwise_distances_chunked are small enough
+  and form the whole distance matrix"""
+  X, y = make_classification(random_state=42, n_samples=200)
+  nca = NCA(max_iter=5).fit(X, y)
+  chunks = list(nca.pairwise_distances_chunked(
+      X[:150], X[50:], working_memory=working_memory))
+  if working_memory is not None:
+    assert len(chunks) > 1
+    assert all(chunk.shape[0] <= max(1, working_memory * 2**20 /
+                                     (8 * 150)) for chunk in chunks)
+  assert_allclose(np.vstack(chunks), nca.pairwise_distances(X[:150], X[50:]),
+                  atol=1e-6)
+
+
+def test_pairwise_distances_with_preprocessor():
+  """Tests that pairwise_distances accepts indicators of points when using a
+  preprocessor"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5, preprocessor=X).fit(np.arange(X.shape[0]), y)
+  assert_allclose(nca.pairwise_distances([0, 3, 5], [2, 4]),
+                  nca.pairwise_distances(X[[0, 3, 5]], X[[2, 4]]))
+
+
+@pytest.mark.parametrize('algorithm', ['auto', 'brute', 'kd_tree',
+                                       'ball_tree'])
+def test_kneighbors_coherent_with_pairwise_distances(algorithm):
+  """Tests that the neighbors found in the index are the nearest points under
+  the learned metric"""
+  X, y = make_classification(random_state=42, n_samples=100)
+  nca = NCA(max_iter=5).fit(X, y)
+  nca.build_index(X[20:], algorithm=algorithm)
+  dist, ind = nca.kneighbors(X[:20], n_neighbors=3)
+  pairwise = nca.pairwise_distances(X[:20], X[20:])
+  assert_array_equal(ind, np.argsort(pairwise, axis=1)[:, :3])
+  assert_allclose(dist, np.sort(pairwise, axis=1)[:, :3])
+  assert_array_equal(nca.kneighbors(X[:20], n_neighbors=3,
+                                    return_distance=False), ind)
+
+
+def test_kneighbors_with_preprocessor():
+  """Tests that the index and the queries can use the preprocessor"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5, preprocessor=X).fit(np.arange(X.shape[0]), y)
+  nca.build_index(np.arange(20, 100))
+  dist, ind = nca.kneighbors([0, 3, 5], n_neighbors=2)
+  dist_formed, ind_formed = nca.kneighbors(X[[0, 3, 5]], n_neighbors=2)
+  assert_array_equal(ind, ind_formed)
+  assert_allclose(dist, dist_formed)
+
+
+def test_kneighbors_after_refit():
+  """Tests that querying an index built before the last fit raises an
+  error"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5).fit(X, y)
+  with pytest.raises(NotFittedError):
+    nca.kneighbors(X)
+  nca.build_index(X)
+  nca.fit(X, y)
+  with pytest.raises(ValueError) as raised_error:
+    nca.kneighbors(X)
+  assert str(raised_error.value) == ("The nearest neighbors index by NCA was "
+                                     "built before the metric learner was "
+                                     "last fitted. Call `build_index` again.")
+
+
+@pytest.mark.parametrize('estimator, build_dataset', metric_learners,
+                         ids=ids_metric_learners)
+def test_cache_embedding_same_results(estimator, build_dataset):
+  """Tests that caching the embedding of the preprocessor does not change
+  the results of the inference methods"""
+  input_data, labels, X, to_transform = build_dataset(with_preprocessor=True)
+  model = clone(estimator)
+  set_random_state(model)
+  model.set_params(preprocessor=X)
+  model.fit(input_data, labels)
+  pairs = np.array(list(product(to_transform[:10], to_transform[:10])))
+  expected = {'transform': model.transform(to_transform),
+              'score_pairs': model.score_pairs(pairs)}
+  for method in ['predict', 'decision_function']:
+    if hasattr(model, method):
+      expected[method] = getattr(model, method)(input_data)
+
+  model.set_params(cache_embedding=True)
+  assert model._get_embedding_indexer() is not None
+  assert_allclose(model.transform(to_transform), expected['transform'])
+  assert_allclose(model.score_pairs(pairs), expected['score_pairs'],
+                  atol=1e-10)
+  for method in ['predict', 'decision_function']:
+    if hasattr(model, method):
+      assert_allclose(getattr(model, method)(input_data), expected[method],
+                      atol=1e-10)
+  # formed points are still accepted
+  assert_allclose(model.transform(X[:5]), X[:5].dot(model.transformer_.T))
+
+
+def test_cache_embedding_invalidated_on_refit():
+  """Tests that the cached embedding is computed once, and computed again
+  after a new fit"""
+  X, y = make_classification(random_state=42)
+  indices = np.arange(X.shape[0])
+  nca = NCA(max_iter=5, preprocessor=X, cache_embedding=True)
+  nca.fit(indices, y)
+  embedding = nca.transform(indices)
+  indexer = nca._get_embedding_indexer()
+  assert_allclose(indexer.X, X.dot(nca.transformer_.T))
+  nca.transform([0, 1])
+  assert nca._get_embedding_indexer() is indexer
+
+  nca.set_params(num_dims=2)
+  nca.fit(indices, y)
+  assert nca._get_embedding_indexer() is not indexer
+  assert nca.transform(indices).shape == (X.shape[0], 2)
+  assert not np.allclose(nca.transform(indices)[:, :2], embedding[:, :2])
+
+
+@pytest.mark.parametrize('n_jobs', [None, 2])
+def test_cache_embedding_not_computed_for_points(n_jobs):
+  """Tests that the cached embedding is only computed when indicators of
+  points are given, not when the points themselves are"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5, preprocessor=X, cache_embedding=True, n_jobs=n_jobs)
+  nca.fit(X, y)
+  nca.transform(X[:2])
+  nca.score_pairs(np.stack([X[:2], X[2:4]], axis=1))
+  assert 'embedding' not in nca._inference_cache
+  nca.transform([0, 1])
+  assert 'embedding' in nca._inference_cache
+
+
+def test_cache_embedding_without_array_preprocessor():
+  """Tests that cache_embedding has no effect if the preprocessor is not an
+  array"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5, preprocessor=lambda indices: X[indices],
+            cache_embedding=True)
+  nca.fit(np.arange(X.shape[0]), y)
+  assert nca._get_embedding_indexer() is None
+  assert_allclose(nca.transform([0, 4]), X[[0, 4]].dot(nca.transformer_.T))
+
+
+@pytest.mark.parametrize('batch_size, gallery_batch_size',
+                         [(1000, None), (7, None), (7, 11), (1, 3), (50, 5)])
+def test_retrieve_coherent_with_pairwise_distances(batch_size,
+                                                   gallery_batch_size):
+  """Tests that retrieve finds the nearest gallery points under the learned
+  metric, whatever the sizes of the blocks"""
+  X, y = make_classification(random_state=42, n_samples=150)
+  nca = NCA(max_iter=5).fit(X, y)
+  queries, gallery = X[:40], X[40:]
+  distances, indices = nca.retrieve(queries, gallery, k=5,
+                                    batch_size=batch_size,
+                                    gallery_batch_size=gallery_batch_size)
+  pairwise = nca.pairwise_distances(queries, gallery)
+  assert_array_equal(indices, np.argsort(pairwise, axis=1)[:, :5])
+  assert_allclose(distances, np.sort(pairwise, axis=1)[:, :5], atol=1e-6)
+
+
+def test_retrieve_with_preprocessor():
+  """Tests that queries and gallery can be indicators of points"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5, preprocessor=X).fit(np.arange(X.shape[0]), y)
+  distances, indices = nca.retrieve([0, 1, 2], np.arange(10, 100), k=3,
+                                    batch_size=2)
+  distances_formed, indices_formed = nca.retrieve(X[:3], X[10:], k=3)
+  assert_array_equal(indices, indices_formed)
+  assert_allclose(distances, distances_formed)
+
+
+@pytest.mark.parametrize('k', [0, 11])
+def test_retrieve_invalid_k(k):
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5).fit(X, y)
+  with pytest.raises(ValueError) as raised_error:
+    nca.retrieve(X[:5], X[:10], k=k)
+  assert str(raised_error.value) == ("Expected 0 < k <= n_gallery, but k={} "
+                                     "and n_gallery=10.".format(k))
+
+
+@pytest.mark.parametrize('working_memory', [None, 1e-3])
+def test_similarity_join(working_memory):
+  """Tests that similarity_join finds exactly the pairs of distinct points
+  within the threshold"""
+  X, y = make_classification(random_state=42, n_samples=120)
+  X[7] = X[3]  # an exact duplicate, with a zero distance
+  nca = NCA(max_iter=5).fit(X, y)
+  pairwise = nca.pairwise_distances(X)
+  threshold = np.percentile(pairwise, 5)
+  graph = nca.similarity_join(X, threshold, working_memory=working_memory)
+  assert sp.isspmatrix_csr(graph)
+  expected = (pairwise <= threshold) & ~np.eye(X.shape[0], dtype=bool)
+  assert_array_equal(np.repeat(np.arange(X.shape[0]), np.diff(graph.indptr)),
+                     np.nonzero(expected)[0])
+  assert_array_equal(graph.indices, np.nonzero(expected)[1])
+  assert_allclose(graph.data, pairwise[expected], atol=1e-6)
+  assert graph[3, 7] == 0 and graph[7, 3] == 0
+  assert nca.similarity_join(X, -1.).nnz == 0
+
+
+def test_similarity_join_duplicates():
+  """Tests that similarity_join with a zero threshold finds all the exact
+  duplicates, although the squared norms expansion does not give them zero
+  distances"""
+  X = load_iris().data
+  X = np.vstack([X, X[[10, 20, 30, 40, 50]]])  # 5 duplicated rows
+  covariance = Covariance().fit(X)
+  graph = covariance.similarity_join(X, 0.)
+  expected = ((squareform(pdist(covariance.transform(X))) == 0) &
+              ~np.eye(X.shape[0], dtype=bool))
+  assert expected.sum() == 12  # (iris has one duplicate already)
+  # (the zero distances are stored explicitly)
+  assert_array_equal(np.repeat(np.arange(X.shape[0]), np.diff(graph.indptr)),
+                     np.nonzero(expected)[0])
+  assert_array_equal(graph.indices, np.nonzero(expected)[1])
+  assert (graph.data == 0).all()
+
+
+def test_radius_neighbors():
+  """Tests that radius_neighbors finds the indexed points within the
+  radius"""
+  X, y = make_classification(random_state=42, n_samples=120)
+  nca = NCA(max_iter=5).fit(X, y)
+  nca.build_index(X[20:])
+  pairwise = nca.pairwise_distances(X[:20], X[20:])
+  radius = np.percentile(pairwise, 10)
+  graph = nca.radius_neighbors(X[:20], radius)
+  assert sp.isspmatrix_csr(graph)
+  assert graph.shape == (20, 100)
+  dense = graph.toarray()
+  assert_array_equal(dense > 0, pairwise <= radius)
+  assert_allclose(dense[pairwise <= radius], pairwise[pairwise <= radius])
+
+
+@pytest.mark.parametrize('estimator, build_dataset', metric_learners,
+                         ids=ids_metric_learners)
+def test_inference_dtype_float32(estimator, build_dataset):
+  """Tests that with inference_dtype=np.float32, points are embedded in
+  single precision, with results close to the double precision ones"""
+  input_data, labels, _, X = build_dataset()
+  model = clone(estimator)
+  set_random_state(model)
+  model.fit(input_data, labels)
+  pairs = np.array(list(product(X[:10], X[:10])))
+  expected_transform = model.transform(X)
+  expected_scores = model.score_pairs(pairs)
+
+  model.set_params(inference_dtype=np.float32)
+  assert model.transformer_.dtype == np.float64
+  for inputs in [X, X.astype(np.float32)]:
+    X_embedded = model.transform(inputs)
+    assert X_embedded.dtype == np.float32
+    assert_allclose(X_embedded, expected_transform, rtol=1e-4, atol=1e-4)
+  scores = model.score_pairs(pairs.astype(np.float32))
+  assert scores.dtype == np.float32
+  assert_allclose(scores, expected_scores, rtol=1e-4, atol=1e-4)
+  # the single precision transformer is only computed once
+  assert model._get_inference_factor() is model._get_inference_factor()
+
+
+def test_inference_dtype_does_not_change_fit():
+  """Tests that inference_dtype only affects inference, not training (LMNN
+  embeds the points during its fit)"""
+  X, y = load_iris(return_X_y=True)
+  expected = LMNN(k=5).fit(X, y).transformer_
+  lmnn = LMNN(k=5, inference_dtype=np.float32).fit(X, y)
+  assert lmnn.transformer_.dtype == np.float64
+  assert_array_equal(lmnn.transformer_, expected)
+
+
+def test_inference_dtype_with_cache_embedding():
+  """Tests that the cached embedding is in the inference dtype"""
+  X, y = make_classification(random_state=42)
+  indices = np.arange(X.shape[0])
+  nca = NCA(max_iter=5, preprocessor=X, cache_embedding=True).fit(indices, y)
+  assert nca.transform(indices).dtype == np.float64
+  nca.set_params(inference_dtype=np.float32)
+  assert nca.transform(indices).dtype == np.float32
+  assert nca.score_pairs([[0, 1], [1, 2]]).dtype == np.float32
+
+
+@pytest.mark.parametrize('estimator, build_dataset', metric_learners,
+                         ids=ids_metric_learners)
+def test_score_pairs_iter_transform_iter(estimator, build_dataset):
+  """Tests that scoring and embedding blocks of inputs one by one gives the
+  same results as scoring and embedding all of them at once"""
+  input_data, labels, _, X = build_dataset()
+  model = clone(estimator)
+  set_random_state(model)
+  model.fit(input_data, labels)
+  pairs = np.array(list(product(X[:10], X[:10])))
+  # blocks of decreasing then increasing sizes, so buffers are reused
+  bounds = [0, 60, 70, 100]
+  blocks = [pairs[start:stop] for start, stop in zip(bounds, bounds[1:])]
+  scores = list(model.score_pairs_iter(iter(blocks)))
+  assert [len(s) for s in scores] == [60, 10, 30]
+  assert_allclose(np.concatenate(scores), model.score_pairs(pairs))
+
+  X_blocks = [X[:7], X[7:9], X[9:10]]
+  X_embedded = list(model.transform_iter(iter(X_blocks)))
+  assert_allclose(np.concatenate(X_embedded), model.transform(X[:10]))
+  # without copy, the blocks are views on the same reused array
+  views = list(model.transform_iter(iter(X_blocks), copy=False))
+  assert all(np.shares_memory(views[0], view) for view in views[1:])
+
+
+@pytest.mark.parametrize('cache_embedding', [False, True])
+def test_score_pairs_iter_indicators(cache_embedding):
+  """Tests score_pairs_iter and transform_iter on indicators of points"""
+  X, y = make_classification(random_state=42)
+  indices = np.arange(X.shape[0])
+  nca = NCA(max_iter=5, preprocessor=X,
+            cache_embedding=cache_embedding).fit(indices, y)
+  rng = np.random.RandomState(42)
+  pairs = rng.randint(X.shape[0], size=(50, 2))
+  scores = np.concatenate(list(nca.score_pairs_iter([pairs[:20], pairs[20:],
+                                                     pairs[:5]])))
+  assert_allclose(scores, np.concatenate([nca.score_pairs(pairs),
+                                          nca.score_pairs(pairs[:5])]))
+  X_embedded = np.concatenate(list(nca.transform_iter([indices[:30],
+                                                       indices[30:]])))
+  assert_allclose(X_embedded, nca.transform(X))
+
+
+@pytest.mark.parametrize('n_jobs', [2, -1])
+@pytest.mark.parametrize('estimator, build_dataset', metric_learners,
+                         ids=ids_metric_learners)
+def test_n_jobs(estimator, build_dataset, n_jobs):
+  """Tests that transforming and scoring blocks of inputs in parallel gives
+  the same results as doing it in a single thread"""
+  input_data, labels, _, X = build_dataset()
+  model = clone(estimator)
+  set_random_state(model)
+  model.fit(input_data, labels)
+  pairs = np.array(list(product(X[:10], X[:10])))
+  expected_transform = model.transform(X)
+  expected_scores = model.score_pairs(pairs)
+
+  model.set_params(n_jobs=n_jobs)
+  assert_allclose(model.transform(X), expected_transform)
+  assert_allclose(model.transform(X.tolist()), expected_transform)
+  assert_allclose(model.score_pairs(pairs), expected_scores)
+  assert_allclose(model.score_pairs(pairs[:1]), expected_scores[:1])
+
+
+@pytest.mark.parametrize('cache_embedding', [False, True])
+def test_n_jobs_indicators(cache_embedding):
+  """Tests n_jobs on indicators of points, and that errors raised in the
+  threads are raised to the caller"""
+  X, y = make_classification(random_state=42)
+  indices = np.arange(X.shape[0])
+  nca = NCA(max_iter=5, preprocessor=X,
+            cache_embedding=cache_embedding).fit(indices, y)
+  pairs = np.random.RandomState(42).randint(X.shape[0], size=(50, 2))
+  expected_scores = nca.score_pairs(pairs)
+  nca.set_params(n_jobs=3)
+  assert_allclose(nca.transform(indices), nca.transform(X))
+  assert_allclose(nca.score_pairs(pairs), expected_scores)
+  with pytest.raises(ValueError):
+    nca.score_pairs(np.ones((10, 3), dtype=int))
+  nca.set_params(n_jobs=0)
+  with pytest.raises(ValueError):
+    nca.transform(X)
+
+
+def test_n_jobs_thread_pool():
+  """Tests that the threads are started once, and then reused by the
+  following calls and by other metric learners"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5, n_jobs=3).fit(X, y)
+  nca.transform(X)
+  pool = _get_thread_pool(3)
+  n_threads = threading.active_count()
+  for _ in range(5):
+    nca.transform(X[:4])
+    nca.score_pairs(np.stack([X[:4], X[4:8]], axis=1))
+  NCA(max_iter=5, n_jobs=3).fit(X, y).transform(X)
+  assert threading.active_count() == n_threads
+  assert _get_thread_pool(3) is pool
+  assert_allclose(pickle.loads(pickle.dumps(nca)).transform(X),
+                  nca.transform(X))
+
+
+@pytest.mark.parametrize('estimator, build_dataset', metric_learners,
+                         ids=ids_metric_learners)
+def test_export_inference_model(estimator, build_dataset, tmpdir):
+  """Tests that the exported model gives the same results as the metric
+  learner, with its arrays memory-mapped"""
+  input_data, labels, _, X = build_dataset()
+  model = clone(estimator)
+  set_random_state(model)
+  model.fit(input_data, labels)
+  model.build_index(X)
+  path = str(tmpdir.join('model'))
+  model.export_inference_model(path)
+
+  loaded = load_inference_model(path)
+  assert isinstance(loaded, InferenceModel)
+  assert isinstance(loaded.transformer_, np.memmap)
+  assert_array_equal(loaded.transformer_, model.transformer_)
+  assert_allclose(loaded.transform(X), model.transform(X))
+  pairs = np.array(list(product(X[:10], X[:10])))
+  assert_allclose(loaded.score_pairs(pairs), model.score_pairs(pairs))
+  # (the indices of equidistant neighbors can differ)
+  distances, indices = loaded.kneighbors(X[:5])
+  assert_allclose(distances, model.kneighbors(X[:5])[0])
+  assert_allclose(distances, np.linalg.norm(
+      model.transform(X[:5])[:, np.newaxis] - model.transform(X)[indices],
+      axis=2))
+
+  loaded = load_inference_model(path, mmap_mode=None, n_jobs=2)
+  assert not isinstance(loaded.transformer_, np.memmap)
+  assert_allclose(loaded.transform(X), model.transform(X))
+
+
+def test_load_inference_model_index(tmpdir):
+  """Tests that the loaded index searches the memory-mapped embedding by
+  brute force, without any work when loading, and with the results of the
+  index it was exported from"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5).fit(X, y)
+  nca.build_index(X[20:], algorithm='kd_tree')
+  path = str(tmpdir.join('model'))
+  nca.export_inference_model(path)
+  loaded = load_inference_model(path)
+  assert isinstance(loaded.index_._fit_X, np.memmap)
+  assert loaded.index_._norms is None
+
+  distances, indices = loaded.kneighbors(X[:20], n_neighbors=3)
+  expected_distances, expected_indices = nca.kneighbors(X[:20], n_neighbors=3)
+  assert_array_equal(indices, expected_indices)
+  assert_allclose(distances, expected_distances)
+  assert_array_equal(loaded.kneighbors(X[:20], return_distance=False),
+                     nca.kneighbors(X[:20], return_distance=False))
+  radius = np.median(distances)
+  graph = loaded.radius_neighbors(X[:20], radius)
+  expected = nca.radius_neighbors(X[:20], radius)
+  assert graph.shape == expected.shape == (20, 80)
+  assert_array_equal(graph.indptr, expected.indptr)
+  assert_allclose(graph.toarray(), expected.toarray())
+  with pytest.raises(ValueError) as raised_error:
+    loaded.kneighbors(X[:20], n_neighbors=81)
+  assert str(raised_error.value) == ("Expected 0 < n_neighbors <= n_indexed, "
+                                     "but n_neighbors=81 and n_indexed=80.")
+
+
+def test_export_inference_model_options(tmpdir):
+  """Tests the export of the inference dtype, without the preprocessor or
+  an index, and the errors of export and load"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5, preprocessor=X, inference_dtype=np.float32)
+  path = str(tmpdir.join('model'))
+  with pytest.raises(NotFittedError):
+    nca.export_inference_model(path)
+  nca.fit(np.arange(X.shape[0]), y)
+  nca.export_inference_model(path)
+  assert sorted(tmpdir.join('model').listdir()) == [
+      tmpdir.join('model', 'metadata.json'),
+      tmpdir.join('model', 'transformer.npy')]
+  loaded = load_inference_model(path)
+  assert loaded.transformer_.dtype == np.float32
+  X_embedded = loaded.transform(X)
+  assert X_embedded.dtype == np.float32
+  assert_allclose(X_embedded, nca.transform(X), rtol=1e-5)
+  with pytest.raises(NotFittedError):
+    loaded.kneighbors(X)
+
+  metadata = tmpdir.join('model', 'metadata.json')
+  metadata.write(metadata.read().replace('"format_version": 1',
+                                         '"format_version": 100'))
+  with pytest.raises(ValueError) as raised_error:
+    load_inference_model(path)
+  assert str(raised_error.value).startswith(
+      'Unsupported inference model format version 100')
+
+
+@pytest.mark.parametrize('estimator, build_dataset', metric_learners,
+                         ids=ids_metric_learners)
+def test_quantize(estimator, build_dataset):
+  """Tests that the quantized model gives results close to the metric
+  learner's, and that the reported error is the actual one"""
+  input_data, labels, _, X = build_dataset()
+  model = clone(estimator)
+  set_random_state(model)
+  model.fit(input_data, labels)
+  pairs = np.array(list(product(X[:10], X[:10])))
+  scale = np.max(model.pairwise_distances(X))
+
+  quantized = model.quantize(X[:20])
+  assert isinstance(quantized, QuantizedModel)
+  assert quantized.quantized_transformer.dtype == np.int8
+  assert quantized.max_distance_error_ == np.max(np.abs(
+      quantized.pairwise_distances(X[:20]) - model.pairwise_distances(X[:20])))
+  assert quantized.max_distance_error_ < 0.05 * scale
+  assert_allclose(quantized.transformer_, model.transformer_,
+                  atol=0.01 * np.abs(model.transformer_).max())
+
+  quantized = model.quantize(dtype=np.int16)
+  assert quantized.max_distance_error_ is None
+  assert_allclose(quantized.score_pairs(pairs), model.score_pairs(pairs),
+                  atol=1e-3 * scale)
+  assert_allclose(quantized.transform(X), model.transform(X),
+                  atol=1e-3 * scale)
+
+
+def test_quantize_options():
+  """Tests the quantized model with a preprocessor, threads and sparse
+  inputs, and its errors"""
+  X, y = make_classification(random_state=42)
+  indices = np.arange(X.shape[0])
+  nca = NCA(max_iter=5, preprocessor=X, n_jobs=2).fit(indices, y)
+  quantized = nca.quantize(indices)
+  assert quantized.n_jobs == 2
+  assert_array_equal(quantized.transform(indices), quantized.transform(X))
+  X_embedded = quantized.transform(X)
+  assert_allclose(quantized.score_pairs([[0, 1], [2, 3]]),
+                  [np.linalg.norm(X_embedded[1] - X_embedded[0]),
+                   np.linalg.norm(X_embedded[3] - X_embedded[2])], rtol=0.05)
+  assert_allclose(quantized.transform(sp.csr_matrix(X)),
+                  X.dot(quantized.transformer_.T))
+  with pytest.raises(ValueError):
+    nca.quantize(dtype=np.float32)
+  with pytest.raises(TypeError):
+    quantized.export_inference_model('path')
+  with pytest.raises(NotFittedError):
+    NCA().quantize()
+
+
+@pytest.mark.parametrize('dtype', [np.int8, np.int16])
+def test_quantize_integer_product(dtype):
+  """Tests that the quantized model embeds dense points with the exact
+  product of the integer matrices, without keeping any float copy of its
+  transformation, and that it is not dequantized to build and query an
+  index"""
+  X, y = make_classification(random_state=42)
+  quantized = NCA(max_iter=5).fit(X, y).quantize(dtype=dtype)
+  X_quantized, X_scales = _quantize_rows(X, dtype)
+  expected = X_quantized.astype(np.int64).dot(
+      quantized.quantized_transformer.astype(np.int64).T)
+  assert_array_equal(quantized.transform(X),
+                     expected * X_scales[:, np.newaxis] * quantized.scales)
+  quantized.build_index(X)
+  quantized.kneighbors(X[:5])
+  assert 'dequantized_transformer' not in quantized._inference_cache
+  for _, value in quantized._inference_cache.values():
+    assert not (isinstance(value, np.ndarray) and
+                value.shape == quantized.quantized_transformer.shape)
+
+
+def test_accumulation_dtype():
+  """Tests that the products of quantized integers are summed in a type
+  that cannot overflow"""
+  assert _accumulation_dtype(np.int8, 133144) is np.int32
+  assert _accumulation_dtype(np.int8, 133145) is np.int64
+  assert _accumulation_dtype(np.int16, 2) is np.int32
+  assert _accumulation_dtype(np.int16, 3) is np.int64
+  with pytest.raises(ValueError) as raised_error:
+    _accumulation_dtype(np.int16, 2 ** 34)
+  assert str(raised_error.value) == ("Cannot accumulate the products of "
+                                     "int16 values over 17179869184 features "
+                                     "without overflow.")
+  model = InferenceModel(np.full((1, 133145), 2.))
+  assert_array_equal(model.quantize().transform(np.ones((1, 133145))),
+                     [[2. * 133145]])
+
+
+@pytest.mark.parametrize('pairs', [[[0, 1], [2, 3], [4, 5]],
+                                   [[0, 1], [1, 2], [2, 0], [0, 2]]],
+                         ids=['distinct_points', 'repeated_points'])
+def test_score_pairs_sparse_preprocessor(pairs):
+  """Tests that indicators of pairs over a sparse preprocessor are scored
+  like over the dense one"""
+  X, y = make_classification(n_samples=50, n_features=100, random_state=42)
+  X[np.abs(X) < 1.5] = 0
+  nca = NCA(max_iter=5, num_dims=3).fit(X, y)
+  nca.set_params(preprocessor=X)
+  nca.check_preprocessor()
+  expected_scores = nca.score_pairs(pairs)
+  expected_transform = nca.transform(np.arange(10))
+  for X_sparse in [sp.csr_matrix(X), sp.csc_matrix(X)]:
+    nca.set_params(preprocessor=X_sparse)
+    nca.check_preprocessor()
+    assert_allclose(nca.score_pairs(pairs), expected_scores)
+    scores_iter = nca.score_pairs_iter([pairs, pairs[:1]])
+    assert_allclose(next(scores_iter), expected_scores)
+    assert_allclose(next(scores_iter), expected_scores[:1])
+    assert_allclose(nca.transform(np.arange(10)), expected_transform)
+
+
+def test_metric_structure():
+  """Tests that diagonal metrics are used through their diagonal, with the
+  same results as through the dense transformer"""
+  X, y = make_classification(n_samples=50, n_features=5, random_state=42)
+  scaling = np.array([1., 0.5, 0., 2., 3.])
+  model = InferenceModel(scaling)
+  structure, factor = model._get_metric_structure()
+  assert structure == 'diagonal'
+  assert factor is scaling
+  assert '_transformer' not in model.__dict__
+  assert_array_equal(model.transformer_, np.diag(scaling))
+  assert model.transformer_ is model.transformer_
+  assert_allclose(model.transform(X), X.dot(np.diag(scaling)))
+  assert_allclose(model.transform(sp.csr_matrix(X)), X.dot(np.diag(scaling)))
+  assert_array_equal(model.get_mahalanobis_matrix(), np.diag(scaling ** 2))
+  pairs = np.stack([X[:10], X[10:20]], axis=1)
+  expected = np.sqrt(((X[:10] - X[10:20]) ** 2).dot(scaling ** 2))
+  assert_allclose(model.score_pairs(pairs), expected)
+  assert_allclose(next(model.score_pairs_iter([pairs])), expected)
+  assert_allclose(model.get_metric()(X[0], X[10]), expected[0])
+  assert_allclose(model.get_metric(batched=True).paired(X[:10], X[10:20]),
+                  expected)
+  assert_array_equal(model.get_metric(batched=True).VI, np.diag(scaling ** 2))
+  model.set_params(n_jobs=2, inference_dtype=np.float32)
+  assert_allclose(model.score_pairs(pairs), expected, rtol=1e-5)
+
+  # the conversions are not shared between fits, nor modifiable
+  model.get_mahalanobis_matrix()[0, 0] = 42.
+  assert model.get_mahalanobis_matrix()[0, 0] == 1.
+  model.transformer_ = np.ones((2, 5))
+  assert model._get_metric_structure()[0] == 'full'
+  assert '_diagonal' not in model.__dict__
+  assert_array_equal(model.get_mahalanobis_matrix(), 2 * np.ones((5, 5)))
+  # the structure is never found by scanning the dense transformer
+  model.transformer_ = np.diag(scaling)
+  assert model._get_metric_structure()[0] == 'full'
+  assert_allclose(model.transform(X), X.dot(np.diag(scaling)), rtol=1e-5)
+
+
+def test_diagonal_mmc(tmpdir):
+  """Tests that MMC with diagonal=True only stores (and exports) the
+  diagonal of its transformation, and builds the dense one only when it is
+  accessed"""
+  X, y = load_iris(return_X_y=True)
+  pairs = np.stack([X[:50], X[50:100]], axis=1)
+  pairs_y = np.where(y[:50] == y[50:100], 1, -1)
+  pairs_y[:10] = 1
+  mmc = MMC(diagonal=True).fit(pairs, pairs_y)
+  structure, scaling = mmc._get_metric_structure()
+  assert structure == 'diagonal'
+  assert scaling.shape == (X.shape[1],)
+  assert '_transformer' not in mmc.__dict__
+  assert_allclose(mmc.transform(X), X * scaling)
+  mmc.score_pairs(pairs)
+  assert 'transformer' not in mmc._inference_cache
+  assert_array_equal(mmc.transformer_, np.diag(scaling))
+  assert_allclose(mmc.get_mahalanobis_matrix(), mmc.A_)
+  assert_allclose(pickle.loads(pickle.dumps(mmc)).transform(X),
+                  mmc.transform(X))
+  mmc.export_inference_model(str(tmpdir.join('model')))
+  loaded = load_inference_model(str(tmpdir.join('model')))
+  assert loaded._get_metric_structure()[0] == 'diagonal'
+  assert_allclose(loaded.transform(X), mmc.transform(X))
+
+
+def test_unpickle_transformer_attribute():
+  """Tests that metric learners pickled when ``transformer_`` was stored in
+  their ``__dict__`` can still be unpickled"""
+  X, y = make_classification(random_state=42)
+  nca = NCA(max_iter=5).fit(X, y)
+  state = nca.__getstate__()
+  state['transformer_'] = state.pop('_transformer')
+  unpickled = NCA.__new__(NCA)
+  unpickled.__setstate__(state)
+  assert_array_equal(unpickled.transformer_, nca.transformer_)
+  assert_array_equal(unpickled.transform(X), nca.transform(X))
+
+
+def test_inference_cache():
+  """Tests that the state derived from the fit is cached without changing
+  the attributes of the metric learner, computed again after a new fit or a
+  compression, and not pickled"""
+  X, y = make_classification(random_state=42)
+  indices = np.arange(X.shape[0])
+  nca = NCA(max_iter=5, preprocessor=X, cache_embedding=True,
+            inference_dtype=np.float32).fit(indices, y)
+  dict_before = nca.__dict__.copy()
+  nca.transform(indices)
+  nca.score_pairs([[0, 1], [2, 3]])
+  matrix = nca.get_mahalanobis_matrix()
+  assert nca.__dict__ == dict_before
+  assert set(nca._inference_cache) == {'inference_factor', 'embedding',
+                                       'mahalanobis_matrix'}
+  transformer = nca._get_inference_factor()
+  assert nca._get_inference_factor() is transformer
+
+  nca.compress(rank=2)
+  assert nca._get_inference_factor().shape == (2, X.shape[1])
+  assert nca.transform(indices).shape == (X.shape[0], 2)
+  assert not np.allclose(nca.get_mahalanobis_matrix(), matrix)
+
+  unpickled = pickle.loads(pickle.dumps(nca))
+  assert unpickled._inference_cache == {}
+  assert_allclose(unpickled.transform(indices), nca.transform(indices))
+
+
+@pytest.mark.parametrize('estimator, build_dataset', metric_learners,
+                         ids=ids_metric_learners)
+def test_compress(estimator, build_dataset):
+  """Tests that compressing a metric learner keeps its metric when all the
+  energy is kept, and approximates it with the best low-rank factor"""
+  input_data, labels, _, X = build_dataset()
+  model = clone(estimator)
+  set_random_state(model)
+  model.fit(input_data, labels)
+  mahalanobis_matrix = model.get_mahalanobis_matrix()
+  distances = model.pairwise_distances(X)
+
+  model.compress(rank=X.shape[1], X_validation=X)
+  assert model.energy_ == pytest.approx(1.)
+  assert model.max_distance_error_ <= 1e-6 * np.max(distances)
+  assert_allclose(model.get_mahalanobis_matrix(), mahalanobis_matrix,
+                  rtol=1e-6, atol=1e-8 * np.max(np.abs(mahalanobis_matrix)))
+  assert_allclose(model.pairwise_distances(X), distances, rtol=1e-6,
+                  atol=1e-6 * np.max(distances))
+
+  model.compress(rank=1)
+  assert model.transformer_.shape == (1, X.shape[1])
+  eigenvalues, eigenvectors = np.linalg.eigh(mahalanobis_matrix)
+  assert_allclose(model.get_mahalanobis_matrix(),
+                  eigenvalues[-1] * np.outer(eigenvectors[:, -1],
+                                             eigenvectors[:, -1]),
+                  atol=1e-8)
+  assert model.energy_ == pytest.approx(eigenvalues[-1] /
+                                        np.sum(eigenvalues))
+
+
+def test_compress_options():
+  """Tests the choice of the rank by energy, and the errors of compress"""
+  X, y = make_classification(n_samples=50, n_features=5, random_state=42)
+  scaling = np.array([4., 3., 0.1, 0.01, 0.])
+  model = InferenceModel(np.diag(scaling))
+  distances = model.pairwise_distances(X)
+  model.compress(energy=0.9, X_validation=X)
+  assert model.transformer_.shape == (2, 5)
+  assert model.energy_ == pytest.approx(25 / np.sum(scaling ** 2))
+  assert model.max_distance_error_ == pytest.approx(
+      np.max(np.abs(model.pairwise_distances(X) - distances)))
+  assert model.max_distance_error_ > 0
+  assert model.compress(rank=5).transformer_.shape == (2, 5)
+  for kwargs in [{'energy': 0.}, {'energy': 1.5}, {'rank': 0},
+                 {'rank': 6}]:
+    with pytest.raises(ValueError):
+      model.compress(**kwargs)
+  with pytest.raises(TypeError):
+    NCA(max_iter=5).fit(X, y).quantize().compress()
+  with pytest.raises(NotFittedError):
+    NCA().compress()
+
+
+@pytest.mark.parametrize('estimator, build_dataset', metric_learners,
+                         ids=ids_metric_learners)
+def test_get_metric_batched(estimator, build_dataset):
+  """Tests that the batched metric computes the same distances as the
+  metric learner, as scipy with its Mahalanobis matrix, and once pickled"""
+  input_data, labels, _, X = build_dataset()
+  model = clone(estimator)
+  set_random_state(model)
+  model.fit(input_data, labels)
+  metric = model.get_metric(batched=True)
+  U, V = X[:10], X[10:25]
+  expected = model.pairwise_distances(U, V)
+  assert_allclose(metric.pairwise(U, V), expected)
+  assert_allclose(metric.pairwise(U, V, squared=True), expected ** 2)
+  assert_allclose(metric.pairwise(U), model.pairwise_distances(U))
+  assert_allclose(cdist(U, V, 'mahalanobis', VI=metric.VI), expected,
+                  rtol=1e-5, atol=1e-8)
+  assert_allclose(metric.paired(U, V[:10]),
+                  model.score_pairs(np.stack([U, V[:10]], axis=1)))
+  assert metric(U[0], V[0]) == pytest.approx(
+      model.get_metric()(U[0], V[0]))
+  assert_allclose(pickle.loads(pickle.dumps(metric)).pairwise(U, V),
+                  expected)
+  with pytest.raises(ValueError):
+    metric.paired(U, V)
+
+  # the metric does not change when the metric learner is fitted again
+  model.fit(np.sin(input_data), labels)
+  assert_allclose(metric.pairwise(U, V), expected)
+
+
+@pytest.mark.parametrize('cache_embedding', [False, True])
+@pytest.mark.parametrize('n_jobs', [None, 2])
+def test_quadruplets_fused_scoring(cache_embedding, n_jobs):
+  """Tests that quadruplets are scored like their two pairs, and that the
+  preprocessor is called once on their distinct indicators"""
+  quadruplets, _, X, _ = build_quadruplets(with_preprocessor=True)
+  lsml = LSML(max_iter=5).fit(X[quadruplets])
+  expected = (lsml.score_pairs(X[quadruplets[:, :2]]) -
+              lsml.score_pairs(X[quadruplets[:, 2:]]))
+  assert_allclose(lsml.decision_function(X[quadruplets]), expected)
+
+  calls = []
+
+  def preprocessor(indices):
+    calls.append(indices)
+    return X[indices]
+
+  lsml.set_params(preprocessor=preprocessor, n_jobs=n_jobs)
+  lsml.check_preprocessor()
+  assert_allclose(lsml.decision_function(quadruplets), expected)
+  assert_array_equal(lsml.predict(quadruplets.tolist()), np.sign(expected))
+  if n_jobs is None:
+    assert len(calls) == 2
+    assert_array_equal(calls[0], np.unique(quadruplets))
+  lsml.set_params(preprocessor=X, cache_embedding=cache_embedding)
+  lsml.check_preprocessor()
+  assert_allclose(lsml.decision_function(quadruplets), expected)
+  assert lsml.score(quadruplets) == -np.mean(np.sign(expected))
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from sklearn.base import clone
+from sklearn.datasets import make_classification, make_regression
+from sklearn.exceptions import NotFittedError
+from sklearn.model_selection import cross_val_score
+from sklearn.neighbors import KNeighborsClassifier, KNeighborsRegressor
+
+from metric_learn import (MLKR, NCA, MetricKNeighborsClassifier,
+                          MetricKNeighborsRegressor)
+
+
+@pytest.mark.parametrize('algorithm', ['auto', 'brute', 'kd_tree'])
+def test_classifier_matches_callable_metric(algorithm):
+  """Tests that the classifier predicts like a k-nearest neighbors
+  classifier using the learned metric as a callable"""
+  X, y = make_classification(n_samples=100, n_features=5, random_state=42)
+  knn = MetricKNeighborsClassifier(NCA(max_iter=10), n_neighbors=3,
+                                   algorithm=algorithm).fit(X, y)
+  # the metric learner given is not fitted, a clone is
+  assert not hasattr(knn.metric_learner, 'transformer_')
+  reference = KNeighborsClassifier(
+      n_neighbors=3, metric=knn.metric_learner_.get_metric()).fit(X, y)
+  assert_array_equal(knn.classes_, reference.classes_)
+  assert_array_equal(knn.predict(X), reference.predict(X))
+  assert_allclose(knn.predict_proba(X), reference.predict_proba(X))
+  dist, ind = knn.kneighbors(X[:10])
+  expected_dist, expected_ind = reference.kneighbors(X[:10])
+  assert_allclose(dist, expected_dist, atol=1e-7)
+  assert_array_equal(ind, expected_ind)
+  assert knn.kneighbors(X[:10], n_neighbors=1,
+                        return_distance=False).shape == (10, 1)
+
+
+def test_classifier_with_preprocessor():
+  """Tests that the classifier accepts indicators of points"""
+  X, y = make_classification(n_samples=100, n_features=5, random_state=42)
+  knn = MetricKNeighborsClassifier(NCA(max_iter=10))
+  knn_indicators = MetricKNeighborsClassifier(NCA(max_iter=10,
+                                                  preprocessor=X))
+  indices = np.arange(X.shape[0])
+  assert_array_equal(knn.fit(X, y).predict(X),
+                     knn_indicators.fit(indices, y).predict(indices))
+  assert cross_val_score(clone(knn), X, y, cv=3).mean() > 0.5
+
+
+def test_regressor_matches_callable_metric():
+  """Tests that the regressor predicts like a k-nearest neighbors regressor
+  using the learned metric as a callable"""
+  X, y = make_regression(n_samples=100, n_features=5, random_state=42)
+  knn = MetricKNeighborsRegressor(MLKR(max_iter=10), n_neighbors=3,
+                                  weights='distance').fit(X, y)
+  reference = KNeighborsRegressor(
+      n_neighbors=3, weights='distance',
+      metric=knn.metric_learner_.get_metric()).fit(X, y)
+  assert_allclose(knn.predict(X[:20]), reference.predict(X[:20]))
+  assert knn.score(X, y) == pytest.approx(reference.score(X, y))
+
+
+def test_not_fitted():
+  with pytest.raises(NotFittedError):
+    MetricKNeighborsClassifier(NCA()).predict(np.ones((2, 3)))
+  with pytest.raises(NotFittedError):
+    MetricKNeighborsRegressor(MLKR()).kneighbors(np.ones((2, 3)))
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from sklearn.datasets import make_classification
+from sklearn.exceptions import NotFittedError
+
+from metric_learn import NCA, PQIndex
+
+
+@pytest.fixture
+def fitted_nca():
+  X, y = make_classification(n_samples=300, n_features=10, random_state=42)
+  return NCA(max_iter=10).fit(X, y), X, y
+
+
+def test_pq_exact_with_one_cluster_per_point(fitted_nca):
+  """Tests that with as many clusters as points, the codes are exact and so
+  are the neighbors"""
+  nca, X, _ = fitted_nca
+  index = PQIndex(nca, n_subspaces=3, n_clusters=50,
+                  random_state=0).fit(X[:50])
+  assert index.codes_.dtype == np.uint8
+  assert index.codes_.shape == (50, 3)
+  assert [s.stop - s.start for s in index.subspaces_] == [4, 3, 3]
+  assert_allclose(index.decode(), nca.transform(X[:50]), atol=1e-10)
+  dist, ind = index.kneighbors(X[:50], n_neighbors=4)
+  expected_dist, expected_ind = nca.retrieve(X[:50], X[:50], k=4)
+  assert_array_equal(ind, expected_ind)
+  assert_allclose(dist, expected_dist, atol=1e-6)
+
+
+@pytest.mark.parametrize('batch_size, gallery_batch_size',
+                         [(1000, None), (7, 13), (1, 1)])
+def test_pq_asymmetric_distances(fitted_nca, batch_size, gallery_batch_size):
+  """Tests that the distances are the distances between the queries and the
+  decoded indexed points, whatever the block sizes"""
+  nca, X, _ = fitted_nca
+  index = PQIndex(nca, n_subspaces=5, n_clusters=16, random_state=0).fit(X)
+  dist, ind = index.kneighbors(X[:20], n_neighbors=5, batch_size=batch_size,
+                               gallery_batch_size=gallery_batch_size)
+  decoded = index.decode()
+  all_dist = np.sqrt(np.sum((nca.transform(X[:20])[:, None] -
+                             decoded[None])**2, axis=-1))
+  assert_allclose(dist, np.sort(all_dist, axis=1)[:, :5])
+  assert_allclose(dist, all_dist[np.arange(20)[:, None], ind])
+  assert_array_equal(index.kneighbors(X[:20], n_neighbors=5,
+                                      return_distance=False,
+                                      batch_size=batch_size,
+                                      gallery_batch_size=gallery_batch_size),
+                     ind)
+
+
+def test_pq_recall(fitted_nca):
+  """Tests that the approximate neighbors are mostly the exact ones"""
+  nca, X, _ = fitted_nca
+  index = PQIndex(nca, n_subspaces=5, n_clusters=64, random_state=0).fit(X)
+  _, ind = index.kneighbors(X[:50], n_neighbors=10)
+  _, expected_ind = nca.retrieve(X[:50], X, k=10)
+  recall = np.mean([np.intersect1d(a, b).size / 10.
+                    for a, b in zip(ind, expected_ind)])
+  assert recall > 0.5
+
+
+def test_pq_partial_fit(fitted_nca):
+  """Tests that inserted points are encoded with the trained codebooks"""
+  nca, X, _ = fitted_nca
+  index = PQIndex(nca, n_subspaces=2, n_clusters=8, random_state=0)
+  index.partial_fit(X[:100])
+  codebooks = [codebook.copy() for codebook in index.codebooks_]
+  index.partial_fit(X[100:])
+  assert index.n_indexed_ == X.shape[0]
+  for codebook, expected in zip(index.codebooks_, codebooks):
+    assert_array_equal(codebook, expected)
+  assert_array_equal(index.codes_[100:], index._encode(nca.transform(X[100:])))
+
+
+def test_pq_errors(fitted_nca):
+  nca, X, y = fitted_nca
+  with pytest.raises(NotFittedError):
+    PQIndex(NCA()).fit(X)
+  with pytest.raises(NotFittedError):
+    PQIndex(nca).kneighbors(X)
+  with pytest.raises(ValueError):
+    PQIndex(nca, n_clusters=257).fit(X)
+  with pytest.raises(ValueError):
+    PQIndex(nca, n_subspaces=11).fit(X)
+  index = PQIndex(nca, n_clusters=4, random_state=0).fit(X[:10])
+  with pytest.raises(ValueError):
+    index.kneighbors(X, n_neighbors=11)
+  nca.fit(X, y)
+  with pytest.raises(ValueError) as raised_error:
+    index.kneighbors(X)
+  assert str(raised_error.value) == ("The PQ index was built before NCA was "
+                                     "last fitted. Call `fit` again.")
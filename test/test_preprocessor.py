@@ -0,0 +1,139 @@
+import pickle
+import threading
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+from scipy.sparse import csr_matrix
+from sklearn.base import clone
+from sklearn.datasets import load_iris
+from sklearn.utils import check_random_state
+
+from metric_learn import CachedPreprocessor, ITML, NCA
+
+SEED = 42
+RNG = check_random_state(SEED)
+
+
+class CountingPreprocessor(object):
+  """Preprocessor that records the indicators it is called on"""
+
+  def __init__(self, X):
+    self.X = X
+    self.calls = []
+
+  def __call__(self, indices):
+    self.calls.append(np.asarray(indices))
+    return self.X[indices]
+
+
+def test_cached_preprocessor_hits_and_misses():
+  """Checks that only the indicators not in the cache are formed, once each,
+  and that the points are returned in the order of the indicators"""
+  X = RNG.randn(10, 3)
+  counting = CountingPreprocessor(X)
+  preprocessor = CachedPreprocessor(counting)
+  assert_array_equal(preprocessor([3, 1, 3]), X[[3, 1, 3]])
+  assert_array_equal(preprocessor([1, 5, 3, 5]), X[[1, 5, 3, 5]])
+  assert_array_equal(counting.calls[0], [3, 1])
+  assert_array_equal(counting.calls[1], [5])
+  assert preprocessor([1, 3]).shape == (2, 3)
+  assert len(counting.calls) == 2
+  assert preprocessor.stats() == {'n_hits': 4, 'n_misses': 5,
+                                  'n_evictions': 0, 'n_points': 3,
+                                  'nbytes': 3 * X[0].nbytes}
+
+
+def test_cached_preprocessor_eviction():
+  """Checks that the least recently used points are evicted beyond the
+  budget of bytes"""
+  X = RNG.randn(10, 3)
+  counting = CountingPreprocessor(X)
+  preprocessor = CachedPreprocessor(counting, max_bytes=2 * X[0].nbytes)
+  preprocessor([0, 1])
+  preprocessor([0])  # 1 is now the least recently used point
+  preprocessor([2])
+  stats = preprocessor.stats()
+  assert stats['n_evictions'] == 1
+  assert stats['nbytes'] == 2 * X[0].nbytes
+  counting.calls = []
+  assert_array_equal(preprocessor([0, 2, 1]), X[[0, 2, 1]])
+  assert_array_equal(counting.calls[0], [1])
+  # points larger than the budget are not cached
+  preprocessor = CachedPreprocessor(counting, max_bytes=X[0].nbytes - 1)
+  preprocessor([0])
+  assert preprocessor.stats()['n_points'] == 0
+  preprocessor = CachedPreprocessor(counting)
+  preprocessor([0, 1])
+  preprocessor.clear()
+  assert preprocessor.stats()['n_points'] == 0
+  assert preprocessor.stats()['nbytes'] == 0
+
+
+def test_cached_preprocessor_not_cacheable():
+  """Checks that the results which cannot be split by indicator are returned
+  as they are"""
+  X = csr_matrix(RNG.randn(10, 3))
+  preprocessor = CachedPreprocessor(lambda indices: X[indices])
+  assert (preprocessor([2, 4]) != X[[2, 4]]).nnz == 0
+  assert preprocessor.stats()['n_points'] == 0
+
+
+def test_cached_preprocessor_invalid():
+  with pytest.raises(ValueError):
+    CachedPreprocessor(np.ones((2, 2)))
+  with pytest.raises(ValueError):
+    CachedPreprocessor(lambda x: x, max_bytes=-1)
+
+
+def test_cached_preprocessor_metric_learners():
+  """Checks that metric learners with a cached preprocessor give the same
+  results as with the preprocessor, and that they can be cloned and
+  pickled"""
+  X, y = load_iris(return_X_y=True)
+  counting = CountingPreprocessor(X)
+  preprocessor = CachedPreprocessor(counting)
+  indices = np.arange(len(y))
+  nca = NCA(preprocessor=preprocessor, max_iter=5).fit(indices, y)
+  np.testing.assert_allclose(
+      nca.transform(indices[::-1]),
+      NCA(preprocessor=X, max_iter=5).fit(indices, y)
+      .transform(indices[::-1]))
+  assert preprocessor.stats()['n_hits'] == len(y)
+  pairs = np.array([[0, 1], [2, 3], [4, 5], [6, 7], [0, 50]])
+  itml = ITML(preprocessor=preprocessor).fit(pairs, [1, 1, 1, 1, -1])
+  np.testing.assert_allclose(itml.score_pairs(pairs),
+                             itml.score_pairs(X[pairs]))
+  cloned = clone(nca)
+  assert cloned.preprocessor.stats()['n_points'] == 0
+  unpickled = pickle.loads(pickle.dumps(nca))
+  np.testing.assert_allclose(unpickled.transform(indices),
+                             nca.transform(indices))
+
+
+def test_cached_preprocessor_threads():
+  """Checks that a cached preprocessor can be called from several
+  threads"""
+  X = RNG.randn(100, 3)
+  preprocessor = CachedPreprocessor(CountingPreprocessor(X),
+                                    max_bytes=20 * X[0].nbytes)
+  errors = []
+
+  def work(seed):
+    rng = check_random_state(seed)
+    try:
+      for _ in range(50):
+        indices = rng.randint(len(X), size=5)
+        assert_array_equal(preprocessor(indices), X[indices])
+    except Exception as e:
+      errors.append(e)
+
+  threads = [threading.Thread(target=work, args=(seed,))
+             for seed in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert not errors
+  stats = preprocessor.stats()
+  assert stats['n_hits'] + stats['n_misses'] == 4 * 50 * 5
+  assert stats['nbytes'] <= 20 * X[0].nbytes
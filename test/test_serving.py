@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from sklearn.datasets import make_classification
+
+asyncio = pytest.importorskip('asyncio')
+
+from metric_learn import NCA  # noqa: E402
+from metric_learn.serving import MicroBatcher, serve_unix  # noqa: E402
+
+
+@pytest.fixture
+def fitted_nca():
+  X, y = make_classification(n_samples=100, n_features=5, random_state=42)
+  return NCA(max_iter=5).fit(X, y), X
+
+
+@pytest.fixture
+def loop():
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  yield loop
+  asyncio.set_event_loop(None)
+  loop.close()
+
+
+def test_micro_batcher_batches_requests(fitted_nca, loop):
+  """Tests that concurrent requests are computed in batches, with the same
+  results as separate calls"""
+  nca, X = fitted_nca
+  nca.build_index(X)
+  batcher = MicroBatcher(nca, max_batch_size=8, max_latency=10., loop=loop)
+  pairs = [batcher.score_pairs([[X[i], X[i + 1]]]) for i in range(8)]
+  transforms = [batcher.transform(X[i:i + 2]) for i in range(3)]
+  neighbors = [batcher.kneighbors(X[i:i + 1], n_neighbors=3)
+               for i in range(2)]
+  assert batcher.stats()['queue_depth'] == 5
+  # the pairs reached max_batch_size, the other batches wait for the
+  # latency unless flushed
+  batcher._flush(('transform',))
+  batcher._flush(('kneighbors', ('n_neighbors', 3),
+                  ('return_distance', True)))
+  results = loop.run_until_complete(asyncio.gather(*(pairs + transforms +
+                                                     neighbors)))
+  for i, scores in enumerate(results[:8]):
+    assert_allclose(scores, nca.score_pairs([[X[i], X[i + 1]]]))
+  for i, X_embedded in enumerate(results[8:11]):
+    assert_allclose(X_embedded, nca.transform(X[i:i + 2]))
+  for i, (dist, ind) in enumerate(results[11:]):
+    expected_dist, expected_ind = nca.kneighbors(X[i:i + 1], n_neighbors=3)
+    assert_allclose(dist, expected_dist, atol=1e-7)
+    assert_array_equal(ind, expected_ind)
+  stats = batcher.stats()
+  assert stats['n_requests'] == 13
+  assert stats['n_batches'] == 3
+  assert stats['largest_batch_size'] == 8
+  assert stats['mean_batch_size'] == pytest.approx(16 / 3)
+  assert stats['queue_depth'] == 0
+  assert stats['max_queue_depth'] == 8  # (the 8 pairs, before their batch)
+
+
+def test_micro_batcher_latency_and_errors(fitted_nca, loop):
+  """Tests that batches are computed after max_latency, and that invalid
+  requests do not fail the valid ones of their batch"""
+  nca, X = fitted_nca
+  batcher = MicroBatcher(nca, max_latency=0.01)
+  valid = batcher.transform(X[:3])
+  invalid = batcher.transform(X[:3, :2])
+  loop.run_until_complete(asyncio.wait([valid, invalid]))
+  assert_allclose(valid.result(), nca.transform(X[:3]))
+  with pytest.raises(ValueError):
+    invalid.result()
+  assert batcher.stats()['n_batches'] == 1
+
+
+def test_micro_batcher_cancelled_request(fitted_nca, loop):
+  """Tests that the other requests of a batch get their own rows when a
+  request of the batch has been cancelled"""
+  nca, X = fitted_nca
+  batcher = MicroBatcher(nca, max_latency=10., loop=loop)
+  cancelled = batcher.transform(X[:3])
+  second = batcher.transform(X[3:5])
+  third = batcher.transform(X[5:6])
+  cancelled.cancel()
+  batcher._flush(('transform',))
+  loop.run_until_complete(asyncio.wait([second, third]))
+  assert cancelled.cancelled()
+  assert_allclose(second.result(), nca.transform(X[3:5]))
+  assert_allclose(third.result(), nca.transform(X[5:6]))
+
+
+def test_serve_unix(fitted_nca, loop):
+  """Tests that the Unix socket server answers JSON requests"""
+  nca, X = fitted_nca
+  batcher = MicroBatcher(nca, max_latency=0.01, loop=loop)
+  path = os.path.join(tempfile.mkdtemp(), 'metric.sock')
+  server = loop.run_until_complete(serve_unix(batcher, path))
+  try:
+    reader, writer = loop.run_until_complete(
+        asyncio.open_unix_connection(path))
+    requests = [{'id': 0, 'method': 'score_pairs',
+                 'inputs': [[X[0].tolist(), X[1].tolist()]]},
+                {'id': 1, 'method': 'transform', 'inputs': X[:2].tolist()},
+                {'id': 2, 'method': 'unknown', 'inputs': []}]
+    writer.write(b''.join(json.dumps(request).encode('utf-8') + b'\n'
+                          for request in requests))
+    responses = {}
+    for _ in requests:
+      response = json.loads(loop.run_until_complete(reader.readline())
+                            .decode('utf-8'))
+      responses[response['id']] = response
+    assert_allclose(responses[0]['result'],
+                    nca.score_pairs([[X[0], X[1]]]))
+    assert_allclose(responses[1]['result'], nca.transform(X[:2]))
+    assert responses[2]['error'].startswith('ValueError')
+    writer.write(b'{"id": 3, "method": "stats"}\n')
+    response = json.loads(loop.run_until_complete(reader.readline())
+                          .decode('utf-8'))
+    assert response['result']['n_requests'] == 2
+    writer.close()
+  finally:
+    server.close()
+    loop.run_until_complete(server.wait_closed())
@@ -9,7 +9,8 @@ from sklearn.utils.testing import set_random_state
 from sklearn.base import clone
 from metric_learn._util import (check_input, make_context, preprocess_tuples,
                                 make_name, preprocess_points,
-                                check_collapsed_pairs, validate_vector)
+                                check_collapsed_pairs, validate_vector,
+                                check_tuples_unique)
 from metric_learn import (ITML, LSML, MMC, RCA, SDML, Covariance, LFDA,
                           LMNN, MLKR, NCA, ITML_Supervised, LSML_Supervised,
                           MMC_Supervised, RCA_Supervised, SDML_Supervised,
@@ -824,10 +825,59 @@ def test_array_like_indexer_array_like_valid_tuples(input_data, indices):
   mock_algo._prepare_inputs(indices, type_of_inputs='tuples')
 
 
+def test_array_indexer_memmap(tmpdir):
+  """Checks that the path of a .npy file is memory-mapped by the
+  `ArrayIndexer`, and that the points gathered from a memory-mapped array
+  are in-memory copies of the rows at the indices, in their order"""
+  X = RNG.randn(10, 3)
+  path = str(tmpdir.join('X.npy'))
+  np.save(path, X)
+  indexer = ArrayIndexer(path)
+  assert isinstance(indexer.X, np.memmap)
+  assert ArrayIndexer(indexer.X).X is indexer.X
+  for indices in [[7, 2, 7, 0], [[3, 1], [1, 9], [3, 3]], X[:, 0] > 0]:
+    points = indexer(indices)
+    assert type(points) is np.ndarray
+    assert_array_equal(points, X[np.asarray(indices)])
+
+
+def test_array_indexer_ndarray_subclass():
+  """Checks that subclasses of numpy arrays other than memory-maps, like
+  `numpy.matrix`, are converted to numpy arrays, so that the points
+  gathered have the right shape"""
+  X = RNG.randn(10, 3)
+  indexer = ArrayIndexer(np.matrix(X))
+  assert type(indexer.X) is np.ndarray
+  assert_array_equal(indexer.X, X)
+  indices = np.array([[3, 1], [1, 9]])
+  points = indexer(indices)
+  assert points.shape == (2, 2, 3)
+  assert_array_equal(points, X[indices])
+  assert check_input([[3, 1], [1, 9]], type_of_inputs='tuples',
+                     preprocessor=indexer).shape == (2, 2, 3)
+
+
+def test_memmap_preprocessor_checks_gathered_rows(tmpdir):
+  """Checks that a metric learner with a memory-mapped preprocessor gives
+  the same results as with the in-memory array, and only checks the rows it
+  gathers"""
+  X, y = load_iris(return_X_y=True)
+  X = np.concatenate([X, [[np.nan] * X.shape[1]]])
+  path = str(tmpdir.join('X.npy'))
+  np.save(path, X)
+  indices = np.arange(len(y))
+  nca = NCA(preprocessor=path, max_iter=5).fit(indices, y)
+  nca_in_memory = NCA(preprocessor=X, max_iter=5).fit(indices, y)
+  np.testing.assert_allclose(nca.transform(indices[::-1]),
+                             nca_in_memory.transform(indices[::-1]))
+  with pytest.raises(ValueError):
+    nca.transform([0, len(X) - 1])
+
+
 @pytest.mark.parametrize('preprocessor', [4, NCA()])
 def test_error_message_check_preprocessor(preprocessor):
-  """Checks that if the preprocessor given is not an array-like or a
-  callable, the right error message is returned"""
+  """Checks that if the preprocessor given is not an array-like, a path or
+  a callable, the right error message is returned"""
   class MockMetricLearner(MahalanobisMixin):
     pass
 
@@ -836,7 +886,8 @@ def test_error_message_check_preprocessor(preprocessor):
     mock_algo.check_preprocessor()
   assert str(e.value) == ("Invalid type for the preprocessor: {}. You should "
                           "provide either None, an array-like object, "
-                          "or a callable.".format(type(preprocessor)))
+                          "the path of a .npy file, or a callable."
+                          .format(type(preprocessor)))
 
 
 @pytest.mark.parametrize('estimator', [ITML(), LSML(), MMC(), SDML()],
@@ -1040,3 +1091,80 @@ def test__validate_vector():
   x = [[1, 2], [3, 4]]
   with pytest.raises(ValueError):
     validate_vector(x)
+
+
+class CountingPreprocessor:
+  """Preprocessor that records the indicators it is called on"""
+
+  def __init__(self, X):
+    self.X = X
+    self.calls = []
+
+  def __call__(self, indices):
+    self.calls.append(np.asarray(indices))
+    return self.X[indices]
+
+
+def test_preprocess_tuples_unique_calls():
+  """Tests that the preprocessor is called only once, on the distinct
+  indicators of the tuples"""
+  X = RNG.randn(10, 3)
+  tuples = np.array([[1, 2], [2, 3], [1, 3], [3, 1]])
+  preprocessor = CountingPreprocessor(X)
+  assert_array_equal(preprocess_tuples(tuples, preprocessor), X[tuples])
+  assert len(preprocessor.calls) == 1
+  assert_array_equal(preprocessor.calls[0], [1, 2, 3])
+
+
+def test_check_tuples_unique():
+  """Tests that check_tuples_unique returns the distinct formed points and
+  the positions of every element of the tuples among them"""
+  X = RNG.randn(10, 3)
+  tuples = np.array([[1, 2], [2, 3], [1, 3], [3, 1]])
+  preprocessor = CountingPreprocessor(X)
+  points, inverse = check_tuples_unique(tuples, preprocessor=preprocessor,
+                                        tuple_size=2)
+  assert points.shape == (3, 3)
+  assert_array_equal(points[inverse], X[tuples])
+  assert len(preprocessor.calls) == 1
+
+  # formed tuples are just checked
+  points, inverse = check_tuples_unique(X[tuples], tuple_size=2)
+  assert_array_equal(points, X[tuples])
+  assert inverse is None
+
+
+@pytest.mark.parametrize('estimator', [ITML(), LSML(), MMC(), SDML()],
+                         ids=['ITML', 'LSML', 'MMC', 'SDML'])
+def test_check_tuples_unique_error_message(estimator):
+  """Tests that invalid indicators of tuples raise the same error as with
+  check_input"""
+  invalid_tuples = np.array([[0, 1, 2], [1, 2, 0]])
+  with pytest.raises(ValueError) as raised_err:
+    check_tuples_unique(invalid_tuples, preprocessor=ArrayIndexer(X),
+                        tuple_size=2, estimator=estimator)
+  with pytest.raises(ValueError) as expected_err:
+    check_input(invalid_tuples, type_of_inputs='tuples',
+                preprocessor=ArrayIndexer(X), tuple_size=2,
+                estimator=estimator)
+  assert str(raised_err.value) == str(expected_err.value)
+
+
+@pytest.mark.parametrize('estimator, build_dataset', tuples_learners,
+                         ids=ids_tuples_learners)
+def test_score_pairs_unique_points(estimator, build_dataset):
+  """Tests that scoring pairs of indicators where points appear in several
+  pairs calls the preprocessor once and gives the same scores as formed
+  pairs"""
+  input_data, labels, X, _ = build_dataset(with_preprocessor=True)
+  pairs = np.array([[0, 1], [1, 2], [0, 2], [2, 0], [1, 0]])
+  preprocessor = CountingPreprocessor(X)
+  estimator = clone(estimator)
+  set_random_state(estimator)
+  estimator.set_params(preprocessor=preprocessor)
+  estimator.fit(input_data, labels)
+  preprocessor.calls = []
+  scores = estimator.score_pairs(pairs)
+  assert len(preprocessor.calls) == 1
+  assert_array_equal(preprocessor.calls[0], [0, 1, 2])
+  np.testing.assert_allclose(scores, estimator.score_pairs(X[pairs]))